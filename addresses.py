@@ -0,0 +1,272 @@
+'''Deduplicated pick-up and drop-off addresses.
+
+Every reservation's PU_* and DO_* parts are normalized (spacing, case,
+street suffixes, state names, ZIP+4, country) and hashed into a key, and
+the reservation points at the one `addresses` row with that key through
+PU_address_id / DO_address_id. Customers who ride from home to the airport
+every week share two rows instead of repeating the text, and per-city or
+per-zip reports are index lookups on addresses joined to reservations.
+Reservations keep only the search-box line (PU_address / DO_address);
+Reservation.PU_street, DO_city, ... read and write the address rows.
+
+Normalizing is memoized in an LRU cache of ADDRESS_CACHE_SIZE entries,
+since the same few addresses come back over and over. The ids are set by
+the mapper events below on every ORM insert or update, in batches by
+link_records() for the bulk import and the repeating bookings, and by
+the backfill for reservations made before the address store:
+
+    python addresses.py [batch_size]
+
+then migrations/0010_drop_address_text.sql drops the old text columns.'''
+
+import hashlib
+import os
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlalchemy import bindparam, column, event, func, select, table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Address, Reservation, ADDRESS_PARTS, new_addresses
+
+ADDRESS_CACHE_SIZE = int(os.environ.get('ADDRESS_CACHE_SIZE', 4096))
+BACKFILL_BATCH_SIZE = int(os.environ.get('ADDRESS_BACKFILL_BATCH_SIZE', 1000))
+
+# we only drive in the US, an address without a country is a US one
+DEFAULT_COUNTRY = 'US'
+
+PARTS = ADDRESS_PARTS
+
+NormalizedAddress = namedtuple('NormalizedAddress', PARTS + ('key',))
+
+STREET_WORDS = {
+    'street': 'St', 'avenue': 'Ave', 'road': 'Rd', 'boulevard': 'Blvd', 'drive': 'Dr',
+    'lane': 'Ln', 'court': 'Ct', 'place': 'Pl', 'parkway': 'Pkwy', 'highway': 'Hwy',
+    'terrace': 'Ter', 'circle': 'Cir', 'square': 'Sq', 'suite': 'Ste', 'apartment': 'Apt',
+    'north': 'N', 'south': 'S', 'east': 'E', 'west': 'W',
+}
+
+STATES = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR', 'california': 'CA',
+    'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE', 'district of columbia': 'DC',
+    'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI', 'idaho': 'ID', 'illinois': 'IL',
+    'indiana': 'IN', 'iowa': 'IA', 'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA',
+    'maine': 'ME', 'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
+    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE', 'nevada': 'NV',
+    'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM', 'new york': 'NY',
+    'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH', 'oklahoma': 'OK', 'oregon': 'OR',
+    'pennsylvania': 'PA', 'rhode island': 'RI', 'south carolina': 'SC', 'south dakota': 'SD',
+    'tennessee': 'TN', 'texas': 'TX', 'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA',
+    'washington': 'WA', 'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY',
+}
+
+COUNTRIES = {'us': 'US', 'usa': 'US', 'u s': 'US', 'u s a': 'US', 'united states': 'US',
+             'united states of america': 'US'}
+
+WORD_RE = re.compile(r"[\w#'/-]+")
+
+
+def words(value):
+    return WORD_RE.findall((value or '').lower())
+
+
+def title(word):
+    return word[:1].upper() + word[1:]
+
+
+def normalize_city(value):
+    return ' '.join(title(word) for word in words(value))
+
+
+def normalize_zip(value):
+    value = (value or '').strip().upper()
+    digits = re.sub(r'\D', '', value)
+    if len(digits) in (5, 9) and len(digits) >= len(value) - 1:
+        # 94103-1234 and 94103 are the same place
+        return digits[:5]
+    return value
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def normalize_address(street, city, state, zip_code, country):
+    '''The canonical form and key of an address, None when there is no
+    street and no city to go on.'''
+
+    street = ' '.join(STREET_WORDS.get(word, title(word)) for word in words(street))
+    city = normalize_city(city)
+    if not street and not city:
+        return None
+
+    state = ' '.join(words(state))
+    state = STATES.get(state, state.upper())
+
+    country = ' '.join(words(country))
+    country = COUNTRIES.get(country, country.upper()) or DEFAULT_COUNTRY
+
+    parts = (street, city, state, normalize_zip(zip_code), country)
+    key = hashlib.sha1('|'.join(parts).lower().encode()).hexdigest()
+    return NormalizedAddress(*parts, key)
+
+
+def reservation_parts(values, prefix):
+    '''(street, city, state, zip, country) of the PU or DO address of a
+    Reservation or of a dict of reservation columns.'''
+
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    return tuple(get(f'{prefix}_{part}') for part in PARTS)
+
+
+def insert_missing(connection):
+    table = Address.__table__
+    if connection.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=['key'])
+    if connection.dialect.name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=['key'])
+    return table.insert()
+
+
+def address_ids(connection, parts_list):
+    '''The addresses row id for each (street, city, state, zip, country),
+    adding the rows that do not exist yet. One SELECT for the whole list,
+    plus one INSERT and one SELECT if some are new.'''
+
+    normalized = [normalize_address(*parts) for parts in parts_list]
+    wanted = {address.key: address for address in normalized if address is not None}
+    if not wanted:
+        return [None] * len(normalized)
+
+    table = Address.__table__
+    found = dict(connection.execute(
+        select(table.c.key, table.c.id).where(table.c.key.in_(list(wanted)))).all())
+
+    missing = [address for key, address in wanted.items() if key not in found]
+    if missing:
+        connection.execute(insert_missing(connection), [address._asdict() for address in missing])
+        found.update(connection.execute(
+            select(table.c.key, table.c.id)
+            .where(table.c.key.in_([address.key for address in missing]))).all())
+
+    return [None if address is None else found[address.key] for address in normalized]
+
+
+ADDRESS_COLUMNS = {prefix: [f'{prefix}_{part}' for part in PARTS] for prefix in ('PU', 'DO')}
+
+
+def link_records(connection, records):
+    '''Set PU_address_id and DO_address_id of reservation rows (dicts of
+    columns, for a Core insert) from their PU_* / DO_* parts, which are
+    taken out. One address_ids() call for all of them.'''
+
+    ids = address_ids(connection, [reservation_parts(record, prefix)
+                                   for prefix in ('PU', 'DO') for record in records])
+    for record, pu_id, do_id in zip(records, ids[:len(records)], ids[len(records):]):
+        for name in ADDRESS_COLUMNS['PU'] + ADDRESS_COLUMNS['DO']:
+            record.pop(name, None)
+        record.update(PU_address_id=pu_id, DO_address_id=do_id)
+
+
+@event.listens_for(Reservation, 'before_insert')
+@event.listens_for(Reservation, 'before_update')
+def _link_addresses(mapper, connection, res):
+    pending = new_addresses(res)
+    if not pending:
+        return
+    # both addresses in one address_ids() call, one lookup per reservation
+    prefixes = list(pending)
+    ids = address_ids(connection, [tuple(pending[prefix][part] for part in PARTS) for prefix in prefixes])
+    for prefix, address_id in zip(prefixes, ids):
+        setattr(res, f'{prefix}_address_id', address_id)
+    object_session(res).info.setdefault('linked_reservations', []).append(res)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _load_linked_addresses(session, flush_context):
+    '''Once the new ids are written, read the parts from the address rows.'''
+
+    for res in session.info.pop('linked_reservations', ()):
+        new_addresses(res).clear()
+        session.expire(res, ['pickup', 'dropoff'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_linked(session):
+    # the parts stay pending, the next flush links them again
+    session.info.pop('linked_reservations', None)
+
+
+#############################################################################
+# Reports
+
+def pickups_in(city=None, zip_code=None):
+    '''Query for reservations picked up in `city` and/or `zip_code`.'''
+
+    query = Reservation.query.join(Reservation.pickup)
+    if city:
+        query = query.filter(Address.city == normalize_city(city))
+    if zip_code:
+        query = query.filter(Address.zip == normalize_zip(zip_code))
+    return query
+
+
+def pickup_counts(by='city'):
+    '''[(city or zip, number of reservations)], busiest first.'''
+
+    column = Address.zip if by == 'zip' else Address.city
+    return (db.session.query(column, func.count(Reservation.id))
+            .join(Reservation, Reservation.PU_address_id == Address.id)
+            .group_by(column)
+            .order_by(func.count(Reservation.id).desc())
+            .all())
+
+
+#############################################################################
+# Backfill
+
+# reservations as they were before the address store, with the text columns
+# migrations/0010_drop_address_text.sql drops once the backfill is done
+LEGACY_RESERVATIONS = table('reservations', column('id'), column('PU_address_id'), column('DO_address_id'),
+                            *[column(f'{prefix}_{part}') for prefix in ('PU', 'DO') for part in PARTS])
+
+def backfill(batch_size=BACKFILL_BATCH_SIZE, log=print):
+    '''Link every reservation that has no address ids yet, in batches of
+    `batch_size` reservations, one transaction each. Returns how many
+    reservations were looked at.'''
+
+    table = LEGACY_RESERVATIONS
+    columns = [table.c.id] + [table.c[name] for prefix in ('PU', 'DO') for name in ADDRESS_COLUMNS[prefix]]
+    update = (table.update()
+              .where(table.c.id == bindparam('res_id'))
+              .values(PU_address_id=bindparam('pu_id'), DO_address_id=bindparam('do_id')))
+
+    last_id = 0
+    done = 0
+    while True:
+        rows = db.session.execute(
+            select(*columns)
+            .where(table.c.id > last_id)
+            .where((table.c.PU_address_id == None) | (table.c.DO_address_id == None))
+            .order_by(table.c.id)
+            .limit(batch_size)).all()
+        if not rows:
+            return done
+
+        connection = db.session.connection()
+        pickups = address_ids(connection, [tuple(row[1:6]) for row in rows])
+        dropoffs = address_ids(connection, [tuple(row[6:11]) for row in rows])
+        connection.execute(update, [dict(res_id=row[0], pu_id=pu_id, do_id=do_id)
+                                    for row, pu_id, do_id in zip(rows, pickups, dropoffs)])
+        db.session.commit()
+
+        last_id = rows[-1][0]
+        done += len(rows)
+        log(f'{done} reservations linked, up to id {last_id}')
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        backfill(int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_BATCH_SIZE)
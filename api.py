@@ -0,0 +1,304 @@
+'''Versioned JSON API for reservations and users, mounted at /api/v1.
+
+Authentication is the same session cookie as the web pages: customers
+see their own reservations and profile, admins see everything.
+
+    GET /api/v1/reservations          ?fields=&after=&per_page=
+                                      customers: &scope=upcoming|past
+                                      admins: &start=&end=&sort=&dir=
+    GET /api/v1/reservations/<id>     ?fields=
+    GET /api/v1/users                 ?fields=&after=&per_page=   (admins)
+    GET /api/v1/users/<id>            ?fields=
+    GET /api/v1/pool                  database connection pool of this worker (admins)
+
+`fields` is a comma separated sparse fieldset, only those columns are
+loaded and returned (`id` always is). A reservation's address parts
+(PU_street, DO_city, ...) come from its address rows, joined in the same
+query when asked for. Rows are turned into JSON through a
+column -> field mapping built once at import, not by inspecting models
+per request.
+
+Every response carries a strong ETag built from the rows' id and
+updated_at, so a client sending it back in If-None-Match gets an empty
+304 Not Modified until something it would see has changed, without the
+payload being serialized again.'''
+
+import hashlib
+from datetime import date, time, datetime
+from functools import lru_cache
+from operator import attrgetter
+
+from flask import Blueprint, g, jsonify, make_response, request
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, Unauthorized
+
+from models import db, User, Reservation, ADDRESS_PARTS
+from db_pool import pool_status
+from query_budget import query_budget
+from pagination import get_per_page, keyset_page, decode_cursor
+
+API_VERSION = 'v1'
+
+api = Blueprint('api', __name__, url_prefix=f'/api/{API_VERSION}')
+
+# columns never sent out
+HIDDEN_FIELDS = {
+    User: ('password',),
+    Reservation: (),
+}
+
+
+def to_json_value(column):
+    '''Converter for one column's values, picked once from the column type.'''
+
+    python_type = column.type.python_type
+    if python_type in (datetime, date, time):
+        return lambda value: None if value is None else value.isoformat()
+    return None
+
+
+# fields read from a related row: field name -> relationship, loaded in the same query
+RELATED_FIELDS = {
+    User: {},
+    Reservation: {f'{prefix}_{part}': relationship
+                  for prefix, relationship in (('PU', Reservation.pickup), ('DO', Reservation.dropoff))
+                  for part in ADDRESS_PARTS},
+}
+
+
+def field_map(model):
+    '''field name -> (attribute, converter or None) for every visible column of `model`
+    and its RELATED_FIELDS.'''
+
+    hidden = HIDDEN_FIELDS[model]
+    fields = {
+        attr.key: (attr.key, to_json_value(attr.columns[0]))
+        for attr in db.inspect(model).column_attrs
+        if attr.key not in hidden
+    }
+    fields.update((name, (name, None)) for name in RELATED_FIELDS[model])
+    return fields
+
+
+FIELDS = {model: field_map(model) for model in (User, Reservation)}
+
+# used for ETags and pagination, so loaded even when not asked for
+ALWAYS_LOADED = {
+    User: ('id', 'updated_at'),
+    Reservation: ('id', 'updated_at', 'PU_date', 'PU_time', 'created_date', 'user_id'),
+}
+
+
+@lru_cache(maxsize=256)
+def serializer(model, fields):
+    '''A function turning one row of `model` into a dict of `fields`.'''
+
+    mapping = FIELDS[model]
+    getter = attrgetter(*[mapping[name][0] for name in fields])
+    converters = [mapping[name][1] for name in fields]
+
+    if len(fields) == 1:
+        name, convert = fields[0], converters[0]
+        return lambda row: {name: convert(getter(row)) if convert else getter(row)}
+
+    def serialize(row):
+        return {
+            name: convert(value) if convert else value
+            for name, convert, value in zip(fields, converters, getter(row))
+        }
+
+    return serialize
+
+
+def requested_fields(model):
+    '''The ?fields= sparse fieldset as a tuple, every visible field if not given.'''
+
+    value = request.args.get('fields')
+    if not value:
+        return tuple(FIELDS[model])
+
+    fields = ['id']
+    for name in value.split(','):
+        name = name.strip()
+        if name not in FIELDS[model]:
+            raise BadRequest(f'unknown field: {name}')
+        if name not in fields:
+            fields.append(name)
+    return tuple(fields)
+
+
+def load_only(model, fields):
+    '''Query options loading the columns of `fields` and the rows of their RELATED_FIELDS.'''
+
+    related = RELATED_FIELDS[model]
+    names = (set(fields) | set(ALWAYS_LOADED[model])) - set(related)
+    relationships = {related[name] for name in fields if name in related}
+    # the foreign keys too, or the joined rows could not be matched up
+    names |= {column.key for relationship in relationships for column in relationship.property.local_columns}
+    return (db.load_only(*[getattr(model, name) for name in names]),
+            *[db.joinedload(relationship) for relationship in relationships])
+
+
+def make_etag(rows, *extra):
+    '''Strong ETag for `rows` plus whatever else shapes the body (fields,
+    next cursor): changes when a row is added, removed or updated.'''
+
+    digest = hashlib.sha1(API_VERSION.encode())
+    for part in extra:
+        digest.update(f'|{part}'.encode())
+    for row in rows:
+        digest.update(f'|{row.id}:{row.updated_at.isoformat()}'.encode())
+    return digest.hexdigest()
+
+
+def conditional(etag, build, last_modified=None):
+    '''304 if the client already has `etag`, otherwise the JSON from build().'''
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build())
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # the body depends on who is logged in, and must be revalidated every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def require_login():
+    if g.user is None and g.admin is None:
+        raise Unauthorized()
+
+
+# 401 and 404 are named so they win over the app's HTML handlers for those codes
+@api.errorhandler(401)
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def api_error(e):
+    '''Errors as JSON instead of the HTML error pages.'''
+    return jsonify({"error": e.name, "message": e.description}), e.code
+
+
+#############################################################################
+# Reservations
+
+@api.route('/reservations')
+@query_budget(1)
+def list_reservations(db_session=None):
+    '''Customers get their upcoming or past trips, admins the dispatch board.
+    `db_session` is for asgi.py, db.session otherwise.'''
+
+    require_login()
+    fields = requested_fields(Reservation)
+    per_page = get_per_page(request.args.get('per_page'))
+    after = request.args.get('after')
+    options = load_only(Reservation, fields)
+
+    if g.admin is not None:
+        rows, next_cursor = Reservation.dispatch_board(
+            start=request.args.get('start', type=date.fromisoformat),
+            end=request.args.get('end', type=date.fromisoformat),
+            sort=request.args.get('sort', 'pickup'),
+            descending=request.args.get('dir') == 'desc',
+            cursor=after, per_page=per_page, options=options, session=db_session)
+    else:
+        upcoming = request.args.get('scope', 'upcoming') != 'past'
+        rows, next_cursor = Reservation.user_trips(
+            g.user.id, upcoming=upcoming, cursor=after, per_page=per_page, options=options,
+            session=db_session)
+
+    etag = make_etag(rows, ','.join(fields), next_cursor)
+    serialize = serializer(Reservation, fields)
+    return conditional(etag, lambda: {
+        "reservations": [serialize(row) for row in rows],
+        "next": next_cursor,
+    })
+
+
+@api.route('/reservations/<int:res_id>')
+@query_budget(1)
+def get_reservation(res_id, db_session=None):
+
+    require_login()
+    fields = requested_fields(Reservation)
+
+    res = ((db_session or db.session).query(Reservation)
+           .options(*load_only(Reservation, fields))
+           .filter(Reservation.id == res_id)
+           .first())
+    if res is None:
+        raise NotFound()
+    if g.admin is None and res.user_id != g.user.id:
+        raise Unauthorized()
+
+    etag = make_etag([res], ','.join(fields))
+    return conditional(etag, lambda: {"reservation": serializer(Reservation, fields)(res)},
+                       last_modified=res.updated_at)
+
+
+#############################################################################
+# Users
+
+@api.route('/users')
+@query_budget(1)
+def list_users(db_session=None):
+    '''Every user, by id, admins only.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    fields = requested_fields(User)
+    rows, next_cursor = keyset_page(
+        (db_session or db.session).query(User).options(*load_only(User, fields)),
+        (User.id,),
+        cursor=decode_cursor(request.args.get('after'), (int,)),
+        per_page=get_per_page(request.args.get('per_page')),
+    )
+
+    etag = make_etag(rows, ','.join(fields), next_cursor)
+    serialize = serializer(User, fields)
+    return conditional(etag, lambda: {
+        "users": [serialize(row) for row in rows],
+        "next": next_cursor,
+    })
+
+
+@api.route('/users/<int:user_id>')
+@query_budget(1)
+def get_user(user_id, db_session=None):
+
+    require_login()
+    if g.admin is None and g.user.id != user_id:
+        raise Unauthorized()
+
+    fields = requested_fields(User)
+    user = ((db_session or db.session).query(User)
+            .options(*load_only(User, fields))
+            .filter(User.id == user_id)
+            .first())
+    if user is None:
+        raise NotFound()
+
+    etag = make_etag([user], ','.join(fields))
+    return conditional(etag, lambda: {"user": serializer(User, fields)(user)},
+                       last_modified=user.updated_at)
+
+
+#############################################################################
+# Operations
+
+@api.route('/pool')
+@query_budget(0)
+def get_pool():
+    '''Connections in use and checkout waits of the worker that answers,
+    admins only. Not cached, every call is a fresh reading.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    response = jsonify({"pool": pool_status(db.engine)})
+    response.cache_control.no_store = True
+    return response
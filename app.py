@@ -1,71 +1,194 @@
-from flask import Flask, jsonify, render_template, redirect, flash, session, url_for
-from flask_debugtoolbar import DebugToolbarExtension
-from werkzeug.exceptions import Unauthorized
-from forms import EmailRes, RegisterForm, LoginForm, ResForm, UserEditForm, AdminRegisterForm
-from models import db, connect_db, User, Reservation
+from flask import Flask, Response, jsonify, render_template, redirect, flash, session, url_for, request, g, stream_with_context, current_app
+from werkzeug.exceptions import NotFound, Unauthorized
+from werkzeug.middleware.proxy_fix import ProxyFix
+from forms import EmailRes, RegisterForm, LoginForm, ResForm, UserEditForm, AdminRegisterForm, ImportResForm, RequoteForm, AssignForm, RecurringResForm, RecurringActionForm
+from models import db, connect_db, User, Reservation, RecurringReservation, SmsOutbox, DISPATCH_WINDOW_DAYS
+from pagination import get_per_page, PER_PAGE_CHOICES
 from sqlalchemy import exc
+from sqlalchemy.orm import joinedload, selectinload
 import os
-import smtplib
+from datetime import date, datetime, time, timedelta
+import threading
 from email.message import EmailMessage
-from twilio.rest import Client
-try:
-    from secret import em_user, em_pass, account_sid, auth_token, twilio_number
-except:
-    em_user = os.environ.get("EM_USER")
-    em_pass = os.environ.get("EM_PASS")
-    account_sid = os.environ.get("ACCOUNT_SID")
-    auth_token = os.environ.get("AUTH_TOKEN")
-    twilio_number = os.environ.get("TWILIO_NUMBER")
-
-app = Flask(__name__)
-
-try:
-    uri = os.getenv('DATABASE_URL')
-    uri = uri.replace("postgres://", "postgresql://")
-    app.config['SQLALCHEMY_DATABASE_URI'] = uri
-except:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///book_a_ride'
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-app.debug = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+from functools import partial
+from email_template import render_confirmation
+from availability import checker, ClientRateLimiter, FIELDS, RATE_PER_SECOND, RATE_BURST
+from identity import load_profile, forget_profile
+from fleet import fleet_schedule, reserve
+from search import search_reservations
+from api import api
+from assets import assets
+from metrics import metrics
+from query_budget import query_budget
+from export import export_rows, FORMATS, WRITERS
+from recurrence import start_series, skip_day, stop_series, materialize, describe_rule, next_days
+from bulk_import import import_upload, FIELD_NAMES as IMPORT_FIELDS
+from config import CONFIGS
 
 CURR_USER_KEY = "curr_user"
 CURR_ADMIN_KEY = "curr_admin"
-EMAIL_ADDRESS = em_user
-EMAIL_PASSWORD = em_pass
-ACCOUNT_SID = account_sid
-AUTH_TOKEN = auth_token
-TWILIO_NUMBER = twilio_number
+BOOKING_SMS = "Thank you! Your reservation has been successfully booked!"
+REPEATING_BOOKING_SMS = "Thank you! Your repeating reservation has been successfully booked!"
 
-# for working with the twilio API
-client = Client(ACCOUNT_SID, AUTH_TOKEN)
+FLEET_FULL = 'Sorry, all our vehicles of that type are booked at that time. Please choose another time or vehicle.'
 
-connect_db(app)
+# upcoming days of each repeating booking shown on the dashboard
+REPEAT_PREVIEW_DAYS = 5
+
+
+class Routes:
+    '''The views, error handlers and request hooks below, kept until
+    create_app() adds them to an app. Like a Blueprint, but the endpoints
+    keep their plain names (url_for('admin_home')).'''
+
+    def __init__(self):
+        self.deferred = []
+
+    def route(self, rule, **options):
+        def decorator(view):
+            self.deferred.append(lambda app: app.add_url_rule(rule, view_func=view, **options))
+            return view
+        return decorator
+
+    def errorhandler(self, code):
+        def decorator(handler):
+            self.deferred.append(lambda app: app.register_error_handler(code, handler))
+            return handler
+        return decorator
+
+    def before_request(self, hook):
+        self.deferred.append(lambda app: app.before_request(hook))
+        return hook
+
+    def init_app(self, app):
+        for register in self.deferred:
+            register(app)
+
+
+routes = Routes()
+
+
+def config_class(config=None):
+    '''The config class create_app() uses for `config`.'''
+
+    config = config or os.environ.get('FLASK_CONFIG') or os.environ.get('FLASK_ENV') or 'production'
+    return CONFIGS[config] if isinstance(config, str) else config
+
+
+def create_app(config=None):
+    '''A configured app: `config` is 'production', 'development', 'testing'
+    or a config class, default FLASK_CONFIG (or FLASK_ENV), then production.
+    Integrations (SMTP, the SMS provider, NumPy for quotes and dispatch)
+    are set up on first use, not here.'''
+
+    app = Flask(__name__)
+    app.config.from_object(config_class(config))
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    connect_db(app)
+    # first, so its timer starts before the other before_request hooks
+    app.register_blueprint(metrics)
+    app.register_blueprint(api)
+    app.register_blueprint(assets)
+    routes.init_app(app)
+
+    if app.config['DEBUG_TB_ENABLED']:
+        # development only, the toolbar and its panels are slow to import
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    return app
+
+
+def __getattr__(name):
+    '''`app`, made by create_app() the first time it is asked for, for
+    `gunicorn app:app` and the `from app import app` of the scripts.'''
+
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def record_email_status(app, res_id, status, error=None):
+    '''Called by the mailer threads once a confirmation e-mail was sent or failed.'''
+
+    if res_id is None:
+        return
+
+    with app.app_context():
+        res = Reservation.query.get(res_id)
+        if res is not None:
+            res.email_status = status
+            res.email_error = error
+            db.session.commit()
+
+
+mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    '''The app's background mailer, made on the first e-mail: sends
+    confirmation e-mails over reused SMTP connections.'''
+
+    app = current_app._get_current_object()
+    with mailer_lock:
+        if 'mailer' not in app.extensions:
+            from mailer import SMTPPool, Mailer
+
+            config = app.config
+            app.extensions['mailer'] = Mailer(
+                SMTPPool(config['SMTP_HOST'], config['SMTP_PORT'],
+                         config['EMAIL_ADDRESS'], config['EMAIL_PASSWORD'],
+                         use_ssl=config['SMTP_SSL'], size=config['SMTP_POOL_SIZE']),
+                on_status=partial(record_email_status, app),
+            )
+    return app.extensions['mailer']
+
+
+def parse_date(value):
+    '''Parse a YYYY-MM-DD query arg, returns None if it is missing or invalid.'''
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+# The views that take a `db_session` are also served by asgi.py, which calls
+# them with the sync face of its asyncio session; from Flask it is None and
+# they use db.session.
+
+@routes.before_request
+def load_current_user(db_session=None):
+    '''Resolve the logged in user and/or admin once per request, as g.user and g.admin.'''
+
+    if request.endpoint == 'static':
+        return
+
+    g.user = load_profile(session[CURR_USER_KEY], db_session) if CURR_USER_KEY in session else None
+    g.admin = load_profile(session[CURR_ADMIN_KEY], db_session) if CURR_ADMIN_KEY in session else None
 
 ###########################################################################
 # Homepage and error handling
 
-@app.route('/')
+@routes.route('/')
+@query_budget(0)
 def homepage():
     '''Display User's homepage'''
     return render_template('home.html')
 
-@app.route('/about')
+@routes.route('/about')
+@query_budget(0)
 def about():
     '''Display about us page'''
     return render_template('about.html')
 
-@app.errorhandler(404)
+@routes.errorhandler(404)
 def page_not_found(e):
     '''Page not found (404 error)'''
     return render_template('404.html'), 404
 
-@app.errorhandler(401)
+@routes.errorhandler(401)
 def not_allowed(e):
     '''Show 401 page for not authorized users.'''
     return render_template('401.html'), 401
@@ -76,7 +199,8 @@ def not_allowed(e):
 #################################################################
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@routes.route('/register', methods=['GET', 'POST'])
+@query_budget(2)
 def register_user():
     '''Page to register a new user to create an account.'''
 
@@ -109,7 +233,8 @@ def register_user():
         return render_template('users/register.html', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@routes.route('/login', methods=['GET', 'POST'])
+@query_budget(2)
 def login():
     '''Show the page to login existing users.'''
 
@@ -117,6 +242,10 @@ def login():
 
     if form.validate_on_submit():
         user = User.authenticate(form.username.data, form.password.data)
+
+        if user:
+            # saves the new hash if the password was upgraded to the current work factor
+            db.session.commit()
         
         if user and not user.is_admin:
             session[CURR_USER_KEY] = user.id
@@ -134,7 +263,8 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@routes.route('/logout')
+@query_budget(0)
 def logout():
     '''Handle logout of a user.'''
     session.clear()
@@ -145,35 +275,79 @@ def logout():
 
 
 
+availability_limiter = ClientRateLimiter(RATE_PER_SECOND, RATE_BURST)
+
+def check_available(values, db_session=None):
+    '''Run the availability checker, returns None if the client is over its rate limit.'''
+    if not availability_limiter.allow(request.remote_addr):
+        return None
+    return checker.check(values, db_session)
+
+def too_many_requests():
+    return jsonify({"error": "Too many requests, please slow down."}), 429
+
+############# API to check if a username, email and/or phone number are free ############
+@routes.route('/availability', methods=['GET'])
+@query_budget(3)
+def availability(db_session=None):
+    '''e.g. /availability?username=x&email=y returns {"available": {"username": true, "email": false}}'''
+
+    values = {field: request.args[field] for field in FIELDS if request.args.get(field)}
+    result = check_available(values, db_session)
+    if result is None:
+        return too_many_requests()
+    return jsonify({"available": result})
+
+############# API to quote the distance and fare of a trip ############
+@routes.route('/quote', methods=['GET'])
+@query_budget(0)
+def fare_quote():
+    '''Distance and fare of a trip, for the booking form.'''
+
+    if g.user is None and g.admin is None:
+        raise Unauthorized()
+
+    try:
+        coordinates = [float(request.args[name]) for name in ('pu_lat', 'pu_lng', 'do_lat', 'do_lng')]
+    except (KeyError, ValueError):
+        return jsonify({"miles": None, "fare": None}), 400
+
+    # quotes.py and dispatch.py bring in NumPy, only imported when first used
+    from quotes import quote_trip
+
+    pickup_time = request.args.get('time', type=time.fromisoformat) or datetime.now().time()
+    miles, fare = quote_trip(*coordinates, request.args.get('vehicle_type'), pickup_time)
+    return jsonify({"miles": miles, "fare": fare})
+
 ############# API to check if username already exists in the users database ############
-@app.route('/check/<username>', methods=['GET'])
-def check_user(username):
+@routes.route('/check/<username>', methods=['GET'])
+@query_budget(3)
+def check_user(username, db_session=None):
     
-    user = User.query.filter_by(username=username).first()
-    is_valid = True
-    if user:
-        is_valid = False
-    return jsonify({"exists": is_valid})
+    result = check_available({'username': username}, db_session)
+    if result is None:
+        return too_many_requests()
+    return jsonify({"exists": result['username']})
 
 ############# API to check if phone number already exists in the users database ############
-@app.route('/verify/<phone>', methods=['GET'])
-def check_phone(phone):
+@routes.route('/verify/<phone>', methods=['GET'])
+@query_budget(3)
+def check_phone(phone, db_session=None):
     
-    phone_num = User.query.filter_by(phone=phone).first()
-    is_avail = True
-    if phone_num:
-        is_avail = False
-    return jsonify({"exists": is_avail})
+    result = check_available({'phone': phone}, db_session)
+    if result is None:
+        return too_many_requests()
+    return jsonify({"exists": result['phone']})
 
 ############# API to check if email already exists in the users database ############
-@app.route('/lookup/<email>', methods=['GET'])
-def check_email(email):
+@routes.route('/lookup/<email>', methods=['GET'])
+@query_budget(3)
+def check_email(email, db_session=None):
     
-    ck_email = User.query.filter_by(email=email).first()
-    valid = True
-    if ck_email:
-        valid = False
-    return jsonify({"exists": valid})
+    result = check_available({'email': email}, db_session)
+    if result is None:
+        return too_many_requests()
+    return jsonify({"exists": result['email']})
 
 ################################################################################
 
@@ -181,35 +355,53 @@ def check_email(email):
 #############################################################################
 # User route for user's page / edit profile / reservations
 
-@app.route('/users/<int:id>')
-def user_dashboard(id):
+@routes.route('/users/<int:id>')
+@query_budget(4)
+def user_dashboard(id, db_session=None):
     '''Page for logged in users.'''
-    user = User.query.get_or_404(id)
 
-    if CURR_USER_KEY not in session or session[CURR_USER_KEY] != user.id:
+    if g.user is None or g.user.id != id:
         raise Unauthorized()
 
-    user = User.query.get_or_404(id)
+    user = g.user
+
+    per_page = get_per_page(request.args.get('per_page'))
+    upcoming_after = request.args.get('upcoming_after')
+    past_after = request.args.get('past_after')
 
-    reservations = Reservation.query.all()
+    upcoming, next_upcoming = Reservation.user_trips(user.id, upcoming=True, cursor=upcoming_after,
+                                                     per_page=per_page, session=db_session)
+    past, next_past = Reservation.user_trips(user.id, upcoming=False, cursor=past_after,
+                                             per_page=per_page, session=db_session)
+
+    # each repeating booking with its next few days, expanded from the rule
+    repeating = [(series, describe_rule(series.rule), next_days(series, REPEAT_PREVIEW_DAYS))
+                 for series in ((db_session or db.session).query(RecurringReservation)
+                                .filter_by(user_id=user.id)
+                                .options(selectinload(RecurringReservation.exceptions))
+                                .order_by(RecurringReservation.id))]
     
-    return render_template('users/user_dashboard.html', user=user, reservations=reservations)
+    return render_template('users/user_dashboard.html', user=user,
+                           upcoming=upcoming, next_upcoming=next_upcoming,
+                           past=past, next_past=next_past,
+                           upcoming_after=upcoming_after, past_after=past_after,
+                           per_page=per_page, per_page_choices=PER_PAGE_CHOICES,
+                           repeating=repeating, action_form=RecurringActionForm())
 
 
-@app.route('/users/edit_profile/<int:user_id>', methods=['GET', 'POST'])
+@routes.route('/users/edit_profile/<int:user_id>', methods=['GET', 'POST'])
+@query_budget(3)
 def edit_profile(user_id):
     '''Update a profile from a current user.'''
 
-    user = User.query.get(session[CURR_USER_KEY])
-
-    if CURR_USER_KEY not in session or session[CURR_USER_KEY] != user_id:
+    if g.user is None or g.user.id != user_id:
         raise Unauthorized()
 
-    user_id = user.id
+    user = User.query.get_or_404(user_id)
     form = UserEditForm(obj=user)
 
     if form.validate_on_submit():
-        if User.authenticate(user.username, form.password.data):
+        if user.check_password(form.password.data):
             user.username = form.username.data
             user.email = form.email.data
             user.first_name = form.first_name.data
@@ -217,6 +409,7 @@ def edit_profile(user_id):
             user.phone = form.phone.data
 
             db.session.commit()
+            forget_profile(user.id)
             return redirect(f'/users/{user.id}')
 
         flash('Wrong password, please try again!', 'danger')
@@ -227,37 +420,55 @@ def edit_profile(user_id):
 #############################################################################
 # Reservations routes 
 
-@app.route('/res/res_form', methods=['POST', 'GET'])
+@routes.route('/res/res_form', methods=['POST', 'GET'])
+# 2 more when the capacity check reads the day before and after, 2 for
+# the locked re-check of a repeating booking's horizon
+@query_budget(17)
 def res_form():
     '''Show form to submit a reservation.'''
 
-    if CURR_USER_KEY not in session:
+    if g.user is None:
         raise Unauthorized()
 
-    user = User.query.get(session[CURR_USER_KEY])
+    user = g.user
 
-    form = ResForm()
+    form = RecurringResForm()
 
     if form.validate_on_submit():
-        passenger_name = form.passenger_name.data,
-        passenger_phone = form.passenger_phone.data,
-        passenger_email = form.passenger_email.data,
-        vehicle_type = form.vehicle_type.data,
-        PU_date = form.PU_date.data,
-        PU_time = form.PU_time.data,
-        PU_address = form.PU_address.data,
-        PU_street = form.PU_street.data,
-        PU_city = form.PU_city.data,
-        PU_state = form.PU_state.data,
-        PU_zip = form.PU_zip.data,
-        PU_country = form.PU_country.data,
-        DO_address = form.DO_address.data,
-        DO_street = form.DO_street.data,
-        DO_city = form.DO_city.data,
-        DO_state = form.DO_state.data,
-        DO_zip = form.DO_zip.data,
-        DO_country = form.DO_country.data,
-        trip_notes = form.trip_notes.data,
+        trip = (form.vehicle_type.data, form.PU_date.data, form.PU_time.data)
+        if not fleet_schedule.has_capacity(*trip):
+            flash(FLEET_FULL, 'danger')
+            return render_template('res/res_form.html', form=form, user=user)
+
+        if form.repeat.data:
+            return book_repeating(user, form)
+
+        # the schedule above may be stale; this checks the database and
+        # locks the vehicle type's capacity until the booking commits
+        if not reserve([trip])[0]:
+            db.session.rollback()
+            flash(FLEET_FULL, 'danger')
+            return render_template('res/res_form.html', form=form, user=user)
+
+        passenger_name = form.passenger_name.data
+        passenger_phone = form.passenger_phone.data
+        passenger_email = form.passenger_email.data
+        vehicle_type = form.vehicle_type.data
+        PU_date = form.PU_date.data
+        PU_time = form.PU_time.data
+        PU_address = form.PU_address.data
+        PU_street = form.PU_street.data
+        PU_city = form.PU_city.data
+        PU_state = form.PU_state.data
+        PU_zip = form.PU_zip.data
+        PU_country = form.PU_country.data
+        DO_address = form.DO_address.data
+        DO_street = form.DO_street.data
+        DO_city = form.DO_city.data
+        DO_state = form.DO_state.data
+        DO_zip = form.DO_zip.data
+        DO_country = form.DO_country.data
+        trip_notes = form.trip_notes.data
 
         new_res = Reservation(
             passenger_name = passenger_name,
@@ -279,162 +490,252 @@ def res_form():
             DO_zip = DO_zip,
             DO_country = DO_country,
             trip_notes = trip_notes,
+            user_id = user.id,
         )
 
-        user.reservations.append(new_res)
+        db.session.add(new_res)
+
+        # SMS confirming the booking, committed together with the reservation
+        # and sent by the SMS worker (sms_worker.py).
+        SmsOutbox.queue(to=f'+1{form.passenger_phone.data}', body=BOOKING_SMS, reservation=new_res)
+
         db.session.commit()
+        fleet_schedule.add(form.vehicle_type.data, form.PU_date.data, form.PU_time.data)
         flash('Your reservation has been successfully submitted!', 'success')
 
-        # SMS message using the Twilio API - send a text confirming the booking.
-        SMS_MESSAGE = client.messages.create(
-            body="Thank you! Your reservation has been successfully booked!",
-            from_=TWILIO_NUMBER,
-            to=f'+1{passenger_phone}'
-            )
-        print(SMS_MESSAGE.body)
-
         return redirect(f'/users/{user.id}')
     else:
         return render_template('res/res_form.html', form=form, user=user)
 
 
+def book_repeating(user, form):
+    '''Save a repeating booking from res_form: its first trip now, the
+    rest of the horizon right after.'''
+
+    fields = {name: form[name].data for name in IMPORT_FIELDS}
+    try:
+        series, first = start_series(user.id, fields, form.repeat.data, form.repeat_until.data)
+    except ValueError:
+        db.session.rollback()
+        flash('That repeat has no trips on or after the pick-up date.', 'danger')
+        return render_template('res/res_form.html', form=form, user=user)
+
+    db.session.flush()
+    if not reserve([(first.vehicle_type, first.PU_date, first.PU_time)], exclude_ids=[first.id])[0]:
+        db.session.rollback()
+        flash(FLEET_FULL, 'danger')
+        return render_template('res/res_form.html', form=form, user=user)
+
+    SmsOutbox.queue(to=f'+1{form.passenger_phone.data}', body=REPEATING_BOOKING_SMS, reservation=first)
+    db.session.commit()
+
+    materialize(series_ids=[series.id])
+    fleet_schedule.forget()
+    flash('Your repeating reservation has been successfully submitted!', 'success')
+
+    return redirect(f'/users/{user.id}')
+
+
+@routes.route('/res/recurring/<int:series_id>/skip', methods=['POST'])
+@query_budget(4)
+def skip_recurring(series_id):
+    '''Skip one day of a repeating booking.'''
+
+    series = RecurringReservation.query.get_or_404(series_id)
+    if g.user is None or g.user.id != series.user_id:
+        raise Unauthorized()
+
+    form = RecurringActionForm()
+    if form.validate_on_submit() and form.day.data:
+        skip_day(series, form.day.data)
+        db.session.commit()
+        fleet_schedule.forget()
+        flash(f"The trip on {form.day.data.strftime('%m/%d/%Y')} has been cancelled.", 'success')
+
+    return redirect(f'/users/{g.user.id}')
+
+
+@routes.route('/res/recurring/<int:series_id>/stop', methods=['POST'])
+@query_budget(3)
+def stop_recurring(series_id):
+    '''Stop a repeating booking; trips from tomorrow on are cancelled.'''
+
+    series = RecurringReservation.query.get_or_404(series_id)
+    if g.user is None or g.user.id != series.user_id:
+        raise Unauthorized()
+
+    form = RecurringActionForm()
+    if form.validate_on_submit():
+        stop_series(series, date.today())
+        db.session.commit()
+        fleet_schedule.forget()
+        flash('Your reservation will not repeat anymore.', 'success')
+
+    return redirect(f'/users/{g.user.id}')
+
+
 ################ routes to edit reservations ###########################
-@app.route('/res/edit_res/<int:res_id>')
+# the edit form shows the address parts, load the address rows with the reservation
+WITH_ADDRESSES = (joinedload(Reservation.pickup), joinedload(Reservation.dropoff))
+
+@routes.route('/res/edit_res/<int:res_id>')
+@query_budget(1)
 def show_edit_res(res_id):
     '''Display the form for editing the reservation'''
 
-    res_id = Reservation.query.get_or_404(res_id)
+    res_id = Reservation.query.options(*WITH_ADDRESSES).get_or_404(res_id)
 
-    if CURR_USER_KEY not in session or session[CURR_USER_KEY] != res_id.user_id:
+    if g.user is None or g.user.id != res_id.user_id:
         raise Unauthorized()
 
     form = ResForm(obj=res_id)
     return render_template('/res/edit_res.html', res_id=res_id, form=form)
 
 
-@app.route('/res/edit_res/<int:res_id>', methods=['POST'])
+def moved_trip_fits(res, form):
+    '''Does the edited trip still get a vehicle? Only asked when the edit
+    changes its vehicle type or pickup; the check holds the vehicle type's
+    capacity lock until the edit commits.'''
+
+    trip = (form.vehicle_type.data, form.PU_date.data, form.PU_time.data)
+    if trip == (res.vehicle_type, res.PU_date, res.PU_time):
+        return True
+    if reserve([trip], exclude_ids=[res.id])[0]:
+        return True
+    db.session.rollback()
+    return False
+
+
+@routes.route('/res/edit_res/<int:res_id>', methods=['POST'])
+# 2 of them when the trip moves: the capacity lock and the booked pickups
+@query_budget(7)
 def edit_res(res_id):
     '''Edit a reservation '''
-    user = User.query.get(session[CURR_USER_KEY])
-    res_id = Reservation.query.get_or_404(res_id)
+    user = g.user
+    res_id = Reservation.query.options(*WITH_ADDRESSES).get_or_404(res_id)
     
-    if CURR_USER_KEY not in session or session[CURR_USER_KEY] != res_id.user_id:
+    if user is None or user.id != res_id.user_id:
         raise Unauthorized()
 
     form = ResForm(obj=res_id)
 
     if form.validate_on_submit():
-        res_id.passenger_name = form.passenger_name.data,
-        res_id.passenger_phone = form.passenger_phone.data,
-        res_id.passenger_email = form.passenger_email.data,
-        res_id.vehicle_type = form.vehicle_type.data,
-        res_id.PU_date = form.PU_date.data,
-        res_id.PU_time = form.PU_time.data,
-        res_id.PU_address = form.PU_address.data,
-        res_id.PU_street = form.PU_street.data,
-        res_id.PU_city = form.PU_city.data,
-        res_id.PU_state = form.PU_state.data,
-        res_id.PU_zip = form.PU_zip.data,
-        res_id.PU_country = form.PU_country.data,
-        res_id.DO_address = form.DO_address.data,
-        res_id.DO_street = form.DO_street.data,
-        res_id.DO_city = form.DO_city.data,
-        res_id.DO_state = form.DO_state.data,
-        res_id.DO_zip = form.DO_zip.data,
-        res_id.DO_country = form.DO_country.data,
-        res_id.trip_notes = form.trip_notes.data,
+        if not moved_trip_fits(res_id, form):
+            flash(FLEET_FULL, 'danger')
+            return render_template('/res/edit_res.html', res_id=res_id, form=form)
+
+        res_id.passenger_name = form.passenger_name.data
+        res_id.passenger_phone = form.passenger_phone.data
+        res_id.passenger_email = form.passenger_email.data
+        res_id.vehicle_type = form.vehicle_type.data
+        res_id.PU_date = form.PU_date.data
+        res_id.PU_time = form.PU_time.data
+        res_id.PU_address = form.PU_address.data
+        res_id.PU_street = form.PU_street.data
+        res_id.PU_city = form.PU_city.data
+        res_id.PU_state = form.PU_state.data
+        res_id.PU_zip = form.PU_zip.data
+        res_id.PU_country = form.PU_country.data
+        res_id.DO_address = form.DO_address.data
+        res_id.DO_street = form.DO_street.data
+        res_id.DO_city = form.DO_city.data
+        res_id.DO_state = form.DO_state.data
+        res_id.DO_zip = form.DO_zip.data
+        res_id.DO_country = form.DO_country.data
+        res_id.trip_notes = form.trip_notes.data
 
         db.session.commit()
+        # the pickup slot may have moved, reload the schedule on the next check
+        fleet_schedule.forget()
         flash('Your reservation has been updated.', 'success')
         return redirect(f'/users/{user.id}')
 
 
 
 ################# reservation view route ####################
-@app.route('/res/view/<int:res_id>')
-def view_res(res_id):
+@routes.route('/res/view/<int:res_id>')
+@query_budget(1)
+def view_res(res_id, db_session=None):
     '''display reservation details in HTML'''
 
-    if (CURR_USER_KEY not in session) and (CURR_ADMIN_KEY not in session):
+    if g.user is None and g.admin is None:
         raise Unauthorized()
 
-    res = Reservation.query.get_or_404(res_id)
+    res = ((db_session or db.session).query(Reservation)
+           .options(joinedload(Reservation.user))
+           .filter(Reservation.id == res_id)
+           .first())
+    if res is None:
+        raise NotFound()
     return render_template('/res/view_res.html', res=res)
 
 
 ################ email reservation routes ###################
 
-@app.route('/res/email_res_form/<int:res_id>')
+@routes.route('/res/email_res_form/<int:res_id>')
+@query_budget(1)
 def email_res_form(res_id):
     '''Display a form so a user can email the booking confirmation'''
 
-    if CURR_USER_KEY not in session and CURR_ADMIN_KEY not in session:
+    if g.user is None and g.admin is None:
         raise Unauthorized()
 
-    user = User.query.get(session[CURR_USER_KEY or CURR_ADMIN_KEY])
+    user = g.user or g.admin
     res_id = Reservation.query.get_or_404(res_id)
     form = EmailRes()
     return render_template('/res/email_res.html', user=user, res_id=res_id, form=form)
 
 
-@app.route('/res/email_res_form/<int:res_id>', methods=['POST'])
+@routes.route('/res/email_res_form/<int:res_id>', methods=['POST'])
+@query_budget(3)
 def email_res(res_id):
     '''Display a form so a user can email the booking confirmation'''
 
-    if CURR_USER_KEY not in session and CURR_ADMIN_KEY not in session:
+    if g.user is None and g.admin is None:
         raise Unauthorized()
 
-    user = User.query.get(session[CURR_USER_KEY])
-    res = Reservation.query.get_or_404(res_id)
+    # the confirmation is the customer's, also when an admin sends it
+    res = (Reservation.query
+           .options(joinedload(Reservation.user))
+           .filter(Reservation.id == res_id)
+           .first())
+    if res is None:
+        raise NotFound()
 
     form = EmailRes()
 
-    if form.validate_on_submit:
-        EMAIL_TO = form.email_res.data,
+    if form.validate_on_submit():
+        EMAIL_TO = form.email_res.data
         msg = EmailMessage()
         msg['Subject'] = f'Booking confirmation {res.id}'
-        msg['From'] = EMAIL_ADDRESS
+        msg['From'] = current_app.config['EMAIL_ADDRESS']
         msg['To'] = EMAIL_TO
         msg.set_content('This is a plain text email')
 
-        lines = []
-
-        with open("email.txt") as f:
-            lines = f.readlines()
-          
-        email_string = ' '.join(lines)
-        
-        email_string = email_string.replace('{first_name}', user.first_name)
-        email_string = email_string.replace('{last_name}', user.last_name)
-        email_string = email_string.replace('{phone}', user.phone)
-        email_string = email_string.replace('{conf}', str(res.id))
-        email_string = email_string.replace('{PU_date}', res.PU_date.strftime('%A, %B %d, %Y'))
-        email_string = email_string.replace('{PU_time}', res.PU_time.strftime('%I:%M %p'))
-        email_string = email_string.replace('{passenger_name}', res.passenger_name)
-        email_string = email_string.replace('{passenger_phone}', res.passenger_phone)
-        email_string = email_string.replace('{vehicle_type}', res.vehicle_type)
-        email_string = email_string.replace('{PU_date}', res.PU_date.strftime('%m/%d/%Y'))
-        email_string = email_string.replace('{PU_time}', res.PU_time.strftime('%I:%M %p'))
-        email_string = email_string.replace('{PU_address}', res.PU_address)
-        email_string = email_string.replace('{DO_address}', res.DO_address)
-        email_string = email_string.replace('{trip_notes}', res.trip_notes)
-
-        # print(email_string)
+        email_string = render_confirmation(res.user, res)
 
         msg.add_alternative(email_string, subtype='html')
-        
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
-    
-        return redirect(f'/users/{user.id}')
+
+        res.email_status = 'queued'
+        res.email_error = None
+        db.session.commit()
+
+        get_mailer().send(msg, res.id)
+        flash('Your confirmation e-mail is on its way!', 'success')
+
+        if g.user is None:
+            return redirect('/admin/admin_home')
+        return redirect(f'/users/{g.user.id}')
+
+    return render_template('/res/email_res.html', user=g.user or g.admin, res_id=res, form=form)
 
 
 #################################################################################
 ############## System Administrator routes ##################
 #################################################################################
 
-@app.route('/admin/register_admin', methods=['GET', 'POST'])
+@routes.route('/admin/register_admin', methods=['GET', 'POST'])
+@query_budget(2)
 def register_admin():
     '''Register administrator to the system.'''
 
@@ -471,72 +772,189 @@ def register_admin():
         return render_template('admin/register_admin.html', form=form)
 
 
-@app.route('/admin/admin_home')
-def admin_home():
+@routes.route('/admin/admin_home')
+@query_budget(1)
+def admin_home(db_session=None):
     '''Dispatch view page for admin users.'''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
 
-    reservations = Reservation.query.all()
-    users = User.query.all()
+    start = parse_date(request.args.get('start')) or date.today()
+    end = parse_date(request.args.get('end')) or start + timedelta(days=DISPATCH_WINDOW_DAYS)
+    sort = request.args.get('sort', 'pickup')
+    if sort not in Reservation.dispatch_sort_keys():
+        sort = 'pickup'
+    descending = request.args.get('dir') == 'desc'
+    per_page = get_per_page(request.args.get('per_page'), default=50)
+    cursor = request.args.get('after')
+
+    reservations, next_cursor = Reservation.dispatch_board(start=start, end=end, sort=sort,
+                                                           descending=descending, cursor=cursor,
+                                                           per_page=per_page, session=db_session)
     
-    return render_template('admin/admin_home.html', reservations=reservations, users=users)
+    requote_form = RequoteForm(formdata=None, start=start, end=end)
+    assign_form = AssignForm(formdata=None, day=start)
+    
+    return render_template('admin/admin_home.html', reservations=reservations,
+                           next_cursor=next_cursor, cursor=cursor, start=start, end=end,
+                           sort=sort, descending=descending, per_page=per_page,
+                           per_page_choices=PER_PAGE_CHOICES, requote_form=requote_form,
+                           assign_form=assign_form)
+
+
+@routes.route('/admin/requote', methods=['POST'])
+@query_budget(1)
+def admin_requote():
+    '''Re-price every reservation picking up in the chosen window.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    form = RequoteForm()
+    if not form.validate_on_submit():
+        flash('Choose the pick-up dates to re-quote.', 'danger')
+        return redirect(url_for('admin_home'))
 
+    from quotes import requote
 
-@app.route('/admin/admin_edit_res/<int:res_id>')
+    count = requote(form.start.data, form.end.data)
+    flash(f'{count} reservations have been re-quoted.', 'success')
+
+    return redirect(url_for('admin_home', start=form.start.data.isoformat(), end=form.end.data.isoformat()))
+
+
+@routes.route('/admin/assign', methods=['POST'])
+@query_budget(3)
+def admin_assign():
+    '''Assign drivers to every ride picking up on the chosen day.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    form = AssignForm()
+    if not form.validate_on_submit():
+        flash('Choose the day to assign drivers for.', 'danger')
+        return redirect(url_for('admin_home'))
+
+    from dispatch import assign_drivers
+
+    result = assign_drivers(form.day.data)
+    total = result.assigned + len(result.unassigned)
+    flash(f'{result.assigned} of {total} rides have been assigned a driver.',
+          'success' if not result.unassigned else 'warning')
+
+    day = form.day.data.isoformat()
+    return redirect(url_for('admin_home', start=day, end=day))
+
+
+@routes.route('/admin/search')
+@query_budget(2)
+def admin_search():
+    '''Search reservations by number, passenger, address or city.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    q = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = get_per_page(request.args.get('per_page'), default=25)
+
+    reservations, has_more = search_reservations(q, page=page, per_page=per_page)
+
+    return render_template('admin/search.html', reservations=reservations, q=q,
+                           page=page, per_page=per_page, has_more=has_more)
+
+
+@routes.route('/admin/export')
+# the rows are read while streaming, after the view has returned
+@query_budget(0)
+def admin_export():
+    '''Download reservations as CSV or NDJSON, streamed as they are read.
+    Filters: start, end (pickup date), vehicle_type, user_id.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        fmt = 'csv'
+    mimetype, extension = FORMATS[fmt]
+
+    start = parse_date(request.args.get('start'))
+    end = parse_date(request.args.get('end'))
+    rows = export_rows(start=start, end=end,
+                       vehicle_type=request.args.get('vehicle_type'),
+                       user_id=request.args.get('user_id', type=int))
+
+    filename = f'reservations_{start or "all"}_{end or "all"}.{extension}'
+    return Response(stream_with_context(WRITERS[fmt](rows)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@routes.route('/admin/admin_edit_res/<int:res_id>')
+@query_budget(1)
 def admin_show_edit_res(res_id):
     '''Display the form for editing reservation'''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
 
-    res_id = Reservation.query.get_or_404(res_id)
+    res_id = Reservation.query.options(*WITH_ADDRESSES).get_or_404(res_id)
     form = ResForm(obj=res_id)
     return render_template('/admin/admin_edit_res.html', res_id=res_id, form=form)
 
 
-@app.route('/admin/admin_edit_res/<int:res_id>', methods=['POST'])
+@routes.route('/admin/admin_edit_res/<int:res_id>', methods=['POST'])
+# 2 of them when the trip moves: the capacity lock and the booked pickups
+@query_budget(4)
 def admin_edit_res(res_id):
     '''Edit a reservation '''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
 
-    res_id = Reservation.query.get_or_404(res_id)
+    res_id = Reservation.query.options(*WITH_ADDRESSES).get_or_404(res_id)
     form = ResForm(obj=res_id)
 
     if form.validate_on_submit():
-        res_id.passenger_name = form.passenger_name.data,
-        res_id.passenger_phone = form.passenger_phone.data,
-        res_id.passenger_email = form.passenger_email.data,
-        res_id.vehicle_type = form.vehicle_type.data,
-        res_id.PU_date = form.PU_date.data,
-        res_id.PU_time = form.PU_time.data,
-        res_id.PU_address = form.PU_address.data,
-        res_id.PU_street = form.PU_street.data,
-        res_id.PU_city = form.PU_city.data,
-        res_id.PU_state = form.PU_state.data,
-        res_id.PU_zip = form.PU_zip.data,
-        res_id.PU_country = form.PU_country.data,
-        res_id.DO_address = form.DO_address.data,
-        res_id.DO_street = form.DO_street.data,
-        res_id.DO_city = form.DO_city.data,
-        res_id.DO_state = form.DO_state.data,
-        res_id.DO_zip = form.DO_zip.data,
-        res_id.DO_country = form.DO_country.data,
-        res_id.trip_notes = form.trip_notes.data,
+        if not moved_trip_fits(res_id, form):
+            flash('All vehicles of that type are booked at that time, choose another time or vehicle.', 'danger')
+            return render_template('/admin/admin_edit_res.html', res_id=res_id, form=form)
+
+        res_id.passenger_name = form.passenger_name.data
+        res_id.passenger_phone = form.passenger_phone.data
+        res_id.passenger_email = form.passenger_email.data
+        res_id.vehicle_type = form.vehicle_type.data
+        res_id.PU_date = form.PU_date.data
+        res_id.PU_time = form.PU_time.data
+        res_id.PU_address = form.PU_address.data
+        res_id.PU_street = form.PU_street.data
+        res_id.PU_city = form.PU_city.data
+        res_id.PU_state = form.PU_state.data
+        res_id.PU_zip = form.PU_zip.data
+        res_id.PU_country = form.PU_country.data
+        res_id.DO_address = form.DO_address.data
+        res_id.DO_street = form.DO_street.data
+        res_id.DO_city = form.DO_city.data
+        res_id.DO_state = form.DO_state.data
+        res_id.DO_zip = form.DO_zip.data
+        res_id.DO_country = form.DO_country.data
+        res_id.trip_notes = form.trip_notes.data
 
         db.session.commit()
+        # the pickup slot may have moved, reload the schedule on the next check
+        fleet_schedule.forget()
         flash('Reservation has been updated.', 'success')
         return redirect(f'/admin/admin_home')
 
 
-@app.route('/admin/select_user')
+@routes.route('/admin/select_user')
+@query_budget(1)
 def select_user():
     '''Select a user to create a reservation'''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
 
     users = User.query.all()
@@ -544,11 +962,12 @@ def select_user():
 
 
 
-@app.route('/admin/new_res/<int:user_id>')
+@routes.route('/admin/new_res/<int:user_id>')
+@query_budget(1)
 def new_res_form(user_id):
     '''Display the form for an admin to submit a new reservation.'''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
 
     user = User.query.get(user_id)
@@ -558,11 +977,12 @@ def new_res_form(user_id):
     return render_template('admin/new_res.html', user_id=user_id, form=form, user=user)
 
     
-@app.route('/admin/new_res/<int:user_id>', methods=['POST'])
+@routes.route('/admin/new_res/<int:user_id>', methods=['POST'])
+@query_budget(7)
 def new_res(user_id):
     '''Allow admin to create a new reservation to an existing user.'''
 
-    if CURR_ADMIN_KEY not in session:
+    if g.admin is None:
         raise Unauthorized()
     
     user_id = User.query.get(user_id)
@@ -570,25 +990,33 @@ def new_res(user_id):
     form = ResForm()
 
     if form.validate_on_submit():
-        passenger_name = form.passenger_name.data,
-        passenger_phone = form.passenger_phone.data,
-        passenger_email = form.passenger_email.data,
-        vehicle_type = form.vehicle_type.data,
-        PU_date = form.PU_date.data,
-        PU_time = form.PU_time.data,
-        PU_address = form.PU_address.data,
-        PU_street = form.PU_street.data,
-        PU_city = form.PU_city.data,
-        PU_state = form.PU_state.data,
-        PU_zip = form.PU_zip.data,
-        PU_country = form.PU_country.data,
-        DO_address = form.DO_address.data,
-        DO_street = form.DO_street.data,
-        DO_city = form.DO_city.data,
-        DO_state = form.DO_state.data,
-        DO_zip = form.DO_zip.data,
-        DO_country = form.DO_country.data,
-        trip_notes = form.trip_notes.data,
+        trip = (form.vehicle_type.data, form.PU_date.data, form.PU_time.data)
+        # reserve() checks the database and locks the vehicle type's
+        # capacity until the booking below commits
+        if not fleet_schedule.has_capacity(*trip) or not reserve([trip])[0]:
+            db.session.rollback()
+            flash('All vehicles of that type are booked at that time, choose another time or vehicle.', 'danger')
+            return render_template('admin/new_res.html', user_id=user.id, form=form, user=user)
+
+        passenger_name = form.passenger_name.data
+        passenger_phone = form.passenger_phone.data
+        passenger_email = form.passenger_email.data
+        vehicle_type = form.vehicle_type.data
+        PU_date = form.PU_date.data
+        PU_time = form.PU_time.data
+        PU_address = form.PU_address.data
+        PU_street = form.PU_street.data
+        PU_city = form.PU_city.data
+        PU_state = form.PU_state.data
+        PU_zip = form.PU_zip.data
+        PU_country = form.PU_country.data
+        DO_address = form.DO_address.data
+        DO_street = form.DO_street.data
+        DO_city = form.DO_city.data
+        DO_state = form.DO_state.data
+        DO_zip = form.DO_zip.data
+        DO_country = form.DO_country.data
+        trip_notes = form.trip_notes.data
 
         new_res = Reservation(
             passenger_name = passenger_name,
@@ -610,11 +1038,39 @@ def new_res(user_id):
             DO_zip = DO_zip,
             DO_country = DO_country,
             trip_notes = trip_notes,
+            user_id = user.id,
         )
 
-        user.reservations.append(new_res)
+        # not user.reservations.append(), which loads every trip of the user first
+        db.session.add(new_res)
 
         db.session.commit()
+        fleet_schedule.add(form.vehicle_type.data, form.PU_date.data, form.PU_time.data)
         flash('Reservation has been successfully submitted!', 'success')
 
-        return redirect(url_for('admin_home'))
\ No newline at end of file
+        return redirect(url_for('admin_home'))
+
+
+@routes.route('/admin/import/<int:user_id>', methods=['GET', 'POST'])
+@query_budget(8)
+def import_res(user_id):
+    '''Allow admin to import a CSV file of reservations for an existing user.'''
+
+    if g.admin is None:
+        raise Unauthorized()
+
+    user = User.query.get_or_404(user_id)
+    form = ImportResForm()
+    result = None
+
+    if form.validate_on_submit():
+        result = import_upload(form.csv_file.data.stream, user.id)
+        fleet_schedule.forget()
+
+        if result.imported:
+            flash(f'{result.imported} of {result.rows} reservations have been imported.', 'success')
+        if result.errors:
+            flash('Some rows could not be imported, see the list below.', 'danger')
+
+    return render_template('admin/import_res.html', form=form, user=user, result=result,
+                           fields=IMPORT_FIELDS)
@@ -0,0 +1,123 @@
+'''Async serving of the read-heavy pages and API, as an ASGI app.
+
+    gunicorn 'asgi:create_asgi_app()' -k uvicorn.workers.UvicornWorker
+    uvicorn --factory asgi:create_asgi_app      # development
+
+The GET endpoints in ASYNC_ENDPOINTS are answered on the event loop, over
+SQLAlchemy's asyncio engine (asyncpg): a request waiting on Postgres holds
+no thread, so one process keeps hundreds of slow clients going at once.
+Everything else (forms, bookings, SMS, e-mail, exports) goes to the Flask
+app from create_app(), run in a thread pool as usual.
+
+Both sides run the same code. The views listed take a `db_session`; here
+they are called through AsyncSession.run_sync(), which hands them the
+sync face of the async session, and every query they make, lazy loads
+included, awaits the async driver underneath. Routing, the session cookie,
+g.user / g.admin, templates, error pages and after_request hooks are
+Flask's, inside a Flask request context made from the ASGI scope.'''
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from starlette.middleware.wsgi import WSGIMiddleware, build_environ
+from werkzeug.exceptions import HTTPException
+
+from app import config_class, create_app, load_current_user
+from db_pool import configure_engine, engine_options
+from metrics import start_request
+
+# endpoint -> served on the event loop; GET (and HEAD) only
+ASYNC_ENDPOINTS = {
+    'availability', 'check_user', 'check_phone', 'check_email',
+    'view_res', 'user_dashboard', 'admin_home',
+    'api.list_reservations', 'api.get_reservation', 'api.list_users', 'api.get_user',
+}
+
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def async_url(uri):
+    '''The same database, through the asyncio driver.'''
+
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+def call_view(db_session, view, view_args):
+    '''Inside run_sync(): what Flask's before_request and dispatch do, on `db_session`.'''
+
+    load_current_user(db_session)
+    return view(**view_args, db_session=db_session)
+
+
+class AsyncApp:
+    '''The ASGI app: ASYNC_ENDPOINTS here, the rest to the Flask app.'''
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app)
+
+        config = flask_app.config
+        url = async_url(config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = create_async_engine(url, **engine_options(config, url))
+        configure_engine(config, self.engine.sync_engine)
+
+    def endpoint(self, scope):
+        '''The async view for this request, None to hand it to Flask.'''
+
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return None
+        adapter = self.flask_app.url_map.bind('localhost')
+        try:
+            endpoint, _ = adapter.match(scope['path'], method='GET')
+        except HTTPException:
+            # not found, redirects: Flask's answer
+            return None
+        return self.flask_app.view_functions[endpoint] if endpoint in ASYNC_ENDPOINTS else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        view = self.endpoint(scope)
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+
+        app = self.flask_app
+        with app.request_context(build_environ(scope, b'')) as ctx:
+            start_request()
+            # as Flask's wsgi_app() and full_dispatch_request() do
+            try:
+                try:
+                    async with AsyncSession(self.engine) as db_session:
+                        rv = await db_session.run_sync(call_view, view, ctx.request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+
+            body = b'' if scope['method'] == 'HEAD' else response.get_data()
+            headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                       for name, value in response.headers.to_wsgi_list()]
+
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(config=None):
+    '''AsyncApp around create_app(config).'''
+
+    base = config_class(config)
+    # the sync engine's pool is sized knowing the async one shares the worker's connections
+    return AsyncApp(create_app(type(base.__name__, (base,), {'SERVE_ASGI': True})))
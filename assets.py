@@ -0,0 +1,259 @@
+'''Fingerprinted, precompressed static files.
+
+`python assets.py` copies every file under static/ into static/dist/ with a
+hash of its content in the name (style.css -> style.3f2a9c1b04de.css), so a
+file's URL changes whenever the file does and browsers may keep it
+forever. Text files also get .gz and .br neighbours (.br only if Brotli is
+installed), and the images get smaller copies in IMAGE_WIDTHS, as WebP and
+as JPEG (only if Pillow is installed). What was built is listed in
+static/dist/manifest.json. On Heroku it runs at build time, from
+bin/post_compile.
+
+Templates ask for files by their source name:
+
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
+    {{ picture('images/home.jpg', alt='Home page image') }}
+
+and /static/dist/ answers with the best encoding the browser accepts and
+`Cache-Control: public, max-age=31536000, immutable`. Without a manifest
+(development, tests) the helpers fall back to the plain /static/ URLs.'''
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+import sys
+from functools import lru_cache
+
+from flask import Blueprint, abort, request, send_from_directory, url_for
+from markupsafe import Markup, escape
+
+from query_budget import query_budget
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+HASH_LENGTH = 12
+
+# a year, the longest max-age browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+RESIZABLE = {'.jpg', '.jpeg', '.png'}
+
+# widths of the resized images, for srcset; none wider than the original
+IMAGE_WIDTHS = (640, 1280, 1920)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+# preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+#############################################################################
+# Build
+
+def fingerprint(name, data):
+    '''images/home.jpg -> images/home.<hash>.jpg'''
+
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def write(name, data):
+    path = os.path.join(DIST_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def compressed(data):
+    '''{encoding: bytes} of the variants that are smaller than `data`.'''
+
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def resized(name, data):
+    '''{mimetype: [(width, fingerprinted name)]} of the smaller copies of an
+    image, written to DIST_DIR, and its width. ({}, None) without Pillow.'''
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return {}, None
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        full_width = image.width
+        widths = [width for width in IMAGE_WIDTHS if width < full_width] + [full_width]
+
+        stem = os.path.splitext(name)[0]
+        sources = {'image/webp': [], 'image/jpeg': []}
+        for width in widths:
+            copy = image.resize((width, round(image.height * width / full_width)), Image.LANCZOS)
+            for mimetype, ext, options in (
+                    ('image/webp', '.webp', dict(format='WEBP', quality=WEBP_QUALITY, method=6)),
+                    ('image/jpeg', '.jpg', dict(format='JPEG', quality=JPEG_QUALITY,
+                                                optimize=True, progressive=True))):
+                if mimetype == 'image/jpeg' and copy.mode == 'RGBA':
+                    # PNG with transparency: WebP only
+                    continue
+                buffer = io.BytesIO()
+                copy.save(buffer, **options)
+                body = buffer.getvalue()
+                hashed = fingerprint(f'{stem}.{width}w{ext}', body)
+                write(hashed, body)
+                sources[mimetype].append((width, hashed))
+
+    return {mimetype: found for mimetype, found in sources.items() if found}, full_width
+
+
+def source_files():
+    '''Paths under STATIC_DIR, relative and with / separators, except dist/.'''
+
+    for root, dirs, files in os.walk(STATIC_DIR):
+        if os.path.abspath(root) == STATIC_DIR and 'dist' in dirs:
+            dirs.remove('dist')
+        for filename in sorted(files):
+            yield os.path.relpath(os.path.join(root, filename), STATIC_DIR).replace(os.sep, '/')
+
+
+def build(log=print):
+    '''Rebuild DIST_DIR and its manifest from STATIC_DIR. Returns the manifest.'''
+
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {'files': {}, 'encodings': {}, 'images': {}}
+
+    for name in source_files():
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            data = f.read()
+
+        hashed = fingerprint(name, data)
+        write(hashed, data)
+        manifest['files'][name] = hashed
+
+        ext = os.path.splitext(name)[1].lower()
+        if ext in COMPRESSIBLE:
+            variants = compressed(data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants:
+                    write(hashed + suffix, variants[encoding])
+            manifest['encodings'][hashed] = [encoding for encoding, _ in ENCODINGS if encoding in variants]
+        elif ext in RESIZABLE:
+            sources, width = resized(name, data)
+            if sources:
+                manifest['images'][name] = {'width': width, 'sources': sources}
+
+        log(f'{name} -> {hashed}')
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    load_manifest.cache_clear()
+    return manifest
+
+
+#############################################################################
+# Serving
+
+assets = Blueprint('assets', __name__)
+
+
+@lru_cache(maxsize=1)
+def load_manifest():
+    '''The build's manifest, None when the assets were not built.'''
+
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@assets.app_template_global()
+def asset_url(name):
+    '''URL of the built copy of static/<name>, or of the file itself before a build.'''
+
+    manifest = load_manifest()
+    if manifest is not None and name in manifest['files']:
+        return url_for('assets.dist', filename=manifest['files'][name])
+    return url_for('static', filename=name)
+
+
+def srcset(sources):
+    return ', '.join(f"{url_for('assets.dist', filename=hashed)} {width}w" for width, hashed in sources)
+
+
+@assets.app_template_global()
+def picture(name, alt, sizes='100vw', **attrs):
+    '''<picture> for static/<name> with its resized copies, plain <img> before
+    a build. Extra keyword arguments become <img> attributes (class_ for class).'''
+
+    attributes = ''.join(f' {key.rstrip("_").replace("_", "-")}="{escape(value)}"'
+                         for key, value in attrs.items())
+    img = f'<img src="{escape(asset_url(name))}" alt="{escape(alt)}"{attributes}'
+
+    manifest = load_manifest()
+    image = manifest and manifest['images'].get(name)
+    if not image:
+        return Markup(img + '>')
+
+    sources = image['sources']
+    tags = ['<picture>']
+    if 'image/webp' in sources:
+        tags.append(f'<source type="image/webp" srcset="{srcset(sources["image/webp"])}" sizes="{escape(sizes)}">')
+    if 'image/jpeg' in sources:
+        img += f' srcset="{srcset(sources["image/jpeg"])}" sizes="{escape(sizes)}"'
+    tags.append(img + '>')
+    tags.append('</picture>')
+    return Markup(''.join(tags))
+
+
+def encodings_by_file():
+    manifest = load_manifest()
+    return manifest['encodings'] if manifest is not None else {}
+
+
+@assets.route('/static/dist/<path:filename>')
+@query_budget(0)
+def dist(filename):
+    '''A built file, precompressed if the browser takes it, cached for good.'''
+
+    if filename == 'manifest.json':
+        abort(404)
+
+    served = filename
+    encoding = None
+    for candidate in encodings_by_file().get(filename, ()):
+        if request.accept_encodings[candidate]:
+            encoding = candidate
+            served = filename + dict(ENCODINGS)[candidate]
+            break
+
+    resp = send_from_directory(DIST_DIR, served, max_age=IMMUTABLE_MAX_AGE,
+                               mimetype=mimetypes.guess_type(filename)[0],
+                               download_name=os.path.basename(filename))
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    if filename in encodings_by_file():
+        resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+if __name__ == '__main__':
+    manifest = build(log=print if '-v' in sys.argv else (lambda message: None))
+    print(f"{len(manifest['files'])} files built, {len(manifest['images'])} images resized")
@@ -0,0 +1,196 @@
+'''Username / e-mail / phone availability checks for the signup form.
+
+Most checks are for values nobody has taken. A Bloom filter built from the
+users table answers those without touching the database; values the
+filter might contain are checked with one EXISTS query per request and
+taken values are cached for a short TTL.
+
+The filter is per process. Users added by this process are added to it
+once their transaction commits (see the events below), users added by other gunicorn
+workers are picked up when it is rebuilt every AVAILABILITY_REBUILD_SECONDS.
+One request at a time rebuilds it. Meanwhile the others keep using the
+old filter, or, before there is one, ask the database.
+The unique constraints on users stay the final word at registration.'''
+
+import hashlib
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import event, exists, select
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User
+from cache import TTLCache
+
+FIELDS = ('username', 'email', 'phone')
+
+REBUILD_SECONDS = int(os.environ.get('AVAILABILITY_REBUILD_SECONDS', 300))
+TAKEN_TTL_SECONDS = int(os.environ.get('AVAILABILITY_TAKEN_TTL_SECONDS', 60))
+RATE_PER_SECOND = float(os.environ.get('AVAILABILITY_RATE_PER_SECOND', 5))
+RATE_BURST = int(os.environ.get('AVAILABILITY_RATE_BURST', 20))
+
+
+class BloomFilter:
+    '''Set membership with no false negatives and about `error_rate` false positives.'''
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('UTF-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class ClientRateLimiter:
+    '''Token bucket per client key. allow() never blocks.'''
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, client):
+        now = self.clock()
+        with self.lock:
+            if len(self.buckets) > 10000:
+                self.buckets.clear()
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[client] = (tokens, now)
+                return False
+            self.buckets[client] = (tokens - 1, now)
+            return True
+
+
+def normalize(field, value):
+    # values are matched exactly, like the unique constraints on users
+    return f'{field}:{value}'
+
+
+class AvailabilityChecker:
+    '''Answers "is this username / e-mail / phone still free?" for many fields at once.'''
+
+    def __init__(self, rebuild_seconds=REBUILD_SECONDS, taken_ttl=TAKEN_TTL_SECONDS, clock=time.monotonic):
+        self.rebuild_seconds = rebuild_seconds
+        self.clock = clock
+        self.taken = TTLCache(taken_ttl, clock=clock)
+        self.bloom = None
+        self.built_at = None
+        self.lock = threading.Lock()
+        self.rebuilding = threading.Lock()
+
+    def rebuild(self, session=None):
+        '''Load every username, e-mail and phone into a fresh Bloom filter.'''
+
+        session = session or db.session
+        count = session.query(db.func.count(User.id)).scalar()
+        bloom = BloomFilter(count * len(FIELDS))
+        for row in session.query(User.username, User.email, User.phone).yield_per(10000):
+            for field, value in zip(FIELDS, row):
+                if value is not None:
+                    bloom.add(normalize(field, value))
+
+        with self.lock:
+            self.bloom = bloom
+            self.built_at = self.clock()
+
+    def add(self, field, value):
+        '''Record a value that was just taken.'''
+
+        if value is None:
+            return
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(normalize(field, value))
+        self.taken.set(normalize(field, value), True)
+
+    def _stale(self):
+        return self.bloom is None or self.clock() - self.built_at > self.rebuild_seconds
+
+    def _filter(self, session):
+        '''The Bloom filter, rebuilt by whichever request finds it stale and
+        no other one rebuilding. None while the first one is being built.'''
+
+        # never waits for the lock: under asgi.py the rebuilding request may be
+        # a coroutine on this same thread, waiting for its query
+        if self._stale() and self.rebuilding.acquire(blocking=False):
+            try:
+                # another request may have rebuilt it since we looked
+                if self._stale():
+                    self.rebuild(session)
+            finally:
+                self.rebuilding.release()
+        return self.bloom
+
+    def check(self, values, session=None):
+        '''Take {field: value} and return {field: True if available}.
+        `session` defaults to db.session.'''
+
+        session = session or db.session
+        bloom = self._filter(session)
+        result = {}
+        to_query = {}
+
+        for field, value in values.items():
+            key = normalize(field, value)
+            if bloom is not None and key not in bloom:
+                result[field] = True
+            elif self.taken.get(key):
+                result[field] = False
+            else:
+                to_query[field] = value
+
+        if to_query:
+            # a single round trip: SELECT EXISTS(...) AS username, EXISTS(...) AS email, ...
+            columns = [exists().where(getattr(User, field) == value).label(field)
+                       for field, value in to_query.items()]
+            row = session.execute(select(*columns)).one()
+
+            for field, taken in zip(to_query, row):
+                result[field] = not taken
+                if taken:
+                    self.taken.set(normalize(field, to_query[field]), True)
+
+        return result
+
+
+checker = AvailabilityChecker()
+
+
+# Values are only taken once the user row commits: they are collected in
+# session.info at flush time and handed to the checker after the commit,
+# or forgotten if the transaction rolls back.
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _collect_taken(mapper, connection, user):
+    pending = object_session(user).info.setdefault('availability_taken', [])
+    pending.extend((field, getattr(user, field)) for field in FIELDS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_taken(session):
+    for field, value in session.info.pop('availability_taken', ()):
+        checker.add(field, value)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_taken(session):
+    session.info.pop('availability_taken', None)
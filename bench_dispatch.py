@@ -0,0 +1,108 @@
+'''Benchmark the driver assignment on a random day.
+
+Plans a day of random Bay Area rides for a fleet of drivers with
+dispatch.plan_day() (best of 5), and compares the total deadhead with a
+greedy plan that gives each ride, in pick-up order, the nearest driver who
+can make it.
+
+    python bench_dispatch.py [rides] [drivers]    # default 300 60'''
+
+import random
+import sys
+import time
+
+import numpy as np
+
+from dispatch import plan_day, cost_matrix, travel_minutes, INFEASIBLE, DEFAULT_DEADHEAD_MINUTES
+from quotes import VEHICLE_TYPES
+from bench_quotes import random_trips
+
+
+def random_day(ride_count, driver_count, seed=0):
+    '''(drivers, rides) arrays the way dispatch.load_drivers() and
+    dispatch.load_rides() return them.'''
+
+    rng = random.Random(seed)
+    trips = random_trips(ride_count, seed)
+    # most rides are sedans, most of the fleet too
+    weights = [6, 3, 1]
+    vehicle_types = rng.choices(VEHICLE_TYPES, weights, k=ride_count)
+    start = np.sort(np.array([rng.randrange(5 * 60, 23 * 60) for _ in range(ride_count)], dtype=float))
+
+    pu_lat, pu_lng, do_lat, do_lng = (np.array(column, dtype=float) for column in list(zip(*trips))[3:])
+    rides = dict(
+        ids=list(range(1, ride_count + 1)),
+        start=start,
+        end=start + travel_minutes(pu_lat, pu_lng, do_lat, do_lng, 60) + 10,
+        vehicle_class=np.array([VEHICLE_TYPES.index(kind) for kind in vehicle_types], dtype=float),
+        pu_lat=pu_lat, pu_lng=pu_lng, do_lat=do_lat, do_lng=do_lng,
+    )
+
+    shift_start = np.array([rng.choice((4, 5, 6, 10, 14)) * 60 for _ in range(driver_count)], dtype=float)
+    drivers = dict(
+        ids=list(range(1, driver_count + 1)),
+        free_at=shift_start,
+        shift_end=np.minimum(shift_start + 10 * 60, 24 * 60),
+        lat=np.array([37.3 + rng.random() * 0.6 for _ in range(driver_count)]),
+        lng=np.array([-122.5 + rng.random() * 0.6 for _ in range(driver_count)]),
+        vehicle_class=np.array([VEHICLE_TYPES.index(kind)
+                                for kind in rng.choices(VEHICLE_TYPES, weights, k=driver_count)], dtype=float),
+    )
+    return drivers, rides
+
+
+def copy_drivers(drivers):
+    return {name: value.copy() if isinstance(value, np.ndarray) else value for name, value in drivers.items()}
+
+
+def greedy_plan(drivers, rides):
+    '''Each ride in turn to the cheapest driver who can make it.'''
+
+    plan = {}
+    for ride in range(len(rides['ids'])):
+        cost = cost_matrix(drivers, rides, np.array([ride]))[:, 0]
+        driver = int(np.argmin(cost))
+        if cost[driver] >= INFEASIBLE:
+            continue
+        plan[ride] = driver
+        drivers['free_at'][driver] = rides['end'][ride]
+        drivers['lat'][driver] = rides['do_lat'][ride]
+        drivers['lng'][driver] = rides['do_lng'][ride]
+    return plan
+
+
+def deadhead(drivers, rides, plan):
+    '''Total minutes driven empty to the pick-ups of `plan`.'''
+
+    drivers = copy_drivers(drivers)
+    total = 0.0
+    for ride in sorted(plan):
+        driver = plan[ride]
+        total += float(travel_minutes(drivers['lat'][driver], drivers['lng'][driver],
+                                      rides['pu_lat'][ride], rides['pu_lng'][ride], DEFAULT_DEADHEAD_MINUTES))
+        drivers['lat'][driver] = rides['do_lat'][ride]
+        drivers['lng'][driver] = rides['do_lng'][ride]
+    return total
+
+
+def main(ride_count, driver_count):
+    drivers, rides = random_day(ride_count, driver_count)
+
+    seconds = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        plan = plan_day(copy_drivers(drivers), rides)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    greedy = greedy_plan(copy_drivers(drivers), rides)
+
+    print(f'{ride_count} rides, {driver_count} drivers')
+    print(f'hungarian: {seconds * 1000:7.1f} ms  {len(plan)} assigned  '
+          f'{deadhead(drivers, rides, plan):8.0f} deadhead minutes')
+    print(f'greedy   :             {len(greedy)} assigned  '
+          f'{deadhead(drivers, rides, greedy):8.0f} deadhead minutes')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args + [300, 60][len(args):])
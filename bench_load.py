@@ -0,0 +1,443 @@
+'''Load test of the booking flows, against a locally started app.
+
+Seeds BENCH_DATABASE_URL (default postgresql:///book_a_ride_bench, its
+tables are dropped first) with customers and their trips, starts gunicorn
+on create_app() (asgi.py's app with --asgi) and the SMS worker, and runs
+`clients` simulated users, each going from one scenario to the next:
+
+    signup          the register page, availability checks as the fields
+                    are filled in, the form posted
+    login           the login page and the form posted, in a new session
+    res_form        the booking form and a booking posted
+    user_dashboard  a customer looking at their trips
+    admin_home      a dispatcher refreshing the admin page
+
+Nothing leaves the machine: e-mail goes to an SMTP server run by this
+script (aiosmtpd) and the SMS worker sends with SMS_PROVIDER=fake. All
+simulated users come from 127.0.0.1, so the availability rate limit is
+lifted. Other settings (WEB_CONCURRENCY, GUNICORN_THREADS,
+BCRYPT_LOG_ROUNDS, ...) are taken from the environment as in production.
+
+Reports the requests per second and the p50/p95/p99 latency of every
+request of each scenario, once WARMUP_SECONDS have passed, with the
+number of requests (samples) they are taken from. Percentiles are
+interpolated (statistics.quantiles, 'inclusive'); a * marks one with
+too few samples above it to mean much.
+
+    python bench_load.py [seconds] [clients]        # default 30 20
+    python bench_load.py 60 50 --save load.json     # keep the numbers
+    python bench_load.py 60 50 --compare load.json
+    python bench_load.py 60 50 --asgi
+
+--save writes the numbers with the commit they were measured on.
+--compare prints the change against a saved run and exits with status 1
+when the p95 of a scenario got more than 25% slower.'''
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, time as clock, timedelta
+
+import httpx
+from aiosmtpd.controller import Controller
+
+from test_mailer import Inbox, free_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DATABASE_URL = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///book_a_ride_bench')
+
+CUSTOMERS = 200
+TRIPS_PER_CUSTOMER = 20
+PASSWORD = 'benchpassword'
+
+# scenario: how often a simulated user picks it
+WEIGHTS = {
+    'user_dashboard': 40,
+    'res_form': 20,
+    'login': 15,
+    'admin_home': 15,
+    'signup': 10,
+}
+
+# the first seconds fill the caches and the pools; they are not counted
+WARMUP_SECONDS = 5
+SERVER_START_SECONDS = 30
+# run to run noise is around 10%
+SLOWER_BY = 1.25
+
+SEDAN = 'Sedan (up to 4 passengers)'
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+#############################################################################
+# Database and processes
+
+def seed(customers=CUSTOMERS, trips=TRIPS_PER_CUSTOMER):
+    '''Empty database with an admin ("benchadmin") and `customers` customers
+    ("bench0", ...) with past and upcoming trips, all with PASSWORD.'''
+
+    # imported here, DATABASE_URL has to be set before config.py is read
+    from addresses import link_records
+    from app import create_app
+    from migrate import migrate
+    from models import db, Reservation, User
+    from passwords import password_service
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        migrate(db.engine, mark_only=True)
+
+        # one hash for everyone, bcrypt would take minutes
+        hashed = password_service.hash(PASSWORD)
+        db.session.add(User(username='benchadmin', password=hashed, email='admin@bench.test',
+                            first_name='Bench', last_name='Dispatcher', phone='555-000-0000', is_admin=True))
+        db.session.add_all([User(username=f'bench{n}', password=hashed, email=f'bench{n}@bench.test',
+                                 first_name='Bench', last_name=f'Customer{n}', phone=f'555-100-{n:04d}')
+                            for n in range(customers)])
+        db.session.commit()
+
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.is_admin.isnot(True))]
+        rng = random.Random(0)
+        records = []
+        for user_id in user_ids:
+            for k in range(trips):
+                records.append(dict(
+                    user_id=user_id, passenger_name='Bench Rider', passenger_phone='4155550100',
+                    vehicle_type=SEDAN, PU_date=date.today() + timedelta(days=rng.randrange(-60, 30)),
+                    PU_time=clock(rng.randrange(5, 23), rng.choice((0, 15, 30, 45))),
+                    PU_address='Home', PU_street=f'{rng.randrange(1, 900)} Market St',
+                    PU_city='San Francisco', PU_state='CA', PU_zip='94105', PU_country='US',
+                    DO_address='Airport', DO_street='SFO', DO_city='San Francisco', DO_state='CA',
+                    DO_zip='94128', DO_country='US'))
+
+        link_records(db.session.connection(), records)
+        db.session.execute(Reservation.__table__.insert(), records)
+        db.session.commit()
+        db.engine.dispose()
+
+
+def start_processes(port, smtp_port, asgi=False):
+    '''The web server and the SMS worker, with the services stubbed.'''
+
+    env = dict(os.environ,
+               SMTP_HOST='127.0.0.1', SMTP_PORT=str(smtp_port), SMTP_SSL='false', EM_USER='',
+               SMS_PROVIDER='fake', SMS_RATE_PER_SECOND='100',
+               AVAILABILITY_RATE_PER_SECOND='1000000', AVAILABILITY_RATE_BURST='1000000')
+
+    # workers and threads as gunicorn.conf.py sets them
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    if asgi:
+        command += ['-k', 'uvicorn.workers.UvicornWorker', 'asgi:create_asgi_app()']
+    else:
+        command += ['app:create_app()']
+
+    return [subprocess.Popen(command, cwd=HERE, env=env),
+            subprocess.Popen([sys.executable, 'sms_worker.py'], cwd=HERE, env=env)]
+
+
+async def wait_for_server(base_url):
+    deadline = time.monotonic() + SERVER_START_SECONDS
+    async with httpx.AsyncClient(base_url=base_url) as http:
+        while True:
+            try:
+                if (await http.get('/')).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'the server did not answer on {base_url} in {SERVER_START_SECONDS} s')
+            await asyncio.sleep(0.2)
+
+
+#############################################################################
+# Simulated users
+
+class Results:
+    '''Latencies and errors per scenario, counted once recording is on.'''
+
+    def __init__(self):
+        self.recording = False
+        self.started = None
+        self.stopped = None
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def start(self):
+        self.recording = True
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.recording = False
+        self.stopped = time.perf_counter()
+
+    def record(self, scenario, seconds, ok):
+        if not self.recording:
+            return
+        self.latencies[scenario].append(seconds)
+        if not ok:
+            self.errors[scenario] += 1
+
+
+def csrf_token(response):
+    match = CSRF_TOKEN.search(response.text)
+    return match.group(1) if match else ''
+
+
+class Session:
+    '''One browser: its cookies, and every request timed under a scenario.'''
+
+    def __init__(self, base_url, results):
+        self.http = httpx.AsyncClient(base_url=base_url, timeout=60)
+        self.results = results
+
+    async def request(self, scenario, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.results.record(scenario, time.perf_counter() - start, ok=False)
+            return None
+        self.results.record(scenario, time.perf_counter() - start, ok=response.status_code < 400)
+        return response
+
+    async def form(self, scenario, url, data):
+        '''GET the form, POST it back with its CSRF token.'''
+
+        page = await self.request(scenario, 'GET', url)
+        if page is None:
+            return None
+        return await self.request(scenario, 'POST', url, data=dict(data, csrf_token=csrf_token(page)))
+
+    async def login(self, scenario, username):
+        return await self.form(scenario, '/login', dict(username=username, password=PASSWORD))
+
+    async def close(self):
+        await self.http.aclose()
+
+
+class SimulatedUser:
+    '''A simulated user: a customer's session and a dispatcher's one,
+    picking scenarios by WEIGHTS until `results` stops recording.'''
+
+    signups = itertools.count()
+
+    def __init__(self, base_url, results, customer, run_id, seed):
+        self.base_url = base_url
+        self.results = results
+        self.customer = customer
+        self.run_id = run_id
+        self.rng = random.Random(seed)
+        self.user_id = None
+        self.customer_session = Session(base_url, results)
+        self.admin_session = Session(base_url, results)
+
+    async def setup(self):
+        response = await self.customer_session.login('setup', f'bench{self.customer}')
+        self.user_id = int(response.headers['location'].rstrip('/').rsplit('/', 1)[1])
+        await self.admin_session.login('setup', 'benchadmin')
+
+    async def run(self, until):
+        scenarios = list(WEIGHTS)
+        weights = list(WEIGHTS.values())
+        while time.perf_counter() < until:
+            scenario = self.rng.choices(scenarios, weights)[0]
+            await getattr(self, scenario)()
+
+    async def close(self):
+        await self.customer_session.close()
+        await self.admin_session.close()
+
+    async def signup(self):
+        session = Session(self.base_url, self.results)
+        n = next(self.signups)
+        username = f'new{self.run_id}{n}'
+        email = f'{username}@bench.test'
+        phone = f'555-{self.run_id % 1000:03d}-{n:04d}'
+        try:
+            page = await session.request('signup', 'GET', '/register')
+            if page is None:
+                return
+            # the page asks as each field is filled in
+            for length in (4, 7, len(username)):
+                await session.request('signup', 'GET', '/availability', params=dict(username=username[:length]))
+            await session.request('signup', 'GET', '/availability', params=dict(username=username, email=email))
+            await session.request('signup', 'GET', '/availability',
+                                  params=dict(username=username, email=email, phone=phone))
+            await session.request('signup', 'POST', '/register', data=dict(
+                username=username, password=PASSWORD, email=email, first_name='New',
+                last_name='Customer', phone=phone, csrf_token=csrf_token(page)))
+        finally:
+            await session.close()
+
+    async def login(self):
+        session = Session(self.base_url, self.results)
+        try:
+            await session.login('login', f'bench{self.rng.randrange(CUSTOMERS)}')
+        finally:
+            await session.close()
+
+    async def res_form(self):
+        day = date.today() + timedelta(days=self.rng.randrange(1, 60))
+        await self.customer_session.form('res_form', '/res/res_form', dict(
+            passenger_name='Bench Rider', passenger_phone='4155550100', vehicle_type=SEDAN,
+            PU_date=day.isoformat(), PU_time=f'{self.rng.randrange(5, 23):02d}:30',
+            PU_address='Office', PU_street=f'{self.rng.randrange(1, 900)} Mission St',
+            PU_city='San Francisco', PU_state='CA', DO_address='Airport', DO_street='SFO',
+            DO_city='San Francisco', DO_state='CA'))
+
+    async def user_dashboard(self):
+        await self.customer_session.request('user_dashboard', 'GET', f'/users/{self.user_id}')
+
+    async def admin_home(self):
+        await self.admin_session.request('admin_home', 'GET', '/admin/admin_home')
+
+
+async def run_load(base_url, seconds, clients):
+    results = Results()
+    run_id = random.randrange(100000)
+    users = [SimulatedUser(base_url, results, n % CUSTOMERS, run_id, seed=n) for n in range(clients)]
+    await asyncio.gather(*(user.setup() for user in users))
+
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(user.run(start + WARMUP_SECONDS + seconds)) for user in users]
+    await asyncio.sleep(WARMUP_SECONDS)
+    results.start()
+    await asyncio.sleep(seconds)
+    results.stop()
+    await asyncio.gather(*tasks)
+    await asyncio.gather(*(user.close() for user in users))
+    return results
+
+
+#############################################################################
+# Report
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(latencies):
+    '''{q: latency} for PERCENTILES, interpolated between the samples, the
+    fastest being p0 and the slowest p100.'''
+
+    if len(latencies) < 2:
+        return dict.fromkeys(PERCENTILES, latencies[0])
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {q: cuts[q - 1] for q in PERCENTILES}
+
+
+def thin(q, samples):
+    '''True when not even one of `samples` is expected above pq, the
+    percentile is then little more than the slowest request.'''
+
+    return samples * (100 - q) < 100
+
+
+def summarize(results):
+    '''{scenario: {requests, errors, rps, p50_ms, p95_ms, p99_ms}}, every
+    request being one latency sample.'''
+
+    elapsed = results.stopped - results.started
+    summary = {}
+    for scenario in WEIGHTS:
+        latencies = results.latencies[scenario]
+        if not latencies:
+            continue
+        summary[scenario] = dict(
+            requests=len(latencies),
+            errors=results.errors[scenario],
+            rps=round(len(latencies) / elapsed, 1),
+            **{f'p{q}_ms': round(value * 1000, 1) for q, value in percentiles(latencies).items()})
+    return summary
+
+
+def latency_cell(row, q):
+    return f'{row[f"p{q}_ms"]:.1f}{"*" if thin(q, row["requests"]) else " "}'
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(seconds=30, clients=20, save=None, compare=None, asgi=False):
+    os.environ['DATABASE_URL'] = DATABASE_URL
+    seed()
+
+    controller = Controller(Inbox(), hostname='127.0.0.1', port=free_port())
+    controller.start()
+    port = free_port()
+    processes = start_processes(port, controller.port, asgi)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        asyncio.run(wait_for_server(base_url))
+        results = asyncio.run(run_load(base_url, seconds, clients))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        controller.stop()
+
+    summary = summarize(results)
+    server = 'asgi' if asgi else 'wsgi'
+    print(f'{server}, {clients} clients, {seconds} s')
+    # the request count is the number of samples behind the percentiles next to it
+    print(f'{"scenario":<16}{"errors":>8}{"req/s":>9}{"samples":>9}'
+          + ''.join(f'{f"p{q} ms":>10}' for q in PERCENTILES))
+    for scenario, row in summary.items():
+        print(f'{scenario:<16}{row["errors"]:>8}{row["rps"]:>9.1f}{row["requests"]:>9}'
+              + ''.join(f'{latency_cell(row, q):>10}' for q in PERCENTILES))
+    if any(thin(q, row['requests']) for row in summary.values() for q in PERCENTILES):
+        print('* not one sample above it, about the slowest request: run longer or with more clients')
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump({'commit': commit(), 'server': server, 'seconds': seconds, 'clients': clients,
+                       'scenarios': summary}, f, indent=1, sort_keys=True)
+
+    if compare:
+        with open(compare) as f:
+            before = json.load(f)
+        print(f"against {before['commit']} ({before['server']}, {before['clients']} clients):")
+        slower = []
+        for scenario, row in summary.items():
+            old = before['scenarios'].get(scenario)
+            if old is None:
+                continue
+            print(f"  {scenario:<16} p95 {old['p95_ms']:.1f} ms of {old['requests']} -> "
+                  f"{row['p95_ms']:.1f} ms of {row['requests']} samples "
+                  f"({(row['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%), "
+                  f"{old['rps']:.1f} -> {row['rps']:.1f} req/s")
+            if row['p95_ms'] > old['p95_ms'] * SLOWER_BY:
+                slower.append(scenario)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for flag in ('--save', '--compare'):
+        if flag in args:
+            i = args.index(flag)
+            options[flag[2:]] = args[i + 1]
+            del args[i:i + 2]
+    if '--asgi' in args:
+        args.remove('--asgi')
+        options['asgi'] = True
+    sys.exit(main(*[int(arg) for arg in args], **options))
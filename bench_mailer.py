@@ -0,0 +1,70 @@
+'''Benchmark confirmation e-mail delivery against a local SMTP server.
+
+Compares the old path (new connection + login per message, inside the
+request) with the pooled background Mailer, reporting e-mails per second
+and how long the request waits.
+
+    python bench_mailer.py [number of messages]'''
+
+import smtplib
+import sys
+import time
+
+from aiosmtpd.controller import Controller
+
+from mailer import SMTPPool, Mailer
+from test_mailer import Inbox, free_port, make_msg
+
+
+def bench_inline(port, count):
+    '''One connection per message, sent before the request returns.'''
+
+    waits = []
+    start = time.perf_counter()
+    for n in range(count):
+        t = time.perf_counter()
+        with smtplib.SMTP('127.0.0.1', port) as smtp:
+            smtp.send_message(make_msg(n))
+        waits.append(time.perf_counter() - t)
+    return time.perf_counter() - start, waits
+
+
+def bench_pooled(port, count, size):
+    '''Queued to the Mailer, sent over `size` reused connections.'''
+
+    mailer = Mailer(SMTPPool('127.0.0.1', port, use_ssl=False, size=size))
+    mailer.start()
+
+    waits = []
+    start = time.perf_counter()
+    for n in range(count):
+        t = time.perf_counter()
+        mailer.send(make_msg(n))
+        waits.append(time.perf_counter() - t)
+    mailer.join()
+    total = time.perf_counter() - start
+    mailer.stop()
+    return total, waits
+
+
+def report(name, count, total, waits):
+    waits = sorted(waits)
+    p50 = waits[len(waits) // 2] * 1000
+    p99 = waits[int(len(waits) * 0.99)] * 1000
+    print(f'{name:<12} {count / total:>10.1f} emails/s   request wait p50 {p50:.3f} ms  p99 {p99:.3f} ms')
+
+
+def main(count=500):
+    port = free_port()
+    controller = Controller(Inbox(), hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        report('inline', count, *bench_inline(port, count))
+        for size in (1, 2, 4):
+            report(f'pooled x{size}', count, *bench_pooled(port, count, size))
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
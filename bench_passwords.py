@@ -0,0 +1,82 @@
+'''Benchmark password checks at different bcrypt work factors.
+
+For each work factor, reports the time of one check on an idle service,
+then keeps the password pool (PASSWORD_WORKERS threads, default one per
+core) busy with CLIENTS_PER_WORKER concurrent logins per pool thread, as
+request threads would, and reports logins per second in total and per
+core used, and the p50/p99 time a login waits for its check.
+
+    python bench_passwords.py [rounds ...]    # default: 10 11 12 13'''
+
+import os
+import sys
+import threading
+import time
+
+from passwords import PasswordService, WORKERS
+
+PASSWORD = 'correct horse battery staple'
+CLIENTS_PER_WORKER = 4
+
+
+def idle_check(service, hashed, seconds):
+    '''Milliseconds per check, one at a time.'''
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        service.verify(hashed, PASSWORD)
+        count += 1
+    return (time.perf_counter() - start) * 1000 / count
+
+
+def under_load(service, hashed, seconds, clients):
+    '''(logins per second, sorted login times in ms) with `clients` threads
+    checking passwords back to back through the service.'''
+
+    waits = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def client():
+        mine = []
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            service.verify(hashed, PASSWORD)
+            mine.append((time.perf_counter() - start) * 1000)
+        with lock:
+            waits.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(waits) / (time.perf_counter() - start), sorted(waits)
+
+
+def bench(rounds, seconds=3.0):
+    clients = WORKERS * CLIENTS_PER_WORKER
+    service = PasswordService(rounds=rounds, workers=WORKERS, max_pending=clients)
+    hashed = service.hash(PASSWORD)
+
+    idle_ms = idle_check(service, hashed, seconds / 3)
+    per_second, waits = under_load(service, hashed, seconds, clients)
+    cores = min(WORKERS, os.cpu_count() or 1)
+    p50 = waits[len(waits) // 2]
+    p99 = waits[min(int(len(waits) * 0.99), len(waits) - 1)]
+    return idle_ms, per_second, per_second / cores, p50, p99
+
+
+def main(rounds_list):
+    cores = os.cpu_count() or 1
+    print(f'{cores} cores, {WORKERS} password workers, {WORKERS * CLIENTS_PER_WORKER} concurrent logins')
+    print(f'{"rounds":>6} {"idle ms":>8} {"logins/s":>9} {"per core":>9} {"p50 ms":>8} {"p99 ms":>8}')
+    for rounds in rounds_list:
+        idle_ms, per_second, per_core, p50, p99 = bench(rounds)
+        print(f'{rounds:>6} {idle_ms:>8.1f} {per_second:>9.1f} {per_core:>9.1f} {p50:>8.1f} {p99:>8.1f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10, 11, 12, 13])
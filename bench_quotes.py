@@ -0,0 +1,126 @@
+'''Benchmark batch fare quotes against quoting one trip at a time.
+
+Both sides quote the same random Bay Area trips, each starting from what
+its fetch gives it, and are timed best of REPEATS. The loop is plain
+Python (math module) over row tuples (id, vehicle index, hour, pick-up
+and drop-off coordinates), as a cursor returns requote()'s query. The
+batch is requote()'s own path from the binary COPY Postgres sends for
+that query: quotes.copy_rows() then quotes.quote_rows(). The batch has
+to be at least MIN_SPEEDUP times faster.
+
+    python bench_quotes.py [number of trips]    # default 100000'''
+
+import math
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+from quotes import (copy_rows, quote_rows, COPY_SIGNATURE, QUOTE_COLUMNS, RATES, VEHICLE_TYPES,
+                    HOURLY_SURCHARGE, ZONES, ROAD_FACTOR, EARTH_RADIUS_MILES)
+
+REPEATS = 5
+MIN_SPEEDUP = 50
+
+# QUOTE_COLUMNS' NumPy types in the struct module
+STRUCT_CODES = {'>i4': 'i', '>f8': 'd'}
+
+
+def distance_row(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def quote_row(pu_lat, pu_lng, do_lat, do_lng, vehicle, hour):
+    '''One trip, the straightforward way. Returns (miles, fare).'''
+
+    if vehicle >= len(VEHICLE_TYPES):
+        return math.nan, math.nan
+    rate = RATES[VEHICLE_TYPES[vehicle]]
+
+    miles = distance_row(pu_lat, pu_lng, do_lat, do_lng) * ROAD_FACTOR
+    fare = max(rate.minimum, rate.base + rate.per_mile * miles) * HOURLY_SURCHARGE[hour % 24]
+    for zone in ZONES:
+        for lat, lng in ((pu_lat, pu_lng), (do_lat, do_lng)):
+            dy = math.radians(lat - zone.lat)
+            dx = math.radians(lng - zone.lng) * math.cos(math.radians(zone.lat))
+            if EARTH_RADIUS_MILES * math.hypot(dx, dy) <= zone.radius_miles:
+                fare += zone.fee
+    return round(miles, 1), round(fare, 2)
+
+
+def random_trips(count, seed=0):
+    '''Rows of requote()'s query: (id, vehicle index, hour, pu_lat, pu_lng, do_lat, do_lng).'''
+
+    rng = random.Random(seed)
+    points = [(zone.lat, zone.lng) for zone in ZONES]
+
+    def point():
+        # a third of the trips start or end at an airport
+        if rng.random() < 0.33:
+            return rng.choice(points)
+        return 37.3 + rng.random() * 0.6, -122.5 + rng.random() * 0.6
+
+    rows = []
+    for res_id in range(1, count + 1):
+        pu, do = point(), point()
+        rows.append((res_id, rng.randrange(len(VEHICLE_TYPES)), rng.randrange(24)) + pu + do)
+    return rows
+
+
+def copy_data(rows):
+    '''The binary COPY Postgres sends for these rows.'''
+
+    codes = [STRUCT_CODES[kind] for _, kind in QUOTE_COLUMNS]
+    row_format = '>h' + ''.join('i' + code for code in codes)
+    lengths = [struct.calcsize('>' + code) for code in codes]
+    body = b''.join(struct.pack(row_format, len(lengths), *(v for pair in zip(lengths, row) for v in pair))
+                    for row in rows)
+    return COPY_SIGNATURE + struct.pack('>ii', 0, 0) + body + struct.pack('>h', -1)
+
+
+def loop(rows):
+    return [quote_row(pu_lat, pu_lng, do_lat, do_lng, vehicle, hour)
+            for res_id, vehicle, hour, pu_lat, pu_lng, do_lat, do_lng in rows]
+
+
+def batch(data):
+    '''requote() from the COPY it reads to the fares.'''
+
+    return quote_rows(copy_rows(data))
+
+
+def best_of(function, argument):
+    '''(seconds of the fastest of REPEATS runs, its result)'''
+
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(count):
+    rows = random_trips(count)
+    data = copy_data(rows)
+
+    loop_seconds, looped = best_of(loop, rows)
+    batch_seconds, (miles, fares) = best_of(batch, data)
+
+    assert np.allclose(fares, [fare for _, fare in looped], atol=0.011)
+
+    speedup = loop_seconds / batch_seconds
+    print(f'{count} trips, best of {REPEATS}')
+    print(f'loop : {loop_seconds * 1000:9.1f} ms  {count / loop_seconds:12.0f} trips/s')
+    print(f'batch: {batch_seconds * 1000:9.1f} ms  {count / batch_seconds:12.0f} trips/s')
+    print(f'speedup: {speedup:.1f}x')
+    assert speedup >= MIN_SPEEDUP, f'the batch is only {speedup:.1f}x faster, it should be {MIN_SPEEDUP}x'
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,109 @@
+'''Cold start of a web worker: import app and create_app(), in a fresh interpreter.
+
+Runs `python -X importtime` on what a gunicorn worker does at boot, a few
+times, and reports the median wall time, the median import time of app.py,
+and the top-level packages that take the longest to import.
+
+    python bench_startup.py [runs]                  # default 5
+    python bench_startup.py 5 --save startup.json   # keep the numbers
+    python bench_startup.py 5 --compare startup.json
+
+--compare prints the change against a saved run and exits with status 1
+when the import of app.py got more than 25% slower.'''
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+WORKER_BOOT = "from app import create_app; create_app('production')"
+
+# the first interpreter start warms the OS file cache; it is not counted
+WARMUP_RUNS = 1
+TOP_PACKAGES = 15
+# run to run noise is around 10%
+SLOWER_BY = 1.25
+
+
+def run_once():
+    '''(wall seconds, {module: (self us, cumulative us)}) of one cold start.'''
+
+    env = dict(os.environ)
+    # keep the app away from a real database and the network at import
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', WORKER_BOOT],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                          stderr=subprocess.PIPE, text=True, check=True)
+    wall = time.perf_counter() - start
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return wall, modules
+
+
+def by_package(modules):
+    '''Self time summed per top-level package, in ms.'''
+
+    totals = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        totals[name.split('.')[0]] += self_us
+    return {name: us / 1000 for name, us in totals.items()}
+
+
+def main(runs, save=None, compare=None):
+    for _ in range(WARMUP_RUNS):
+        run_once()
+    results = [run_once() for _ in range(runs)]
+
+    wall_ms = statistics.median(wall for wall, _ in results) * 1000
+    app_ms = statistics.median(modules['app'][1] for _, modules in results) / 1000
+    packages = defaultdict(list)
+    for _, modules in results:
+        for name, ms in by_package(modules).items():
+            packages[name].append(ms)
+    packages = {name: statistics.median(values) for name, values in packages.items()}
+
+    print(f'{runs} cold starts (median)')
+    print(f'interpreter + worker boot: {wall_ms:8.1f} ms')
+    print(f'import app:                {app_ms:8.1f} ms')
+    print('slowest packages (self time):')
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:TOP_PACKAGES]:
+        print(f'  {name:30} {ms:8.1f} ms')
+
+    summary = {'wall_ms': round(wall_ms, 1), 'app_ms': round(app_ms, 1),
+               'packages': {name: round(ms, 1) for name, ms in packages.items()}}
+    if save:
+        with open(save, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+
+    if compare:
+        with open(compare) as f:
+            before = json.load(f)
+        print(f"import app: {before['app_ms']:.1f} ms -> {app_ms:.1f} ms "
+              f"({(app_ms / before['app_ms'] - 1) * 100:+.0f}%)")
+        new = sorted(set(packages) - set(before['packages']), key=lambda name: -packages[name])
+        if new:
+            print('newly imported: ' + ', '.join(f'{name} ({packages[name]:.1f} ms)' for name in new[:10]))
+        if app_ms > before['app_ms'] * SLOWER_BY:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for flag in ('--save', '--compare'):
+        if flag in args:
+            i = args.index(flag)
+            options[flag[2:]] = args[i + 1]
+            del args[i:i + 2]
+    sys.exit(main(int(args[0]) if args else 5, **options))
@@ -0,0 +1,276 @@
+'''Bulk import of reservations from a CSV file.
+
+The CSV has one ride per line and a header naming ResForm's fields
+(passenger_name, passenger_phone, vehicle_type, PU_date, PU_time, ...).
+Rows are checked against the same rules as ResForm, which are read from
+the form class once (required, max length, vehicle type choices, date and
+time formats), a column at a time over a chunk of rows. Bad rows are
+reported by line number; the good ones are inserted for the chosen user
+with COPY on Postgres and a single executemany elsewhere, one transaction
+per IMPORT_CHUNK_SIZE rows. Their addresses are looked up or added in the
+addresses table a chunk at a time. Rows with no vehicle of their type free
+at the pickup time are reported as errors too (fleet.reserve).
+
+Uploads must be UTF-8 (a BOM is fine) and are checked before anything
+is imported, so a bad byte is reported instead of failing the import
+half way, after its first chunks were committed.
+
+Imported rides do not queue an SMS, the same as bookings made by an admin
+through new_res.'''
+
+import codecs
+import csv
+import inspect
+import io
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+from wtforms import DateField, SelectField, TimeField
+from wtforms.fields.core import UnboundField
+from wtforms.validators import DataRequired, InputRequired, Length
+
+from addresses import link_records, ADDRESS_COLUMNS
+from fleet import reserve
+from forms import ResForm
+from models import db, Reservation
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+# the import page lists the first errors only
+MAX_REPORTED_ERRORS = 200
+
+FULL_MESSAGE = 'no vehicle of that type is free at that time'
+
+RowError = namedtuple('RowError', ('line', 'field', 'message'))
+
+ImportResult = namedtuple('ImportResult', ('imported', 'rows', 'errors'))
+
+
+class FieldRule:
+    '''What ResForm accepts for one field.'''
+
+    def __init__(self, name, unbound):
+        self.name = name
+        self.label = unbound.args[0] if unbound.args else name
+        validators = unbound.kwargs.get('validators', [])
+
+        self.required = any(isinstance(v, (InputRequired, DataRequired)) for v in validators)
+        self.min_length = max([v.min for v in validators if isinstance(v, Length)] or [-1])
+        self.max_length = min([v.max for v in validators if isinstance(v, Length) and v.max != -1] or [-1])
+
+        self.choices = None
+        if issubclass(unbound.field_class, SelectField) and unbound.kwargs.get('validate_choice', True):
+            self.choices = {choice if isinstance(choice, str) else choice[0]
+                            for choice in unbound.kwargs.get('choices', [])}
+            # a blank select is not one of its choices either
+            self.required = True
+
+        self.parse = None
+        if issubclass(unbound.field_class, (DateField, TimeField)):
+            formats = (unbound.kwargs.get('format')
+                       or inspect.signature(unbound.field_class).parameters['format'].default)
+            if isinstance(formats, str):
+                formats = [formats]
+            is_date = issubclass(unbound.field_class, DateField)
+            self.parse = lambda value: parse_any(value, formats, is_date)
+
+    def check(self, values):
+        '''Validate a column of stripped strings.
+        Returns (index, message) for each bad value and the parsed column.'''
+
+        bad = []
+        parsed = list(values)
+
+        if self.parse is not None:
+            # spreadsheets repeat the same few dates and times, parse each once
+            cache = {value: self.parse(value) for value in set(values) if value}
+            for i, value in enumerate(values):
+                if value:
+                    parsed[i] = cache[value]
+                    if parsed[i] is None:
+                        bad.append((i, f'{self.label}: not a valid value'))
+
+        for i, value in enumerate(values):
+            if not value:
+                if self.required:
+                    bad.append((i, f'{self.label}: this field is required'))
+                parsed[i] = None
+                continue
+            if self.choices is not None and value not in self.choices:
+                bad.append((i, f'{self.label}: not a valid choice'))
+            if len(value) < self.min_length or (self.max_length != -1 and len(value) > self.max_length):
+                bad.append((i, f'{self.label}: wrong length'))
+
+        return bad, parsed
+
+
+def parse_any(value, formats, is_date):
+    for fmt in formats:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return parsed.date() if is_date else parsed.time()
+    return None
+
+
+def form_rules(form_class):
+    '''A FieldRule for every field of `form_class`, in form order.'''
+
+    return [FieldRule(name, field) for name, field in vars(form_class).items()
+            if isinstance(field, UnboundField)]
+
+
+RULES = form_rules(ResForm)
+
+FIELD_NAMES = [rule.name for rule in RULES]
+
+# columns written by the import: the form's fields but the address parts,
+# which link_records() turns into PU_address_id and DO_address_id
+COLUMNS = ([name for name in FIELD_NAMES if name not in ADDRESS_COLUMNS['PU'] + ADDRESS_COLUMNS['DO']]
+           + ['user_id', 'created_date', 'updated_at', 'PU_address_id', 'DO_address_id'])
+
+
+def full_address(record, prefix):
+    '''The search-box address the form fills in, rebuilt from its parts when the file has none.'''
+
+    parts = [record[f'{prefix}_{part}'] for part in ('street', 'city', 'state', 'zip', 'country')]
+    return ', '.join(part for part in parts if part)
+
+
+def validate_chunk(rows, first_line):
+    '''Check a chunk of CSV rows (dicts) column by column.
+    Returns (records ready to insert, RowErrors).'''
+
+    messages = {}
+    columns = {}
+    for rule in RULES:
+        values = [(row.get(rule.name) or '').strip() for row in rows]
+        bad, columns[rule.name] = rule.check(values)
+        for i, message in bad:
+            messages.setdefault(i, []).append(RowError(first_line + i, rule.name, message))
+
+    records = []
+    for i in range(len(rows)):
+        if i in messages:
+            continue
+        record = {name: columns[name][i] for name in FIELD_NAMES}
+        record['PU_address'] = record['PU_address'] or full_address(record, 'PU')
+        record['DO_address'] = record['DO_address'] or full_address(record, 'DO')
+        records.append(record)
+
+    errors = [error for i in sorted(messages) for error in messages[i]]
+    return records, errors
+
+
+def copy_records(records):
+    '''Insert with COPY on the session's own connection, inside its transaction.'''
+
+    ids = db.session.execute(text("SELECT nextval('res_seq') FROM generate_series(1, :n)"),
+                             {'n': len(records)}).scalars().all()
+    columns = ['id'] + COLUMNS
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for res_id, record in zip(ids, records):
+        writer.writerow([res_id] + [record[name] for name in columns[1:]])
+    buffer.seek(0)
+
+    quoted = ', '.join(f'"{name}"' for name in columns)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY reservations ({quoted}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def insert_records(records):
+    if not records:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        copy_records(records)
+    else:
+        db.session.execute(Reservation.__table__.insert(), records)
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_reservations(csv_file, user_id, chunk_size=IMPORT_CHUNK_SIZE):
+    '''Import every valid ride in `csv_file` (a text file object) for `user_id`.
+    Each chunk is committed on its own. Returns an ImportResult.'''
+
+    reader = csv.DictReader(csv_file)
+    missing = [rule.name for rule in RULES if rule.required and rule.name not in (reader.fieldnames or [])]
+    if missing:
+        return ImportResult(0, 0, [RowError(1, name, 'column is missing') for name in missing])
+
+    imported = 0
+    total = 0
+    errors = []
+    # line 1 is the header
+    line = 2
+
+    for rows in chunks(reader, chunk_size):
+        records, chunk_errors = validate_chunk(rows, line)
+
+        # the lines of the valid records, in order
+        bad_lines = {error.line for error in chunk_errors}
+        lines = [number for number in range(line, line + len(rows)) if number not in bad_lines]
+        fit = reserve([(record['vehicle_type'], record['PU_date'], record['PU_time']) for record in records])
+        if not all(fit):
+            chunk_errors = sorted(chunk_errors + [RowError(number, 'PU_time', FULL_MESSAGE)
+                                                  for number, ok in zip(lines, fit) if not ok],
+                                  key=lambda error: error.line)
+            records = [record for record, ok in zip(records, fit) if ok]
+
+        line += len(rows)
+        total += len(rows)
+        errors.extend(chunk_errors[:MAX_REPORTED_ERRORS - len(errors)])
+
+        now = datetime.utcnow()
+        link_records(db.session.connection(), records)
+        for record in records:
+            record.update(user_id=user_id, created_date=now, updated_at=now)
+
+        insert_records(records)
+        db.session.commit()
+        imported += len(records)
+
+    return ImportResult(imported, total, errors)
+
+
+def undecodable_line(stream, encoding='utf-8-sig', block_size=64 * 1024):
+    '''The line of the first bytes of `stream` (binary, seekable) that are
+    not `encoding`, None if it all decodes. Rewinds the stream.'''
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    line = 1
+    try:
+        while True:
+            block = stream.read(block_size)
+            line += decoder.decode(block, final=not block).count('\n')
+            if not block:
+                return None
+    except UnicodeDecodeError as error:
+        return line + error.object[:error.start].count(b'\n')
+    finally:
+        stream.seek(0)
+
+
+def import_upload(stream, user_id, chunk_size=IMPORT_CHUNK_SIZE):
+    '''import_reservations() for an uploaded file (a binary stream).'''
+
+    line = undecodable_line(stream)
+    if line is not None:
+        return ImportResult(0, 0, [RowError(line, '', 'the file is not UTF-8 text, save it as "CSV UTF-8"')])
+
+    csv_file = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return import_reservations(csv_file, user_id, chunk_size)
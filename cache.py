@@ -0,0 +1,30 @@
+'''Small in-process caches.'''
+
+import time
+
+
+class TTLCache:
+    '''Dict whose entries expire `ttl` seconds after they were set.'''
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < self.clock():
+            self.entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(self.entries) > 10000:
+            self.entries.clear()
+        self.entries[key] = (value, self.clock() + self.ttl)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
@@ -0,0 +1,83 @@
+'''Settings for create_app(), one class per environment.
+
+    create_app()               # FLASK_CONFIG (or FLASK_ENV), default production
+    create_app('development')  # debug toolbar on
+    create_app('testing')      # TEST_DATABASE_URL, default postgresql:///book_a_ride_test
+
+Values come from the environment (or secret.py for the e-mail account),
+read once when this module is imported.'''
+
+import os
+
+try:
+    from secret import em_user, em_pass
+except:
+    em_user = os.environ.get("EM_USER")
+    em_pass = os.environ.get("EM_PASS")
+
+
+def database_url(default):
+    uri = os.environ.get('DATABASE_URL') or default
+    # Heroku still hands out postgres:// URLs, SQLAlchemy 1.4 wants postgresql://
+    return uri.replace("postgres://", "postgresql://", 1)
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    SQLALCHEMY_DATABASE_URI = database_url('postgresql:///book_a_ride')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    # database connections, see db_pool.py
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+    DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 20))
+    DB_POOL_SIZE = os.environ.get('DB_POOL_SIZE')
+    DB_MAX_OVERFLOW = os.environ.get('DB_MAX_OVERFLOW')
+    DB_ASYNC_POOL_SIZE = int(os.environ.get('DB_ASYNC_POOL_SIZE', 10))
+    # set by asgi.create_asgi_app(): the worker has the async engine too
+    SERVE_ASGI = False
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+
+    # proxies in front of the app whose X-Forwarded-For hop is trusted, 0 for none
+    PROXY_FIX_X_FOR = 0
+
+    # over a view's query budget: raise, or only log (query_budget.py)
+    QUERY_BUDGET_STRICT = False
+
+    DEBUG_TB_ENABLED = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    EMAIL_ADDRESS = em_user
+    EMAIL_PASSWORD = em_pass
+    SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 465))
+    SMTP_SSL = os.environ.get('SMTP_SSL', 'true').lower() != 'false'
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))
+
+
+class ProductionConfig(Config):
+    # the Heroku router: request.remote_addr is the client it forwarded for
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 1))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    DEBUG_TB_ENABLED = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    QUERY_BUDGET_STRICT = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'postgresql:///book_a_ride_test'
+
+
+CONFIGS = {
+    'production': ProductionConfig,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
@@ -0,0 +1,205 @@
+'''Database connection pool: sizing, timeouts, PgBouncer mode, and its numbers.
+
+connect_db() builds SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings in
+config.py unless the app sets them itself:
+
+- pool_size / max_overflow: each gunicorn worker gets GUNICORN_THREADS +
+  SMTP_POOL_SIZE connections (one per request thread, one per mailer
+  thread for its status updates) and may open more, up to its share of
+  DB_MAX_CONNECTIONS across WEB_CONCURRENCY workers. DB_POOL_SIZE /
+  DB_MAX_OVERFLOW override.
+- pool_pre_ping: a connection is tested before it is handed out, so after
+  a Postgres failover or restart the dead ones are replaced instead of
+  failing a request each.
+- pool_recycle: connections older than DB_POOL_RECYCLE seconds are
+  reopened, before a load balancer or PgBouncer drops them on us.
+- statement_timeout: DB_STATEMENT_TIMEOUT_MS per statement, 0 for none.
+
+The asyncio engine of asgi.py (asyncpg) gets the same settings, except
+that its pool is DB_ASYNC_POOL_SIZE: one process serves many requests at
+once there, not one per thread. An asgi.py worker has both engines
+(SERVE_ASGI), so both pools come out of its share and the overflow left
+is split between them.
+
+With DB_PGBOUNCER=true the app sits behind PgBouncer in transaction
+pooling mode, where consecutive transactions of one client can run on
+different server connections. Session state cannot be relied on there, so
+the statement timeout is set with SET LOCAL at the start of every
+transaction instead of as a startup option (which PgBouncer refuses),
+and server-side prepared statements are turned off for the drivers that
+make them (asyncpg; psycopg2 never does).
+
+The pool counts how long requests wait for a connection; pool_status()
+returns those numbers with the connections in use, per worker process.'''
+
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+log = logging.getLogger(__name__)
+
+# a checkout waiting longer than this is logged, the pool is too small
+SLOW_CHECKOUT_SECONDS = 0.1
+
+
+class PoolStats:
+    '''Checkout counters of one pool, updated from any thread.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            if waited >= SLOW_CHECKOUT_SECONDS:
+                self.slow += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+class MeteredPool:
+    '''Mixed into a QueuePool: times every checkout, including opening a new connection.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        waited = time.perf_counter() - start
+        self.stats.record(waited)
+        if waited >= SLOW_CHECKOUT_SECONDS:
+            log.warning('waited %.0f ms for a database connection (%d in use of %d + %d overflow)',
+                        waited * 1000, self.checkedout(), self.size(), self._max_overflow)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        # dispose() makes a new pool, the counts go on
+        pool.stats = self.stats
+        return pool
+
+
+class MeteredQueuePool(MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def base_pool_size(config, is_async=False):
+    if config['DB_POOL_SIZE']:
+        return int(config['DB_POOL_SIZE'])
+    if is_async:
+        return config['DB_ASYNC_POOL_SIZE']
+    return config['GUNICORN_THREADS'] + config['SMTP_POOL_SIZE']
+
+
+def pool_sizing(config, is_async=False):
+    '''(pool_size, max_overflow) of one engine of one worker.'''
+
+    pool_size = base_pool_size(config, is_async)
+    if config['DB_MAX_OVERFLOW'] is not None:
+        return pool_size, int(config['DB_MAX_OVERFLOW'])
+
+    share = config['DB_MAX_CONNECTIONS'] // max(config['WEB_CONCURRENCY'], 1)
+    if not config['SERVE_ASGI']:
+        return pool_size, max(share - pool_size, 0)
+
+    spare = max(share - base_pool_size(config) - base_pool_size(config, is_async=True), 0)
+    return pool_size, spare // 2 if is_async else spare - spare // 2
+
+
+def engine_options(config, uri=None):
+    '''SQLALCHEMY_ENGINE_OPTIONS for the app's config, or for another URL
+    of the same database (asgi.py's asyncpg one). Only Postgres gets a
+    sized pool; SQLite (some tests) keeps SQLAlchemy's own.'''
+
+    url = make_url(uri or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'postgresql':
+        return {'pool_pre_ping': True}
+
+    driver = url.get_driver_name()
+    is_async = driver == 'asyncpg'
+    pool_size, max_overflow = pool_sizing(config, is_async)
+    options = {
+        'poolclass': MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+        # reuse the most recent connection, so the surplus ones go idle and get recycled
+        'pool_use_lifo': True,
+        'connect_args': {},
+    }
+
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if config['DB_PGBOUNCER']:
+        if is_async:
+            options['connect_args']['statement_cache_size'] = 0
+            options['connect_args']['prepared_statement_cache_size'] = 0
+    elif timeout and is_async:
+        options['connect_args']['server_settings'] = {'statement_timeout': str(int(timeout))}
+    elif timeout and driver == 'psycopg2':
+        options['connect_args']['options'] = f'-c statement_timeout={int(timeout)}'
+    return options
+
+
+def set_local_timeout(engine, timeout):
+    '''SET LOCAL statement_timeout at the start of every transaction, for PgBouncer.'''
+
+    statement = f'SET LOCAL statement_timeout = {int(timeout)}'
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.exec_driver_sql(statement)
+
+
+def configure_engine(config, engine):
+    '''What the engine options cannot do; called once the engine exists
+    (the sync_engine of an asyncio one).'''
+
+    if (config['DB_PGBOUNCER'] and config['DB_STATEMENT_TIMEOUT_MS']
+            and engine.dialect.name == 'postgresql'):
+        set_local_timeout(engine, config['DB_STATEMENT_TIMEOUT_MS'])
+
+
+def pool_status(engine):
+    '''Connections and checkout waits of `engine`'s pool in this process.'''
+
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if not isinstance(pool, QueuePool):
+        return status
+
+    status.update(size=pool.size(), max_overflow=pool._max_overflow,
+                  in_use=pool.checkedout(), idle=pool.checkedin(),
+                  overflow=max(pool.overflow(), 0))
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        with stats.lock:
+            status.update(checkouts=stats.checkouts, timeouts=stats.timeouts,
+                          slow_checkouts=stats.slow,
+                          wait_ms_total=round(stats.wait_total * 1000, 1),
+                          wait_ms_avg=round(stats.wait_total * 1000 / max(stats.checkouts, 1), 2),
+                          wait_ms_max=round(stats.wait_max * 1000, 1))
+    return status
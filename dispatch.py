@@ -0,0 +1,260 @@
+'''Assign a day's reservations to drivers.
+
+Rides are taken in pick-up order, ROUND_MINUTES of pick-ups at a time (a
+driver does at most one of them). For each round a drivers x rides cost
+matrix is built with NumPy from where and when every driver is free, how
+far they have to drive to the pick-up and whether their vehicle fits:
+
+    cost = deadhead minutes + WAIT_WEIGHT * idle minutes
+           + UPGRADE_PENALTY * (vehicle class - ride class)
+
+A driver who cannot be at the pick-up ARRIVE_EARLY_MINUTES early, whose
+shift would end during the trip, or whose vehicle is smaller than the one
+booked costs INFEASIBLE. The round is solved with the Hungarian algorithm
+(inner loops vectorized), the drivers move on to the drop-offs, and the
+next round starts. Rides nobody could take are tried once more with the
+next round, then left unassigned.
+
+Travel times come from the haversine distance between the cached address
+coordinates (see quotes.py and geocoding.py); when a coordinate is
+missing the defaults below are used. The result is written back with one
+executemany UPDATE. Run it from the dispatch view or for one day with:
+
+    python dispatch.py 2022-07-15'''
+
+import os
+import sys
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+from sqlalchemy import bindparam
+from sqlalchemy.orm import aliased
+
+from models import db, Address, Driver, Reservation, Vehicle
+from quotes import haversine_miles, ROAD_FACTOR, VEHICLE_INDEX
+
+AVERAGE_SPEED_MPH = float(os.environ.get('DISPATCH_AVERAGE_SPEED_MPH', 25))
+ROUND_MINUTES = int(os.environ.get('DISPATCH_ROUND_MINUTES', 30))
+# time at the curb, loading and unloading
+STOP_MINUTES = 10
+ARRIVE_EARLY_MINUTES = 5
+DEFAULT_DEADHEAD_MINUTES = 20
+DEFAULT_TRIP_MINUTES = 60
+
+WAIT_WEIGHT = 0.1
+UPGRADE_PENALTY = 20.0
+INFEASIBLE = 1e6
+
+Assignment = namedtuple('Assignment', ('assigned', 'unassigned'))
+
+
+def hungarian(cost):
+    '''Minimum cost assignment for a rows x columns matrix. Returns
+    (rows, columns) index arrays of the matched pairs; every row is matched
+    when rows <= columns, every column otherwise.
+
+    Shortest augmenting path version (O(n^2 m)), with the scan over the
+    columns done on whole arrays.'''
+
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # potentials, and the row (1-based, 0 = none) matched to each column;
+    # column 0 is a sentinel
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for row in range(1, n + 1):
+        match[0] = row
+        col = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while match[col] != 0:
+            used[col] = True
+            i = match[col]
+            free = ~used
+            free[0] = False
+
+            slack = cost[i - 1] - u[i] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = col
+
+            candidates = np.where(free[1:], min_slack[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            u[match[used]] += delta
+            v[used] -= delta
+            min_slack[free] -= delta
+            col = next_col
+
+        # flip the augmenting path
+        while col != 0:
+            previous = way[col]
+            match[col] = match[previous]
+            col = previous
+
+    cols = np.flatnonzero(match[1:])
+    rows = match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def travel_minutes(lat1, lng1, lat2, lng2, default):
+    '''Driving minutes between points in degrees (arrays broadcast), `default` where a point is unknown.'''
+
+    miles = haversine_miles(np.radians(lat1), np.radians(lng1), np.radians(lat2), np.radians(lng2)) * ROAD_FACTOR
+    minutes = miles / AVERAGE_SPEED_MPH * 60
+    return np.where(np.isnan(minutes), default, minutes)
+
+
+def minute_of_day(t):
+    return t.hour * 60 + t.minute
+
+
+def vehicle_class(vehicle_type):
+    '''Bigger vehicles have higher classes; unknown types fit in anything.'''
+    return VEHICLE_INDEX.get(vehicle_type, 0)
+
+
+def load_rides(day):
+    '''Arrays describing the day's rides, in pick-up order.'''
+
+    pickup = aliased(Address)
+    dropoff = aliased(Address)
+    rows = (db.session.query(Reservation.id, Reservation.PU_time, Reservation.vehicle_type,
+                             pickup.latitude, pickup.longitude, dropoff.latitude, dropoff.longitude)
+            .outerjoin(pickup, Reservation.PU_address_id == pickup.id)
+            .outerjoin(dropoff, Reservation.DO_address_id == dropoff.id)
+            .filter(Reservation.PU_date == day)
+            .order_by(Reservation.PU_time, Reservation.id)
+            .all())
+
+    ids, times, vehicle_types, *coordinates = zip(*rows) if rows else ([],) * 7
+    pu_lat, pu_lng, do_lat, do_lng = (np.array(column, dtype=float) for column in coordinates)
+    start = np.array([minute_of_day(t) for t in times], dtype=float)
+
+    return dict(
+        ids=list(ids),
+        start=start,
+        end=start + travel_minutes(pu_lat, pu_lng, do_lat, do_lng, DEFAULT_TRIP_MINUTES) + STOP_MINUTES,
+        vehicle_class=np.array([vehicle_class(kind) for kind in vehicle_types], dtype=float),
+        pu_lat=pu_lat, pu_lng=pu_lng, do_lat=do_lat, do_lng=do_lng,
+    )
+
+
+def load_drivers():
+    '''Arrays describing the active drivers that have a vehicle.'''
+
+    rows = (db.session.query(Driver.id, Driver.shift_start, Driver.shift_end,
+                             Driver.base_latitude, Driver.base_longitude, Vehicle.vehicle_type)
+            .join(Vehicle, Driver.vehicle_id == Vehicle.id)
+            .filter(Driver.active == True)
+            .order_by(Driver.id)
+            .all())
+
+    ids, shift_start, shift_end, lat, lng, vehicle_types = zip(*rows) if rows else ([],) * 6
+    return dict(
+        ids=list(ids),
+        free_at=np.array([minute_of_day(t) for t in shift_start], dtype=float),
+        shift_end=np.array([minute_of_day(t) for t in shift_end], dtype=float),
+        lat=np.array(lat, dtype=float),
+        lng=np.array(lng, dtype=float),
+        vehicle_class=np.array([vehicle_class(kind) for kind in vehicle_types], dtype=float),
+    )
+
+
+def cost_matrix(drivers, rides, index):
+    '''drivers x rides[index] costs.'''
+
+    deadhead = travel_minutes(drivers['lat'][:, None], drivers['lng'][:, None],
+                              rides['pu_lat'][None, index], rides['pu_lng'][None, index],
+                              DEFAULT_DEADHEAD_MINUTES)
+    idle = rides['start'][None, index] - ARRIVE_EARLY_MINUTES - (drivers['free_at'][:, None] + deadhead)
+    upgrade = drivers['vehicle_class'][:, None] - rides['vehicle_class'][None, index]
+
+    cost = deadhead + WAIT_WEIGHT * idle + UPGRADE_PENALTY * upgrade
+    infeasible = ((idle < 0)
+                  | (upgrade < 0)
+                  | (rides['end'][None, index] > drivers['shift_end'][:, None]))
+    cost[infeasible] = INFEASIBLE
+    return cost
+
+
+def plan_day(drivers, rides):
+    '''Ride index -> driver index for every ride that could be assigned.
+    Updates the drivers' free_at and position as rides are given out.'''
+
+    plan = {}
+    count = len(rides['ids'])
+    if not drivers['ids']:
+        return plan
+
+    left_over = np.zeros(0, dtype=int)
+    first = 0
+    while first < count:
+        last = max(int(np.searchsorted(rides['start'], rides['start'][first] + ROUND_MINUTES)), first + 1)
+        index = np.concatenate([left_over, np.arange(first, last)])
+
+        cost = cost_matrix(drivers, rides, index)
+        rows, cols = hungarian(cost)
+        ok = cost[rows, cols] < INFEASIBLE
+        rows, cols = rows[ok], cols[ok]
+
+        # this round's new rides that nobody took get one more try
+        taken = np.zeros(len(index), dtype=bool)
+        taken[cols] = True
+        new = slice(len(left_over), None)
+        left_over = index[new][~taken[new]]
+
+        cols = index[cols]
+        plan.update(zip(cols.tolist(), rows.tolist()))
+
+        # the drivers who got a ride are free again at its drop-off
+        drivers['free_at'][rows] = rides['end'][cols]
+        drivers['lat'][rows] = rides['do_lat'][cols]
+        drivers['lng'][rows] = rides['do_lng'][cols]
+
+        first = last
+
+    return plan
+
+
+def assign_drivers(day):
+    '''Assign every reservation picking up on `day` to a driver, replacing
+    earlier assignments for that day, and commit. Returns an Assignment
+    (count assigned, ids of the rides left without a driver).'''
+
+    rides = load_rides(day)
+    drivers = load_drivers()
+    plan = plan_day(drivers, rides)
+
+    values = [dict(res_id=res_id, driver_id=drivers['ids'][plan[i]] if i in plan else None)
+              for i, res_id in enumerate(rides['ids'])]
+    if values:
+        table = Reservation.__table__
+        db.session.execute(table.update()
+                           .where(table.c.id == bindparam('res_id'))
+                           .values(driver_id=bindparam('driver_id')),
+                           values)
+    db.session.commit()
+
+    return Assignment(len(plan), [res_id for i, res_id in enumerate(rides['ids']) if i not in plan])
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        result = assign_drivers(date.fromisoformat(sys.argv[1]))
+        print(f'{result.assigned} rides assigned, {len(result.unassigned)} left without a driver')
@@ -0,0 +1,98 @@
+'''Booking confirmation e-mail rendering.
+
+email.txt is parsed once into a list of literal text and {field} slots and
+kept in memory. It is parsed again only when the file's mtime changes.
+Rendering fills the slots in a single pass and HTML-escapes every value.'''
+
+import os
+import re
+import threading
+
+from markupsafe import escape
+
+EMAIL_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email.txt')
+
+FIELD_RE = re.compile(r'\{(\w+)\}')
+
+
+class CompiledTemplate:
+    '''A template split into segments: even indexes are literal text,
+    odd indexes are field names.'''
+
+    def __init__(self, source):
+        self.segments = FIELD_RE.split(source)
+        self.fields = set(self.segments[1::2])
+
+    def render(self, values):
+        '''Fill every {field} from `values`. Missing or None values render empty.'''
+
+        out = []
+        for i, segment in enumerate(self.segments):
+            if i % 2:
+                value = values.get(segment)
+                out.append('' if value is None else str(escape(value)))
+            else:
+                out.append(segment)
+        return ''.join(out)
+
+
+class EmailTemplate:
+    '''Loads and caches a CompiledTemplate, reloading it when the file changes.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.compiled = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        mtime = os.stat(self.path).st_mtime_ns
+
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    with open(self.path) as f:
+                        # lines used to be joined with a space, keep the same output
+                        source = ' '.join(f.readlines())
+                    self.compiled = CompiledTemplate(source)
+                    self.mtime = mtime
+
+        return self.compiled
+
+
+confirmation_template = EmailTemplate(EMAIL_TEMPLATE_PATH)
+
+
+def confirmation_fields(user, res):
+    '''Values for the {field} slots of the confirmation e-mail.'''
+
+    return {
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'phone': user.phone,
+        'conf': res.id,
+        'PU_date': res.PU_date.strftime('%A, %B %d, %Y'),
+        'PU_time': res.PU_time.strftime('%I:%M %p'),
+        'passenger_name': res.passenger_name,
+        'passenger_phone': res.passenger_phone,
+        'vehicle_type': res.vehicle_type,
+        'PU_address': res.PU_address,
+        'DO_address': res.DO_address,
+        'trip_notes': res.trip_notes,
+    }
+
+
+def render_confirmation(user, res):
+    '''HTML confirmation e-mail for one reservation.'''
+
+    return confirmation_template.get().render(confirmation_fields(user, res))
+
+
+def render_confirmations(reservations):
+    '''HTML confirmation e-mails for many reservations, e.g. for mass-mailing.
+    Each reservation is addressed to its own customer (res.user); load the
+    users with the reservations to avoid a query per row.
+    Returns a list of (reservation, html).'''
+
+    template = confirmation_template.get()
+    return [(res, template.render(confirmation_fields(res.user, res))) for res in reservations]
@@ -0,0 +1,126 @@
+'''Reservation exports for accounting, as CSV or NDJSON.
+
+Rows are read through a server-side cursor (yield_per, which turns on
+stream_results) as plain column tuples rather than ORM objects, so
+nothing piles up in the session's identity map, and written out a batch
+at a time. Memory stays flat however many reservations match.'''
+
+import csv
+import io
+import json
+import os
+from datetime import date, time, datetime
+
+from sqlalchemy.orm import aliased
+
+from models import db, User, Reservation, Address
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+pickup = aliased(Address)
+dropoff = aliased(Address)
+
+# (header, column) in export order
+EXPORT_COLUMNS = (
+    ('res_id', Reservation.id),
+    ('created_date', Reservation.created_date),
+    ('customer_id', User.id),
+    ('customer_username', User.username),
+    ('customer_first_name', User.first_name),
+    ('customer_last_name', User.last_name),
+    ('customer_email', User.email),
+    ('passenger_name', Reservation.passenger_name),
+    ('passenger_phone', Reservation.passenger_phone),
+    ('passenger_email', Reservation.passenger_email),
+    ('vehicle_type', Reservation.vehicle_type),
+    ('PU_date', Reservation.PU_date),
+    ('PU_time', Reservation.PU_time),
+    ('PU_address', Reservation.PU_address),
+    ('PU_city', pickup.city),
+    ('PU_state', pickup.state),
+    ('PU_zip', pickup.zip),
+    ('DO_address', Reservation.DO_address),
+    ('DO_city', dropoff.city),
+    ('DO_state', dropoff.state),
+    ('DO_zip', dropoff.zip),
+    ('trip_notes', Reservation.trip_notes),
+)
+
+HEADERS = [header for header, _ in EXPORT_COLUMNS]
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def export_rows(start=None, end=None, vehicle_type=None, user_id=None):
+    '''Matching reservations joined with their customer and addresses, in pickup order,
+    as column tuples streamed EXPORT_BATCH_SIZE at a time.'''
+
+    query = (db.session.query(*[column for _, column in EXPORT_COLUMNS])
+             .select_from(Reservation)
+             .outerjoin(Reservation.user)
+             .outerjoin(pickup, Reservation.PU_address_id == pickup.id)
+             .outerjoin(dropoff, Reservation.DO_address_id == dropoff.id))
+
+    if start is not None:
+        query = query.filter(Reservation.PU_date >= start)
+    if end is not None:
+        query = query.filter(Reservation.PU_date <= end)
+    if vehicle_type:
+        query = query.filter(Reservation.vehicle_type == vehicle_type)
+    if user_id is not None:
+        query = query.filter(Reservation.user_id == user_id)
+
+    return (query
+            .order_by(Reservation.PU_date, Reservation.PU_time, Reservation.id)
+            .yield_per(EXPORT_BATCH_SIZE))
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(rows, batch_size=EXPORT_BATCH_SIZE):
+    '''CSV text, the header line first, then one chunk per batch of rows.'''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(HEADERS)
+    for batch in batches(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def json_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'cannot export {type(value).__name__}')
+
+
+def iter_ndjson(rows, batch_size=EXPORT_BATCH_SIZE):
+    '''One JSON object per line, one chunk per batch of rows.'''
+
+    encoder = json.JSONEncoder(default=json_value)
+    for batch in batches(rows, batch_size):
+        yield ''.join(encoder.encode(dict(zip(HEADERS, row))) + '\n' for row in batch)
+
+
+WRITERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+}
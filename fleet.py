@@ -0,0 +1,254 @@
+'''Fleet capacity checks for new bookings.
+
+Pickup times are kept in memory as a sorted list of minutes per vehicle
+type and day, so checking a new booking is a couple of binary searches
+instead of a scan of the day's reservations. A booking keeps one vehicle
+busy for the type's avg_trip_minutes; it fits if fewer than `vehicles`
+trips are under way at every moment of that trip.
+
+Each gunicorn worker has its own copy. Bookings made by this process are
+added right away; a day is reloaded from the database once its copy is
+older than FLEET_SCHEDULE_TTL_SECONDS, which bounds how long another
+worker's booking can go unseen. That makes it a quick first answer for
+the booking form, not a guarantee. Within the TTL a worker's copy misses
+what the other workers (and the bulk import, the repeating bookings and
+edits) booked since, and even a fresh copy is read outside the
+transaction that inserts the trip, so two workers can each see the last
+vehicle free and both take it. So every path that writes a trip also
+calls reserve() in the transaction that commits it: it locks the type's
+fleet_capacity row, which serializes the bookings of that type, and
+reads only the booked pickups that can overlap the new trips (an index
+range on vehicle_type, PU_date, PU_time) from the database.'''
+
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import time as clock, timedelta
+
+from sqlalchemy import and_, or_
+
+from models import db, Reservation, FleetCapacity
+
+SCHEDULE_TTL_SECONDS = int(os.environ.get('FLEET_SCHEDULE_TTL_SECONDS', 60))
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def minute_of_day(t):
+    return t.hour * 60 + t.minute
+
+
+def load_day(vehicle_type, day):
+    '''Sorted pickup minutes of one vehicle type's trips on one day.'''
+
+    rows = (db.session.query(Reservation.PU_time)
+            .filter(Reservation.vehicle_type == vehicle_type, Reservation.PU_date == day)
+            .all())
+    return sorted(minute_of_day(row[0]) for row in rows)
+
+
+def starts_between(minutes_of, day, lo, hi):
+    '''Pickup minutes in [lo, hi), counted from midnight of `day`, where
+    `minutes_of(day)` gives one day's sorted pickup minutes. The range may
+    reach into the day before or after.'''
+
+    starts = []
+    for offset in (-1, 0, 1):
+        base = offset * MINUTES_PER_DAY
+        if hi <= base or lo >= base + MINUTES_PER_DAY:
+            continue
+        minutes = minutes_of(day + timedelta(days=offset))
+        i = bisect_left(minutes, lo - base)
+        j = bisect_left(minutes, hi - base)
+        starts.extend(m + base for m in minutes[i:j])
+    return starts
+
+
+def fits(minutes_of, day, start, vehicles, duration):
+    '''Can one more trip start at minute `start` of `day`, with `vehicles`
+    vehicles each busy `duration` minutes per trip?'''
+
+    # every booked trip that shares at least one minute with the new one
+    overlapping = starts_between(minutes_of, day, start - duration + 1, start + duration)
+
+    if len(overlapping) < vehicles:
+        return True
+
+    # Busy vehicles only go up when a trip starts, so it is enough to
+    # count the trips under way at the new pickup and at every later
+    # pickup inside the new trip.
+    for point in [start] + [s for s in overlapping if s > start]:
+        under_way = bisect_right(overlapping, point) - bisect_left(overlapping, point - duration + 1)
+        if under_way >= vehicles:
+            return False
+
+    return True
+
+
+def load_capacity(vehicle_type):
+    '''(vehicles, avg_trip_minutes) for a vehicle type, None if it is not limited.'''
+
+    row = FleetCapacity.query.get(vehicle_type)
+    if row is None:
+        return None
+    return row.vehicles, row.avg_trip_minutes
+
+
+class FleetSchedule:
+    '''Per vehicle type and day, the sorted pickup minutes of booked trips.'''
+
+    def __init__(self, ttl=SCHEDULE_TTL_SECONDS, load_day=load_day, load_capacity=load_capacity,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.load_day = load_day
+        self.load_capacity = load_capacity
+        self.clock = clock
+        self.days = {}
+        self.capacity = {}
+        self.lock = threading.Lock()
+
+    def _day(self, vehicle_type, day):
+        key = (vehicle_type, day)
+        entry = self.days.get(key)
+        if entry is None or self.clock() - entry[1] > self.ttl:
+            entry = (self.load_day(vehicle_type, day), self.clock())
+            with self.lock:
+                self.days[key] = entry
+        return entry[0]
+
+    def _capacity(self, vehicle_type):
+        entry = self.capacity.get(vehicle_type)
+        if entry is None or self.clock() - entry[1] > self.ttl:
+            entry = (self.load_capacity(vehicle_type), self.clock())
+            self.capacity[vehicle_type] = entry
+        return entry[0]
+
+    def has_capacity(self, vehicle_type, day, pickup_time):
+        '''Can one more trip of `vehicle_type` start at `pickup_time` on `day`?'''
+
+        capacity = self._capacity(vehicle_type)
+        if capacity is None:
+            return True
+        vehicles, duration = capacity
+
+        return fits(lambda d: self._day(vehicle_type, d), day, minute_of_day(pickup_time),
+                    vehicles, duration)
+
+    def add(self, vehicle_type, day, pickup_time):
+        '''Record a trip this process just booked.'''
+
+        with self.lock:
+            entry = self.days.get((vehicle_type, day))
+            if entry is not None:
+                insort(entry[0], minute_of_day(pickup_time))
+
+    def forget(self, vehicle_type=None, day=None):
+        '''Reload these days from the database on the next check, e.g. after an edit.'''
+
+        with self.lock:
+            if vehicle_type is None:
+                self.days.clear()
+                self.capacity.clear()
+            else:
+                self.days.pop((vehicle_type, day), None)
+
+
+fleet_schedule = FleetSchedule()
+
+
+#############################################################################
+# Booking
+
+def overlap_windows(trips, capacity):
+    '''{(vehicle_type, day): [(first, end)]}: the pickup minutes, from
+    `first` up to but not including `end`, of the booked trips that can
+    share a minute with one of `trips`. Windows are split at midnight and
+    merged where they overlap. Vehicle types not in `capacity` are left out.'''
+
+    windows = {}
+    for vehicle_type, day, pickup_time in trips:
+        if vehicle_type not in capacity:
+            continue
+        duration = capacity[vehicle_type][1]
+        start = minute_of_day(pickup_time)
+        # the same range fits() looks at, day by day
+        lo, hi = start - duration + 1, start + duration
+        for offset in (-1, 0, 1):
+            base = offset * MINUTES_PER_DAY
+            if hi <= base or lo >= base + MINUTES_PER_DAY:
+                continue
+            windows.setdefault((vehicle_type, day + timedelta(days=offset)), []).append(
+                (max(lo - base, 0), min(hi - base, MINUTES_PER_DAY)))
+
+    for key, spans in windows.items():
+        spans.sort()
+        merged = [spans[0]]
+        for first, end in spans[1:]:
+            if first <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((first, end))
+        windows[key] = merged
+    return windows
+
+
+def window_filter(vehicle_type, day, first, end):
+    '''SQL condition for the pickups of one overlap window.'''
+
+    conditions = [Reservation.vehicle_type == vehicle_type, Reservation.PU_date == day,
+                  Reservation.PU_time >= clock(first // 60, first % 60)]
+    if end < MINUTES_PER_DAY:
+        conditions.append(Reservation.PU_time < clock(end // 60, end % 60))
+    return and_(*conditions)
+
+
+def reserve(trips, exclude_ids=()):
+    '''Check new (vehicle_type, day, pickup_time) trips against the
+    database, in the transaction that is about to write them.
+
+    Locks the fleet_capacity rows of the trips' vehicle types (FOR UPDATE,
+    in name order so two bookings never wait on each other) until that
+    transaction ends, so bookings of one type are checked and committed one
+    at a time across all workers. Call it before adding the trips to the
+    session. Returns one bool per trip; trips that fit count against the
+    ones after them. `exclude_ids` are reservations being moved, which no
+    longer hold their old slot.'''
+
+    if not trips:
+        return []
+    types = sorted({vehicle_type for vehicle_type, day, pickup_time in trips})
+    rows = (FleetCapacity.query
+            .filter(FleetCapacity.vehicle_type.in_(types))
+            .order_by(FleetCapacity.vehicle_type)
+            .with_for_update()
+            .all())
+    capacity = {row.vehicle_type: (row.vehicles, row.avg_trip_minutes) for row in rows}
+
+    # only the booked pickups that can overlap a limited trip, read in one query
+    windows = overlap_windows(trips, capacity)
+    days = {key: [] for key in windows}
+    if windows:
+        query = (db.session.query(Reservation.vehicle_type, Reservation.PU_date, Reservation.PU_time)
+                 .filter(or_(*[window_filter(vehicle_type, day, first, end)
+                               for (vehicle_type, day), spans in windows.items()
+                               for first, end in spans])))
+        if exclude_ids:
+            query = query.filter(Reservation.id.notin_(exclude_ids))
+        for vehicle_type, day, pickup_time in query:
+            days[(vehicle_type, day)].append(minute_of_day(pickup_time))
+        for minutes in days.values():
+            minutes.sort()
+
+    result = []
+    for vehicle_type, day, pickup_time in trips:
+        if vehicle_type not in capacity:
+            result.append(True)
+            continue
+        vehicles, duration = capacity[vehicle_type]
+        start = minute_of_day(pickup_time)
+        ok = fits(lambda d: days[(vehicle_type, d)], day, start, vehicles, duration)
+        if ok:
+            insort(days[(vehicle_type, day)], start)
+        result.append(ok)
+    return result
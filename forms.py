@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, EmailField, TelField, TimeField, TextAreaField, DateField, SelectField, BooleanField
-from wtforms.validators import DataRequired, Length, InputRequired
+from wtforms.validators import DataRequired, Length, InputRequired, Optional, ValidationError
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 
 class RegisterForm(FlaskForm):
     '''Form for registering new users.'''
@@ -216,6 +217,30 @@ class ResForm(FlaskForm):
     )
 
 
+class RecurringResForm(ResForm):
+    '''Reservation form with the option to repeat the trip (res_form).
+    Kept apart from ResForm, whose fields are the reservation's columns.'''
+
+    repeat = SelectField(
+        'Repeat',
+        choices=[('', 'Does not repeat'),
+                 ('FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR', 'Every weekday'),
+                 ('FREQ=WEEKLY', 'Every week on this day'),
+                 ('FREQ=DAILY', 'Every day')],
+        default='',
+        validate_choice=True
+    )
+
+    repeat_until = DateField(
+        'Repeat until (optional)',
+        validators=[Optional()],
+    )
+
+    def validate_repeat_until(form, field):
+        if field.data and form.PU_date.data and field.data < form.PU_date.data:
+            raise ValidationError('Must be on or after the pick-up date.')
+
+
 class EmailRes(FlaskForm):
     '''Form for a user to email a confirmation'''
 
@@ -225,3 +250,42 @@ class EmailRes(FlaskForm):
     )
 
 
+class ImportResForm(FlaskForm):
+    '''Form for an admin to upload a CSV file of reservations'''
+
+    csv_file = FileField(
+        'CSV file',
+        validators=[FileRequired(), FileAllowed(['csv'], 'CSV files only')],
+    )
+
+
+class RequoteForm(FlaskForm):
+    '''Form for an admin to re-price the reservations of a pick-up window'''
+
+    start = DateField(
+        'Pick-Up From',
+        validators=[DataRequired()],
+    )
+
+    end = DateField(
+        'Pick-Up To',
+        validators=[DataRequired()],
+    )
+
+
+class AssignForm(FlaskForm):
+    '''Form for an admin to assign drivers to the rides of a day'''
+
+    day = DateField(
+        'Pick-Up Date',
+        validators=[DataRequired()],
+    )
+
+
+class RecurringActionForm(FlaskForm):
+    '''Skip a day of, or stop, a repeating booking'''
+
+    day = DateField(
+        'Day',
+        validators=[Optional()],
+    )
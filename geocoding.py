@@ -0,0 +1,83 @@
+'''Coordinates for the addresses table, used by the fare quotes.
+
+Each address is geocoded once through MapQuest's batch geocoding API, up
+to 100 addresses per request, and the result is kept on its row. Run it
+after the address backfill and then every so often for new addresses:
+
+    python geocoding.py
+
+Needs MAPQUEST_KEY in the environment.'''
+
+import os
+
+from models import db, Address
+
+MAPQUEST_KEY = os.environ.get('MAPQUEST_KEY')
+MAPQUEST_BATCH_URL = 'https://www.mapquestapi.com/geocoding/v1/batch'
+
+# MapQuest takes at most 100 locations per batch request
+GEOCODE_BATCH_SIZE = 100
+GEOCODE_TIMEOUT_SECONDS = 10
+
+
+def one_line(address):
+    return ', '.join(part for part in (address.street, address.city, address.state,
+                                       address.zip, address.country) if part)
+
+
+def mapquest_lookup(locations, key=MAPQUEST_KEY):
+    '''[(lat, lng) or None] for each location string.'''
+
+    # imported here, only this job talks to MapQuest
+    import requests
+
+    resp = requests.get(MAPQUEST_BATCH_URL,
+                        params={'key': key, 'location': locations, 'maxResults': 1},
+                        timeout=GEOCODE_TIMEOUT_SECONDS)
+    resp.raise_for_status()
+
+    found = []
+    for result in resp.json()['results']:
+        matches = result.get('locations') or []
+        if matches:
+            lat_lng = matches[0]['latLng']
+            found.append((lat_lng['lat'], lat_lng['lng']))
+        else:
+            found.append(None)
+    return found
+
+
+def geocode_missing(lookup=mapquest_lookup, batch_size=GEOCODE_BATCH_SIZE, limit=None):
+    '''Geocode addresses without coordinates, one lookup and one commit per
+    batch. Addresses the geocoder cannot place are skipped, and tried again
+    on the next run. Returns how many addresses got coordinates.'''
+
+    done = 0
+    last_id = 0
+    while limit is None or done < limit:
+        batch = (Address.query
+                 .filter(Address.latitude == None, Address.id > last_id)
+                 .order_by(Address.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+
+        last_id = batch[-1].id
+        for address, coordinates in zip(batch, lookup([one_line(address) for address in batch])):
+            if coordinates is not None:
+                address.latitude, address.longitude = coordinates
+                done += 1
+        db.session.commit()
+
+    return done
+
+
+if __name__ == '__main__':
+    from app import app
+
+    if not MAPQUEST_KEY:
+        raise SystemExit('MAPQUEST_KEY is not set')
+
+    with app.app_context():
+        print(f'{geocode_missing()} addresses geocoded')
@@ -0,0 +1,31 @@
+'''gunicorn settings, read by gunicorn from the working directory (see Procfile).
+
+Each worker runs GUNICORN_THREADS request threads (gunicorn's gthread
+worker), the number config.py sizes the database pool for. A request
+waiting on bcrypt (passwords.py), SMTP or Postgres then holds one thread,
+not the whole worker.
+
+The workers write their metrics to PROMETHEUS_MULTIPROC_DIR so /metrics
+can add them up across processes (metrics.py). The directory is emptied
+when gunicorn starts and a dead worker's gauges are dropped.'''
+
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'bookaride-metrics'))
+
+# more than one thread makes gunicorn use the gthread worker; ignored by asgi.py's uvicorn workers
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+def on_starting(server):
+    # samples left by a previous run would be added to this one's
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
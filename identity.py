@@ -0,0 +1,44 @@
+'''The logged-in user's profile, loaded once per request.
+
+Profiles hold only non-sensitive columns (no password hash) and are cached
+per process for USER_CACHE_TTL_SECONDS, so most requests resolve the
+current user without a query. edit_profile calls forget_profile(); other
+gunicorn workers may show the old name until their entry expires.'''
+
+import os
+from collections import namedtuple
+
+from cache import TTLCache
+from models import db, User
+
+CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', 30))
+
+PROFILE_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'phone', 'is_admin', 'member_since')
+
+UserProfile = namedtuple('UserProfile', PROFILE_FIELDS)
+
+profile_cache = TTLCache(CACHE_TTL_SECONDS)
+
+
+def load_profile(user_id, session=None):
+    '''The UserProfile for `user_id`, from the cache when possible. None if
+    there is no such user. `session` defaults to db.session.'''
+
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    row = ((session or db.session).query(*[getattr(User, field) for field in PROFILE_FIELDS])
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        return None
+
+    profile = UserProfile(*row)
+    profile_cache.set(user_id, profile)
+    return profile
+
+
+def forget_profile(user_id):
+    '''Drop a cached profile after the user changed it.'''
+    profile_cache.delete(user_id)
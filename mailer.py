@@ -0,0 +1,198 @@
+'''Background e-mail delivery over a small pool of reused SMTP connections.
+
+Opening an SMTP_SSL connection costs a TCP + TLS handshake and a login, so
+connections are kept open and shared between messages. Messages are handed
+to worker threads through a queue, the caller never waits on the mail server.'''
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+
+class SMTPPool:
+    '''Up to `size` logged-in SMTP connections, handed out one at a time.'''
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True,
+                 size=2, timeout=30, check_after=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        # connections idle longer than this are checked with NOOP before reuse
+        self.check_after = check_after
+
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        with timed('smtp', 'connect'):
+            conn = smtp_class(self.host, self.port, timeout=self.timeout)
+            if self.username:
+                conn.login(self.username, self.password)
+        return conn
+
+    def _checkout(self):
+        try:
+            conn, last_used = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+            if can_create:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            conn, last_used = self.idle.get()
+
+        if time.monotonic() - last_used > self.check_after:
+            try:
+                conn.noop()
+            except OSError:
+                self._discard(conn)
+                return self._checkout()
+
+        return conn
+
+    def _discard(self, conn):
+        with self.lock:
+            self.created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        '''Borrow a connection. Connections that drop or hit a socket error are
+        closed instead of returned.'''
+
+        conn = self._checkout()
+        try:
+            yield conn
+        except smtplib.SMTPServerDisconnected:
+            self._discard(conn)
+            raise
+        except smtplib.SMTPException:
+            # the server refused this message but the session is still usable
+            self.idle.put((conn, time.monotonic()))
+            raise
+        except Exception:
+            self._discard(conn)
+            raise
+        else:
+            self.idle.put((conn, time.monotonic()))
+
+    def close(self):
+        '''Quit every idle connection.'''
+
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            with self.lock:
+                self.created -= 1
+            try:
+                conn.quit()
+            except Exception:
+                pass
+
+
+class Mailer:
+    '''Sends queued messages from background threads through an SMTPPool.
+
+    `on_status(reservation_id, status, error)` is called after each message
+    with status "sent" or "failed".'''
+
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    def __init__(self, pool, workers=None, on_status=None):
+        self.pool = pool
+        self.workers = workers or pool.size
+        self.on_status = on_status
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''Start the worker threads, if they are not running yet.
+        Called on the first send so threads are created after gunicorn forks.'''
+
+        with self.lock:
+            if self.threads:
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def send(self, msg, reservation_id=None):
+        '''Queue a message and return right away.'''
+
+        self.start()
+        self.jobs.put((msg, reservation_id))
+
+    def deliver(self, msg):
+        '''Send one message now. A dropped connection is retried once on a fresh one.'''
+
+        try:
+            with self.pool.connection() as conn, timed('smtp', 'send'):
+                conn.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            with self.pool.connection() as conn, timed('smtp', 'send'):
+                conn.send_message(msg)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+
+                msg, reservation_id = job
+                try:
+                    self.deliver(msg)
+                except Exception as e:
+                    status, error = self.FAILED, str(e)
+                else:
+                    status, error = self.SENT, None
+
+                if self.on_status is not None:
+                    try:
+                        self.on_status(reservation_id, status, error)
+                    except Exception:
+                        log.exception('could not record e-mail status for reservation %s', reservation_id)
+            finally:
+                self.jobs.task_done()
+
+    def join(self):
+        '''Wait until every queued message has been handled.'''
+        self.jobs.join()
+
+    def stop(self):
+        '''Finish the queued messages, stop the threads and close the pool.'''
+
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.jobs.put(None)
+        for thread in threads:
+            thread.join()
+        self.pool.close()
@@ -0,0 +1,205 @@
+'''Request, SQL and integration timings, published at /metrics for Prometheus.
+
+    http_request_duration_seconds{endpoint, method, status}    histogram
+    db_queries_per_request{endpoint}                            histogram
+    db_seconds_per_request{endpoint}                            histogram
+    db_queries_total{endpoint}, db_query_seconds_total{endpoint}
+    external_call_duration_seconds{service, operation, outcome} histogram
+    db_pool_connections_in_use                                  gauge, summed
+
+`endpoint` is the Flask endpoint name, so the label has as many values as
+there are routes. SQL outside a request (the mailer's status updates, the
+SMS worker, scripts) is counted under endpoint "none".
+
+Under gunicorn every worker is its own process with its own numbers.
+gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a directory the
+workers write their samples to, and /metrics adds up all of them, so a
+scrape sees the whole dyno whichever worker answers it. Without that
+variable (flask run, tests) the numbers are this process's.
+
+/metrics answers to `Authorization: Bearer $METRICS_TOKEN`, or to a
+logged-in admin when no token is configured.'''
+
+import hmac
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, g, has_app_context, request, session
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from werkzeug.exceptions import Unauthorized
+
+from query_budget import query_budget
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# endpoints with no rule (404s, 405s), one label value for all of them
+UNMATCHED = 'none'
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to build the response, by Flask endpoint',
+    ('endpoint', 'method', 'status'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'SQL statements run for one request',
+    ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+DB_SECONDS_PER_REQUEST = Histogram(
+    'db_seconds_per_request', 'Time spent in SQL statements for one request',
+    ('endpoint',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+QUERIES = Counter('db_queries', 'SQL statements run', ('endpoint',))
+
+QUERY_SECONDS = Counter('db_query_seconds', 'Time spent in SQL statements', ('endpoint',))
+
+EXTERNAL_SECONDS = Histogram(
+    'external_call_duration_seconds', 'Calls to Twilio, SMTP and other services',
+    ('service', 'operation', 'outcome'),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Connections checked out of the pool',
+                    multiprocess_mode='livesum')
+
+
+class RequestTimer:
+    '''What one request has spent so far, kept in g.request_timer.'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+def start_request():
+    '''First thing of every request (asgi.py calls it for its endpoints).'''
+    g.request_timer = RequestTimer()
+
+
+def endpoint_label():
+    return request.endpoint or UNMATCHED
+
+
+#############################################################################
+# Timing
+
+@contextmanager
+def timed(service, operation):
+    '''Time a call to an outside service, e.g. timed('smtp', 'send'). The
+    outcome label is "error" when the block raises.'''
+
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        EXTERNAL_SECONDS.labels(service, operation, outcome).observe(time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _count_query(time.perf_counter() - conn.info['query_start'].pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # a failed statement never gets to after_cursor_execute; its time counts all the same
+    conn = exception_context.connection
+    starts = conn.info.get('query_start') if conn is not None else None
+    if starts:
+        _count_query(time.perf_counter() - starts.pop())
+
+
+def _count_query(seconds):
+    timer = g.get('request_timer') if has_app_context() else None
+    if timer is not None:
+        timer.queries += 1
+        timer.db_seconds += seconds
+        return
+    QUERIES.labels(UNMATCHED).inc()
+    QUERY_SECONDS.labels(UNMATCHED).inc(seconds)
+
+
+@event.listens_for(Pool, 'checkout')
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_IN_USE.inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def _checkin(dbapi_connection, connection_record):
+    POOL_IN_USE.dec()
+
+
+#############################################################################
+# Publishing
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.before_app_request
+def _start_request():
+    start_request()
+
+
+@metrics.after_app_request
+def _finish_request(response):
+    timer = g.pop('request_timer', None)
+    if timer is None:
+        return response
+
+    endpoint = endpoint_label()
+    REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(
+        time.perf_counter() - timer.start)
+    QUERIES_PER_REQUEST.labels(endpoint).observe(timer.queries)
+    DB_SECONDS_PER_REQUEST.labels(endpoint).observe(timer.db_seconds)
+    QUERIES.labels(endpoint).inc(timer.queries)
+    QUERY_SECONDS.labels(endpoint).inc(timer.db_seconds)
+    return response
+
+
+def registry():
+    '''Every worker's samples when running under gunicorn, this process's otherwise.'''
+
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    combined = CollectorRegistry()
+    multiprocess.MultiProcessCollector(combined)
+    return combined
+
+
+def authorized():
+    if METRICS_TOKEN:
+        expected = f'Bearer {METRICS_TOKEN}'
+        return hmac.compare_digest(request.headers.get('Authorization', ''), expected)
+    # imported here, app.py imports this module
+    from app import CURR_ADMIN_KEY
+    return CURR_ADMIN_KEY in session
+
+
+@metrics.route('/metrics')
+@query_budget(0)
+def publish():
+    '''All metrics in the Prometheus text format.'''
+
+    if not authorized():
+        raise Unauthorized()
+
+    response = Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
+    response.cache_control.no_store = True
+    return response
@@ -0,0 +1,65 @@
+'''Apply the versioned SQL migrations in migrations/ to an existing database.
+
+Each migrations/NNNN_name.sql file runs once, in order, in its own
+transaction, and is recorded in the schema_migrations table.
+
+    python migrate.py           # apply pending migrations
+    python migrate.py --mark    # record every migration as applied without running it
+
+A database built from scratch with seed.py already has the full schema,
+seed.py marks every migration as applied.'''
+
+import os
+import sys
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def migration_files():
+    '''(version, path) for every migration, oldest first.'''
+
+    files = sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+    return [(name[:-len('.sql')], os.path.join(MIGRATIONS_DIR, name)) for name in files]
+
+
+def applied_versions(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version VARCHAR PRIMARY KEY, '
+        'applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+    return {row[0] for row in conn.exec_driver_sql('SELECT version FROM schema_migrations')}
+
+
+def migrate(engine, mark_only=False):
+    '''Run every pending migration. Returns the versions that were applied.'''
+
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, path in migration_files():
+        if version in done:
+            continue
+
+        with engine.begin() as conn:
+            if not mark_only:
+                with open(path) as f:
+                    conn.exec_driver_sql(f.read())
+            conn.exec_driver_sql('INSERT INTO schema_migrations (version) VALUES (%(version)s)',
+                                 {'version': version})
+        applied.append(version)
+
+    return applied
+
+
+if __name__ == '__main__':
+    # index builds and backfills may run longer than a web request is allowed to
+    os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', '0')
+
+    from models import db
+    from app import app
+
+    with app.app_context():
+        for version in migrate(db.engine, mark_only='--mark' in sys.argv[1:]):
+            print(f'applied {version}')
@@ -0,0 +1,19 @@
+-- SMS outbox (user-003) and e-mail delivery status on reservations (user-004)
+
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    id SERIAL NOT NULL,
+    "to" VARCHAR NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_error TEXT,
+    created_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    sent_at TIMESTAMP WITHOUT TIME ZONE,
+    reservation_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(reservation_id) REFERENCES reservations (id) ON DELETE SET NULL
+);
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS email_status VARCHAR;
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS email_error TEXT;
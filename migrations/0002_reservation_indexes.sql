@@ -0,0 +1,12 @@
+-- Indexes for the reservation access paths, see Reservation.__table_args__
+
+-- a customer's trips in pickup order (user dashboard)
+CREATE INDEX IF NOT EXISTS ix_reservations_user_pickup ON reservations (user_id, "PU_date", "PU_time", id);
+
+-- every trip in a pickup window in pickup order (dispatch board)
+CREATE INDEX IF NOT EXISTS ix_reservations_pickup ON reservations ("PU_date", "PU_time", id);
+
+CREATE INDEX IF NOT EXISTS ix_reservations_created_date ON reservations (created_date);
+
+-- due messages for the SMS worker
+CREATE INDEX IF NOT EXISTS ix_sms_outbox_due ON sms_outbox (status, next_attempt_at);
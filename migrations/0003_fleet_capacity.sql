@@ -0,0 +1,11 @@
+-- Fleet capacity per vehicle type (user-010)
+
+CREATE TABLE IF NOT EXISTS fleet_capacity (
+    vehicle_type VARCHAR NOT NULL,
+    vehicles INTEGER NOT NULL,
+    avg_trip_minutes INTEGER NOT NULL,
+    PRIMARY KEY (vehicle_type)
+);
+
+-- one vehicle type's trips on one day, loaded by the capacity check
+CREATE INDEX IF NOT EXISTS ix_reservations_vehicle_day ON reservations (vehicle_type, "PU_date");
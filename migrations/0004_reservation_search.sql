@@ -0,0 +1,12 @@
+-- Search columns and indexes for the dispatcher search (user-011), see search.py
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', coalesce("passenger_name", '') || ' ' || coalesce("passenger_phone", '') || ' ' || coalesce("PU_address", '') || ' ' || coalesce("DO_address", '') || ' ' || coalesce("PU_city", ''))) STORED;
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS search_text text GENERATED ALWAYS AS (lower(coalesce("passenger_name", '') || ' ' || coalesce("passenger_phone", '') || ' ' || coalesce("PU_address", '') || ' ' || coalesce("DO_address", '') || ' ' || coalesce("PU_city", ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_reservations_search_vector ON reservations USING gin (search_vector);
+
+CREATE INDEX IF NOT EXISTS ix_reservations_search_trgm ON reservations USING gin (search_text gin_trgm_ops);
+
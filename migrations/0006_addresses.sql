@@ -0,0 +1,22 @@
+-- Deduplicated address store (user-015), fill it with: python addresses.py
+
+CREATE TABLE IF NOT EXISTS addresses (
+    id SERIAL NOT NULL,
+    key VARCHAR(40) NOT NULL,
+    street VARCHAR,
+    city VARCHAR,
+    state VARCHAR,
+    zip VARCHAR,
+    country VARCHAR,
+    PRIMARY KEY (id),
+    UNIQUE (key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_addresses_city ON addresses (city);
+CREATE INDEX IF NOT EXISTS ix_addresses_zip ON addresses (zip);
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS "PU_address_id" INTEGER REFERENCES addresses (id);
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS "DO_address_id" INTEGER REFERENCES addresses (id);
+
+CREATE INDEX IF NOT EXISTS ix_reservations_pu_address ON reservations ("PU_address_id");
+CREATE INDEX IF NOT EXISTS ix_reservations_do_address ON reservations ("DO_address_id");
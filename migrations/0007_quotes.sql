@@ -0,0 +1,7 @@
+-- Cached coordinates and stored fare quotes (user-016), see quotes.py and geocoding.py
+
+ALTER TABLE addresses ADD COLUMN IF NOT EXISTS latitude FLOAT;
+ALTER TABLE addresses ADD COLUMN IF NOT EXISTS longitude FLOAT;
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS distance_miles FLOAT;
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS quoted_fare NUMERIC(8, 2);
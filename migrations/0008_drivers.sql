@@ -0,0 +1,26 @@
+-- Vehicles, drivers and driver assignment (user-017), see dispatch.py
+
+CREATE TABLE IF NOT EXISTS vehicles (
+    id SERIAL NOT NULL,
+    plate VARCHAR NOT NULL,
+    vehicle_type VARCHAR NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (plate)
+);
+
+CREATE TABLE IF NOT EXISTS drivers (
+    id SERIAL NOT NULL,
+    name VARCHAR NOT NULL,
+    phone VARCHAR,
+    vehicle_id INTEGER REFERENCES vehicles (id),
+    base_latitude FLOAT,
+    base_longitude FLOAT,
+    shift_start TIME WITHOUT TIME ZONE NOT NULL DEFAULT '06:00',
+    shift_end TIME WITHOUT TIME ZONE NOT NULL DEFAULT '22:00',
+    active BOOLEAN NOT NULL DEFAULT true,
+    PRIMARY KEY (id)
+);
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS driver_id INTEGER REFERENCES drivers (id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_reservations_driver_day ON reservations (driver_id, "PU_date");
@@ -0,0 +1,27 @@
+-- Repeating bookings (user-018), see recurrence.py; run python recurrence.py daily
+
+CREATE TABLE IF NOT EXISTS recurring_reservations (
+    id SERIAL NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    rule VARCHAR NOT NULL,
+    starts_on DATE NOT NULL,
+    until DATE,
+    vehicle_type VARCHAR NOT NULL,
+    "PU_time" TIME WITHOUT TIME ZONE NOT NULL,
+    trip JSON NOT NULL,
+    materialized_through DATE,
+    created_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_recurring_reservations_user_id ON recurring_reservations (user_id);
+
+CREATE TABLE IF NOT EXISTS recurrence_exceptions (
+    recurring_id INTEGER NOT NULL REFERENCES recurring_reservations (id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    PRIMARY KEY (recurring_id, day)
+);
+
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS recurring_id INTEGER REFERENCES recurring_reservations (id) ON DELETE SET NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_reservations_recurring_day ON reservations (recurring_id, "PU_date");
@@ -0,0 +1,27 @@
+-- Address parts are kept once in addresses (user-015), drop their copies on reservations.
+-- Link the existing reservations first: python addresses.py
+-- The space comes back as rows are rewritten, or at once with VACUUM FULL reservations.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM reservations
+               WHERE ("PU_address_id" IS NULL AND coalesce(nullif(btrim("PU_street"), ''), nullif(btrim("PU_city"), '')) IS NOT NULL)
+                  OR ("DO_address_id" IS NULL AND coalesce(nullif(btrim("DO_street"), ''), nullif(btrim("DO_city"), '')) IS NOT NULL)) THEN
+        RAISE EXCEPTION 'reservations without address ids, run python addresses.py first';
+    END IF;
+END $$;
+
+-- the search columns read "PU_city", rebuild them without it, see search.py
+ALTER TABLE reservations DROP COLUMN IF EXISTS search_vector, DROP COLUMN IF EXISTS search_text;
+
+ALTER TABLE reservations ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', coalesce("passenger_name", '') || ' ' || coalesce("passenger_phone", '') || ' ' || coalesce("PU_address", '') || ' ' || coalesce("DO_address", ''))) STORED;
+
+ALTER TABLE reservations ADD COLUMN search_text text GENERATED ALWAYS AS (lower(coalesce("passenger_name", '') || ' ' || coalesce("passenger_phone", '') || ' ' || coalesce("PU_address", '') || ' ' || coalesce("DO_address", ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_reservations_search_vector ON reservations USING gin (search_vector);
+
+CREATE INDEX IF NOT EXISTS ix_reservations_search_trgm ON reservations USING gin (search_text gin_trgm_ops);
+
+ALTER TABLE reservations
+    DROP COLUMN "PU_street", DROP COLUMN "PU_city", DROP COLUMN "PU_state", DROP COLUMN "PU_zip", DROP COLUMN "PU_country",
+    DROP COLUMN "DO_street", DROP COLUMN "DO_city", DROP COLUMN "DO_state", DROP COLUMN "DO_zip", DROP COLUMN "DO_country";
@@ -0,0 +1,6 @@
+-- Fleet capacity checks read the pickups of one vehicle type in a time window (user-010), see fleet.py
+-- the new index also serves the whole-day lookups of the old one
+
+CREATE INDEX IF NOT EXISTS ix_reservations_vehicle_pickup ON reservations (vehicle_type, "PU_date", "PU_time");
+
+DROP INDEX IF EXISTS ix_reservations_vehicle_day;
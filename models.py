@@ -1,12 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from sqlalchemy.schema import Sequence
-from datetime import datetime, timezone
+from sqlalchemy.orm.attributes import flag_dirty
+from datetime import datetime, timezone, date, time, timedelta
 from flask_login import UserMixin
+from pagination import keyset_page, decode_cursor, DEFAULT_PER_PAGE
+from passwords import bcrypt, password_service
+from db_pool import engine_options, configure_engine
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# how many days of pickups the dispatch board shows when no window is chosen
+DISPATCH_WINDOW_DAYS = 7
+
 class User(db.Model, UserMixin):
     '''User in the system'''
 
@@ -63,12 +68,20 @@ class User(db.Model, UserMixin):
         default=datetime.now(timezone.utc),
     )
 
+    # bumped on every ORM update, the API's ETags and Last-Modified come from it
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
+
     @classmethod
     def register(cls, username, password, email, first_name, last_name, phone):
         '''Register a user 
         Hashes password and add user to the system'''
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_service.hash(password)
 
         user = cls(
             username=username,
@@ -89,17 +102,33 @@ class User(db.Model, UserMixin):
 
         user = User.query.filter_by(username=username).first()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if not user:
+            # take as long as a wrong password would
+            return password_service.verify_dummy(password)
+
+        if user.check_password(password):
             return user
         else:
             return False
 
+    def check_password(self, password):
+        '''Check a password against this user's hash.
+        If the hash was made with an old work factor it is replaced, the caller commits.'''
+
+        if not password_service.verify(self.password, password):
+            return False
+
+        if password_service.needs_rehash(self.password):
+            self.password = password_service.hash(password)
+
+        return True
+
     @classmethod
     def registerAdmin(cls, username, password, email, first_name, last_name, phone, is_admin):
         '''Register a user 
         Hashes password and add user to the system'''
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_service.hash(password)
 
         admin = cls(
             username=username,
@@ -115,11 +144,122 @@ class User(db.Model, UserMixin):
         return admin
 
 
+class Address(db.Model):
+    '''A canonical street address, shared by every reservation that picks
+    up or drops off there. `key` is a hash of the normalized parts, see
+    addresses.py.'''
+
+    __tablename__ = 'addresses'
+
+    # keep in sync with migrations/0006_addresses.sql
+    __table_args__ = (
+        db.Index('ix_addresses_city', 'city'),
+        db.Index('ix_addresses_zip', 'zip'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+
+    key = db.Column(
+        db.String(40),
+        nullable=False,
+        unique=True,
+    )
+
+    street = db.Column(
+        db.String,
+    )
+
+    city = db.Column(
+        db.String,
+    )
+
+    state = db.Column(
+        db.String,
+    )
+
+    zip = db.Column(
+        db.String,
+    )
+
+    country = db.Column(
+        db.String,
+    )
+
+    # filled in by geocoding.py, used for fare quotes
+    latitude = db.Column(
+        db.Float,
+    )
+
+    longitude = db.Column(
+        db.Float,
+    )
+
+
+ADDRESS_PARTS = ('street', 'city', 'state', 'zip', 'country')
+
+
+def new_addresses(res):
+    '''{'PU' or 'DO': {part: value}} of the addresses set on `res` since
+    its last flush, see address_part().'''
+
+    return res.__dict__.setdefault('_new_addresses', {})
+
+
+def address_part(prefix, part):
+    '''Reservation.PU_street, DO_city, ...: a part of the pick-up ('PU') or
+    drop-off ('DO') address, which is kept once in the addresses table.
+    Reads go through the pickup / dropoff relationship. Writes are held
+    in new_addresses() until the next flush links the reservation to the
+    matching addresses row, see addresses.py.'''
+
+    relationship = {'PU': 'pickup', 'DO': 'dropoff'}[prefix]
+
+    def get(res):
+        parts = new_addresses(res).get(prefix)
+        if parts is not None:
+            return parts[part]
+        address = getattr(res, relationship)
+        return None if address is None else getattr(address, part)
+
+    def set_(res, value):
+        pending = new_addresses(res)
+        if prefix not in pending:
+            # the parts not set keep their current values
+            address = getattr(res, relationship) if getattr(res, f'{prefix}_address_id') else None
+            pending[prefix] = {name: getattr(address, name, None) for name in ADDRESS_PARTS}
+        pending[prefix][part] = value
+        # no column changed yet, make sure the flush still sees the reservation
+        flag_dirty(res)
+
+    return property(get, set_)
+
+
 class Reservation(db.Model):
     '''Database for all reservations.'''
 
     __tablename__ = 'reservations'
 
+    # keep in sync with migrations/0002_reservation_indexes.sql
+    __table_args__ = (
+        # a customer's trips, in pickup order (user dashboard)
+        db.Index('ix_reservations_user_pickup', 'user_id', 'PU_date', 'PU_time', 'id'),
+        # every trip in a pickup window, in pickup order (dispatch board)
+        db.Index('ix_reservations_pickup', 'PU_date', 'PU_time', 'id'),
+        db.Index('ix_reservations_created_date', 'created_date'),
+        # one vehicle type's trips on one day or in a pickup window (fleet capacity checks)
+        db.Index('ix_reservations_vehicle_pickup', 'vehicle_type', 'PU_date', 'PU_time'),
+        # trips from / to one address (per city or zip reports)
+        db.Index('ix_reservations_pu_address', 'PU_address_id'),
+        db.Index('ix_reservations_do_address', 'DO_address_id'),
+        # one driver's trips of the day
+        db.Index('ix_reservations_driver_day', 'driver_id', 'PU_date'),
+        # at most one trip per day of a repeating booking
+        db.Index('ux_reservations_recurring_day', 'recurring_id', 'PU_date', unique=True),
+    )
 
     id = db.Column(
         db.Integer, 
@@ -161,71 +301,460 @@ class Reservation(db.Model):
         nullable=False,
     )
 
-    PU_street = db.Column(
-        db.String
+    PU_street = address_part('PU', 'street')
+    PU_city = address_part('PU', 'city')
+    PU_state = address_part('PU', 'state')
+    PU_zip = address_part('PU', 'zip')
+    PU_country = address_part('PU', 'country')
+
+    DO_address = db.Column(
+        db.String,
+        nullable=False,
+    )
+
+    DO_street = address_part('DO', 'street')
+    DO_city = address_part('DO', 'city')
+    DO_state = address_part('DO', 'state')
+    DO_zip = address_part('DO', 'zip')
+    DO_country = address_part('DO', 'country')
+
+    trip_notes = db.Column(
+        db.Text,
+    )
+
+    created_date = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.now(timezone.utc),
+    )
+
+    # bumped on every ORM update, the API's ETags and Last-Modified come from it
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
+
+    user_id = db.Column(
+                        db.Integer,
+                        db.ForeignKey('users.id'),
+                        )
+
+    # delivery of the last confirmation e-mail: queued, sent or failed
+    email_status = db.Column(
+        db.String,
     )
 
-    PU_city = db.Column(
-        db.String
+    email_error = db.Column(
+        db.Text,
     )
 
-    PU_state = db.Column(
-        db.String(3)
+    # last quote from quotes.py, None until the addresses are geocoded
+    distance_miles = db.Column(
+        db.Float,
     )
 
-    PU_zip = db.Column(
-        db.String
+    quoted_fare = db.Column(
+        db.Numeric(8, 2),
     )
 
-    PU_country = db.Column(
-        db.String
+    # set whenever PU_street, DO_city, ... change, see address_part() and addresses.py
+    PU_address_id = db.Column(
+        db.Integer,
+        db.ForeignKey('addresses.id'),
     )
 
-    DO_address = db.Column(
+    DO_address_id = db.Column(
+        db.Integer,
+        db.ForeignKey('addresses.id'),
+    )
+
+    # set by the driver assignment (dispatch.py) or by hand
+    driver_id = db.Column(
+        db.Integer,
+        db.ForeignKey('drivers.id', ondelete='SET NULL'),
+    )
+
+    # the repeating booking this trip was made from, see recurrence.py
+    recurring_id = db.Column(
+        db.Integer,
+        db.ForeignKey('recurring_reservations.id', ondelete='SET NULL'),
+    )
+
+    user = db.relationship(User,  backref=db.backref("reservations", cascade="all, delete-orphan"))
+    pickup = db.relationship(Address, foreign_keys=[PU_address_id])
+    dropoff = db.relationship(Address, foreign_keys=[DO_address_id])
+    driver = db.relationship('Driver')
+
+    @classmethod
+    def user_trips(cls, user_id, upcoming=True, cursor=None, per_page=DEFAULT_PER_PAGE, options=(),
+                   session=None):
+        '''One page of a user's upcoming or past reservations.
+
+        Upcoming trips (pickup today or later) are sorted soonest first, past
+        trips most recent first. Pages are keyed on (PU_date, PU_time, id).
+        `options` are extra query options, e.g. load_only(). `session`
+        defaults to db.session.
+        Returns (reservations, next_cursor).'''
+
+        today = date.today()
+        query = (session or db.session).query(cls).filter(cls.user_id == user_id).options(*options)
+
+        if upcoming:
+            query = query.filter(cls.PU_date >= today)
+        else:
+            query = query.filter(cls.PU_date < today)
+
+        return keyset_page(
+            query,
+            (cls.PU_date, cls.PU_time, cls.id),
+            cursor=decode_cursor(cursor, (date, time, int)),
+            per_page=per_page,
+            descending=not upcoming,
+        )
+
+    @classmethod
+    def dispatch_sort_keys(cls):
+        '''Sort options for the dispatch board: name -> (columns, cursor types).
+        Every key ends in the primary key so keyset pages are stable.'''
+
+        return {
+            'pickup': ((cls.PU_date, cls.PU_time, cls.id), (date, time, int)),
+            'booked': ((cls.created_date, cls.id), (datetime, int)),
+            'res': ((cls.id,), (int,)),
+        }
+
+    @classmethod
+    def dispatch_board(cls, start=None, end=None, sort='pickup', descending=False,
+                       cursor=None, per_page=DEFAULT_PER_PAGE, options=(), session=None):
+        '''One page of reservations for the admin dispatch view.
+
+        Only pickups between `start` and `end` (inclusive, default today to
+        today + DISPATCH_WINDOW_DAYS) are loaded, and the customer and driver
+        are fetched in the same query so the template can read res.user and
+        res.driver without a query per row. `options` are extra query
+        options, e.g. load_only(). `session` defaults to db.session.
+        Returns (reservations, next_cursor).'''
+
+        if start is None:
+            start = date.today()
+        if end is None:
+            end = start + timedelta(days=DISPATCH_WINDOW_DAYS)
+
+        sort_keys = cls.dispatch_sort_keys()
+        columns, types = sort_keys.get(sort, sort_keys['pickup'])
+
+        query = ((session or db.session).query(cls)
+                 .outerjoin(cls.user)
+                 .outerjoin(cls.driver)
+                 .options(db.contains_eager(cls.user), db.contains_eager(cls.driver), *options)
+                 .filter(cls.PU_date >= start, cls.PU_date <= end))
+
+        return keyset_page(
+            query,
+            columns,
+            cursor=decode_cursor(cursor, types),
+            per_page=per_page,
+            descending=descending,
+        )
+
+
+
+class FleetCapacity(db.Model):
+    '''How many vehicles of each type the fleet has, and how long a trip
+    keeps one busy. Vehicle types without a row are not capacity checked.'''
+
+    __tablename__ = 'fleet_capacity'
+
+    vehicle_type = db.Column(
         db.String,
+        primary_key=True,
+    )
+
+    vehicles = db.Column(
+        db.Integer,
         nullable=False,
     )
 
-    DO_street = db.Column(
-        db.String
+    avg_trip_minutes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=60,
     )
 
-    DO_city = db.Column(
-        db.String
+
+class Vehicle(db.Model):
+    '''A vehicle of the fleet.'''
+
+    __tablename__ = 'vehicles'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
     )
 
-    DO_state = db.Column(
-        db.String(3)
+    plate = db.Column(
+        db.String,
+        nullable=False,
+        unique=True,
     )
 
-    DO_zip = db.Column(
-        db.String
+    # one of ResForm's vehicle_type choices
+    vehicle_type = db.Column(
+        db.String,
+        nullable=False,
     )
 
-    DO_country = db.Column(
-        db.String
+
+class Driver(db.Model):
+    '''A chauffeur, the vehicle they drive and their shift. Each shift
+    starts at the driver's base.'''
+
+    __tablename__ = 'drivers'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
     )
 
-    trip_notes = db.Column(
+    name = db.Column(
+        db.String,
+        nullable=False,
+    )
+
+    phone = db.Column(
+        db.String,
+    )
+
+    vehicle_id = db.Column(
+        db.Integer,
+        db.ForeignKey('vehicles.id'),
+    )
+
+    base_latitude = db.Column(
+        db.Float,
+    )
+
+    base_longitude = db.Column(
+        db.Float,
+    )
+
+    shift_start = db.Column(
+        db.Time,
+        nullable=False,
+        default=time(6, 0),
+    )
+
+    shift_end = db.Column(
+        db.Time,
+        nullable=False,
+        default=time(22, 0),
+    )
+
+    active = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=True,
+    )
+
+    vehicle = db.relationship(Vehicle)
+
+
+class RecurringReservation(db.Model):
+    '''A trip booked to repeat, e.g. every weekday.
+
+    Only the rule is stored; the dates are expanded from it when needed and
+    Reservation rows are made for the next RECURRING_HORIZON_DAYS only
+    (see recurrence.py).'''
+
+    __tablename__ = 'recurring_reservations'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    # RRULE subset, e.g. FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR
+    rule = db.Column(
+        db.String,
+        nullable=False,
+    )
+
+    starts_on = db.Column(
+        db.Date,
+        nullable=False,
+    )
+
+    # last day a trip may be on, None to repeat until stopped
+    until = db.Column(
+        db.Date,
+    )
+
+    vehicle_type = db.Column(
+        db.String,
+        nullable=False,
+    )
+
+    PU_time = db.Column(
+        db.Time,
+        nullable=False,
+    )
+
+    # the rest of the booking, by ResForm field name
+    trip = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    # Reservation rows exist up to and including this day
+    materialized_through = db.Column(
+        db.Date,
+    )
+
+    created_date = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    user = db.relationship(User, backref=db.backref("recurring_reservations", cascade="all, delete-orphan"))
+    exceptions = db.relationship('RecurrenceException', cascade="all, delete-orphan")
+
+    @property
+    def skipped(self):
+        return {exception.day for exception in self.exceptions}
+
+
+class RecurrenceException(db.Model):
+    '''A day a repeating booking is skipped.'''
+
+    __tablename__ = 'recurrence_exceptions'
+
+    recurring_id = db.Column(
+        db.Integer,
+        db.ForeignKey('recurring_reservations.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    day = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+
+class SmsOutbox(db.Model):
+    '''Text messages waiting to be sent by the SMS worker (sms_worker.py).
+
+    Rows are added in the same transaction as the reservation they confirm,
+    so a booking never commits without its SMS and the request never waits
+    on the SMS provider.'''
+
+    __tablename__ = 'sms_outbox'
+
+    __table_args__ = (
+        db.Index('ix_sms_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+    PENDING = 'pending'
+    # claimed by a worker until next_attempt_at, see sms_worker.claim()
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+
+    to = db.Column(
+        db.String,
+        nullable=False,
+    )
+
+    body = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    status = db.Column(
+        db.String,
+        nullable=False,
+        default=PENDING,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    next_attempt_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    last_error = db.Column(
         db.Text,
     )
 
     created_date = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.now(timezone.utc),
+        default=datetime.utcnow,
     )
 
-    user_id = db.Column(
-                        db.Integer,
-                        db.ForeignKey('users.id'),
-                        )
+    sent_at = db.Column(
+        db.DateTime,
+    )
 
-    user = db.relationship(User,  backref=db.backref("reservations", cascade="all, delete-orphan"))
+    reservation_id = db.Column(
+        db.Integer,
+        db.ForeignKey('reservations.id', ondelete='SET NULL'),
+    )
+
+    reservation = db.relationship(Reservation)
+
+    @classmethod
+    def queue(cls, to, body, reservation=None):
+        '''Add a message to the outbox.
+        Like User.register, it is only added to the session; the caller commits.'''
+
+        message = cls(to=to, body=body, reservation=reservation)
+        db.session.add(message)
+        return message
+
+    @classmethod
+    def due(cls, limit):
+        '''Pending messages whose next attempt is due, oldest first, and
+        messages whose worker died while sending them (their claim ran out).
+        Rows are locked with SKIP LOCKED on Postgres so several workers never
+        pick up the same message.'''
 
+        return (cls.query
+                .filter(cls.status.in_((cls.PENDING, cls.SENDING)), cls.next_attempt_at <= datetime.utcnow())
+                .order_by(cls.next_attempt_at, cls.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all())
 
 
 def connect_db(app):
     '''Connect this database to Flask app'''
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
     db.app = app
     db.init_app(app)
+    with app.app_context():
+        configure_engine(app.config, db.engine)
@@ -0,0 +1,96 @@
+'''Keyset (cursor) pagination helpers.
+
+Pages are addressed by the sort key of the last row shown instead of an
+OFFSET, so fetching page 50 costs the same as fetching page 1.'''
+
+from datetime import date, time, datetime
+from sqlalchemy import tuple_
+
+PER_PAGE_CHOICES = (10, 25, 50, 100)
+DEFAULT_PER_PAGE = 10
+
+
+def get_per_page(value, default=DEFAULT_PER_PAGE):
+    '''Turn the ?per_page= query arg into one of the allowed page sizes.'''
+
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+
+    if value not in PER_PAGE_CHOICES:
+        return default
+    return value
+
+
+def encode_cursor(values):
+    '''Serialize a row's sort key, e.g. (PU_date, PU_time, id), into a URL-safe string.'''
+
+    parts = []
+    for value in values:
+        if isinstance(value, datetime):
+            parts.append(value.isoformat())
+        elif isinstance(value, date):
+            parts.append(value.strftime('%Y-%m-%d'))
+        elif isinstance(value, time):
+            parts.append(value.strftime('%H:%M:%S'))
+        else:
+            parts.append(str(value))
+    return '_'.join(parts)
+
+
+def decode_cursor(cursor, types):
+    '''Parse a cursor made by encode_cursor back into typed values.
+    Returns None if the cursor is missing or malformed.'''
+
+    if not cursor:
+        return None
+
+    parts = cursor.split('_')
+    if len(parts) != len(types):
+        return None
+
+    values = []
+    try:
+        for part, kind in zip(parts, types):
+            if kind is datetime:
+                values.append(datetime.fromisoformat(part))
+            elif kind is date:
+                values.append(date.fromisoformat(part))
+            elif kind is time:
+                values.append(time.fromisoformat(part))
+            else:
+                values.append(kind(part))
+    except ValueError:
+        return None
+
+    return tuple(values)
+
+
+def keyset_page(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False):
+    '''Return (rows, next_cursor) for one page of `query` ordered by `columns`.
+
+    `columns` must end in a unique column (normally the primary key) so the
+    ordering is total. `cursor` is the decoded sort key of the last row of
+    the previous page.'''
+
+    key = tuple_(*columns)
+
+    if cursor is not None:
+        query = query.filter(key < tuple_(*cursor) if descending else key > tuple_(*cursor))
+
+    if descending:
+        query = query.order_by(*[col.desc() for col in columns])
+    else:
+        query = query.order_by(*columns)
+
+    # fetch one extra row to find out whether there is a next page
+    rows = query.limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, col.key) for col in columns])
+
+    return rows, next_cursor
@@ -0,0 +1,88 @@
+'''Password hashing for login and registration.
+
+bcrypt work runs on a small thread pool (bcrypt releases the GIL while
+hashing), and at most PASSWORD_MAX_PENDING hashes may be running or queued
+at once. Past that, requests fail fast with a 503 instead of piling up
+behind a login burst.
+
+The request still waits for its hash. What the pool buys depends on the
+gunicorn worker: with gthread (gunicorn.conf.py, GUNICORN_THREADS > 1) a
+login burst takes at most PASSWORD_WORKERS cores of a worker, and its
+other threads keep serving pages meanwhile. With the sync worker
+(GUNICORN_THREADS=1) the worker is busy for the whole hash either way,
+and all the pool adds is the 503 when too many are queued.
+
+The work factor comes from BCRYPT_LOG_ROUNDS. Hashes made with another
+factor are upgraded the next time their owner logs in.'''
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+bcrypt = Bcrypt()
+
+LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+WORKERS = int(os.environ.get('PASSWORD_WORKERS', os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', 32))
+
+
+class PasswordServiceBusy(ServiceUnavailable):
+    description = 'We are handling a lot of logins right now, please try again in a moment.'
+
+
+def hash_rounds(hashed):
+    '''The work factor of a bcrypt hash ("$2b$12$..." -> 12), None if it cannot be read.'''
+
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordService:
+    '''Hashes and checks passwords on a bounded thread pool.'''
+
+    def __init__(self, rounds=LOG_ROUNDS, workers=WORKERS, max_pending=MAX_PENDING):
+        self.rounds = rounds
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self._dummy = None
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordServiceBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        '''Hash a new password with the configured work factor.'''
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        return self._run(bcrypt.generate_password_hash, password, self.rounds).decode('UTF-8')
+
+    def verify(self, hashed, password):
+        if not password:
+            return False
+        return self._run(bcrypt.check_password_hash, hashed, password)
+
+    def verify_dummy(self, password):
+        '''Spend as long as a real check would, for logins with an unknown
+        username, so response times do not reveal which usernames exist.
+        Always returns False.'''
+
+        if self._dummy is None or hash_rounds(self._dummy) != self.rounds:
+            self._dummy = self.hash('not-a-real-password')
+        self.verify(self._dummy, password or 'x')
+        return False
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+
+password_service = PasswordService()
@@ -0,0 +1,124 @@
+'''Query budgets: how many SQL statements a view (or any block) may run.
+
+    @routes.route('/admin/admin_home')
+    @query_budget(4)
+    def admin_home(): ...
+
+    with query_budget(2) as log:
+        client.get('/check/someone')
+
+Every statement run inside is counted, lazy loads in templates included.
+On a view that is the view itself: not the before_request hooks (g.user)
+and not a streamed body, which is read after the view has returned.
+Going over the budget, or running the same SELECT (same SQL, any
+parameters) more than `max_repeats` times, which is what a lazy load in a
+loop looks like, raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is
+set (TestingConfig) and logs a warning otherwise, with the statement that
+repeated.
+
+Views served through asgi.py are counted the same way, the budgets follow
+the contextvars into SQLAlchemy's greenlets.'''
+
+import logging
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+# the same SELECT this many times in one block is a loop
+MAX_REPEATS = 3
+
+# the budgets being counted, innermost last
+active = ContextVar('query_budgets', default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def shape(statement):
+    '''`statement` with IN lists of any length made alike.'''
+
+    return re.sub(r'\bIN \((?:[^()]|\([^()]*\))*\)', 'IN (...)', ' '.join(statement.split()))
+
+
+class QueryLog:
+    '''The statements run inside one query_budget block.'''
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, max_repeats):
+        '''{select: times} of the SELECTs run more than `max_repeats` times.'''
+
+        selects = Counter(shape(statement) for statement in self.statements
+                          if statement.lstrip().upper().startswith('SELECT'))
+        return {statement: times for statement, times in selects.items() if times > max_repeats}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count(conn, cursor, statement, parameters, context, executemany):
+    for budget in active.get():
+        budget.log.statements.append(statement)
+
+
+class query_budget(ContextDecorator):
+    '''At most `max_queries` statements, no SELECT more than `max_repeats`
+    times. `strict` (raise instead of log) defaults to the app's
+    QUERY_BUDGET_STRICT, True outside an app.'''
+
+    def __init__(self, max_queries, max_repeats=MAX_REPEATS, strict=None):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.strict = strict
+        self.log = None
+        self.tokens = []
+
+    def __call__(self, view):
+        decorated = super().__call__(view)
+        # for the test that every route has one
+        decorated.query_budget = self
+        return decorated
+
+    def _recreate_cm(self):
+        # a fresh counter each time the decorated view runs, views run concurrently
+        return query_budget(self.max_queries, self.max_repeats, self.strict)
+
+    def __enter__(self):
+        self.log = QueryLog()
+        self.tokens.append(active.set(active.get() + (self,)))
+        return self.log
+
+    def __exit__(self, exc_type, exc, tb):
+        active.reset(self.tokens.pop())
+        if exc_type is None:
+            self.check()
+        return False
+
+    def check(self):
+        problems = []
+        if self.log.count > self.max_queries:
+            problems.append(f'{self.log.count} queries, the budget is {self.max_queries}')
+        for statement, times in self.log.repeated(self.max_repeats).items():
+            problems.append(f'the same SELECT {times} times, a lazy load in a loop?\n    {statement}')
+        if not problems:
+            return
+
+        where = request.endpoint if has_request_context() else 'block'
+        message = f'{where}: ' + '\n'.join(problems)
+        strict = self.strict
+        if strict is None:
+            strict = current_app.config.get('QUERY_BUDGET_STRICT', False) if has_app_context() else True
+        if strict:
+            raise QueryBudgetExceeded(message)
+        log.warning(message)
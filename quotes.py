@@ -0,0 +1,282 @@
+'''Distance and fare quotes, computed on NumPy arrays.
+
+    fare = max(minimum, base + per_mile * miles) * hourly surcharge + zone fees
+
+`miles` is the haversine distance between the pick-up and drop-off
+coordinates times ROAD_FACTOR, since roads are longer than a straight
+line. The rate comes from RATES by vehicle type, the surcharge from the
+pick-up hour, and a zone fee is added for each end of the trip inside a
+zone (airports). Trips with a missing coordinate or an unknown vehicle
+type get NaN.
+
+The same code quotes one booking (quote_trip, used by /quote) or every
+reservation in a date range (requote, from the dispatch view) in one
+pass, using the coordinates cached on the addresses rows (see
+geocoding.py).
+
+requote() has the database map vehicle types to RATE_TABLE rows and cut
+pick-up times to hours. On Postgres the rows come back as a binary COPY
+read straight into a NumPy structured array, with no Python object per
+value; turning a row tuple per trip into columns would take longer than
+quoting them.'''
+
+import io
+import os
+import sys
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+from sqlalchemy import Integer, bindparam, case, cast, extract
+from sqlalchemy.orm import aliased
+
+from models import db, Address, Reservation
+
+EARTH_RADIUS_MILES = 3958.8
+
+# driving distance / straight line distance, about right for the Bay Area
+ROAD_FACTOR = float(os.environ.get('QUOTE_ROAD_FACTOR', 1.3))
+
+FareRate = namedtuple('FareRate', ('base', 'per_mile', 'minimum'))
+
+RATES = {
+    'Sedan (up to 4 passengers)': FareRate(15.0, 3.00, 45.0),
+    'SUV (up to 7 passengers)': FareRate(20.0, 3.75, 65.0),
+    'Sprinter Van (up to 14 passengers)': FareRate(35.0, 5.00, 120.0),
+}
+
+# fare multiplier by pick-up hour: nights and rush hours cost more
+HOURLY_SURCHARGE = np.array(
+    [1.25] * 6            # 00:00 - 05:59
+    + [1.0]               # 06:00
+    + [1.1] * 3           # 07:00 - 09:59
+    + [1.0] * 6           # 10:00 - 15:59
+    + [1.1] * 3           # 16:00 - 18:59
+    + [1.0] * 3           # 19:00 - 21:59
+    + [1.25] * 2          # 22:00 - 23:59
+)
+
+Zone = namedtuple('Zone', ('name', 'lat', 'lng', 'radius_miles', 'fee'))
+
+ZONES = (
+    Zone('SFO', 37.6213, -122.3790, 2.0, 10.0),
+    Zone('OAK', 37.7126, -122.2197, 1.5, 8.0),
+    Zone('SJC', 37.3639, -121.9289, 1.5, 8.0),
+)
+
+# per zone: latitude, longitude (radians), cos(latitude), radius as an angle, fee
+ZONE_TABLE = [
+    (np.radians(zone.lat), np.radians(zone.lng), np.cos(np.radians(zone.lat)),
+     zone.radius_miles / EARTH_RADIUS_MILES, zone.fee)
+    for zone in ZONES
+]
+
+VEHICLE_TYPES = list(RATES)
+RATE_TABLE = np.array([RATES[vehicle_type] for vehicle_type in VEHICLE_TYPES] + [(np.nan,) * 3])
+BASE_FARES, PER_MILE, MINIMUM_FARES = (np.ascontiguousarray(column) for column in RATE_TABLE.T)
+UNKNOWN_VEHICLE = len(VEHICLE_TYPES)
+VEHICLE_INDEX = {vehicle_type: i for i, vehicle_type in enumerate(VEHICLE_TYPES)}
+
+
+def radians(degrees):
+    '''A new float64 array of `degrees` (array-like, scalar) in radians.'''
+
+    degrees = np.atleast_1d(np.asarray(degrees))
+    if degrees.dtype == np.dtype('>f8') and not degrees.dtype.isnative:
+        # big-endian, from a binary COPY: swapping a plain copy is faster than a swapping cast
+        values = degrees.copy().byteswap(inplace=True).view(np.float64)
+    else:
+        values = np.array(degrees, dtype=np.float64)
+    return np.radians(values, out=values)
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    '''Great circle distance in miles, all arguments in radians (arrays broadcast).'''
+
+    # in place after the first subtractions, a day of trips makes no more temporaries
+    a = np.asarray(np.subtract(lat2, lat1))
+    a *= 0.5
+    np.sin(a, out=a)
+    a *= a
+    b = np.asarray(np.subtract(lng2, lng1))
+    b *= 0.5
+    np.sin(b, out=b)
+    b *= b
+    b *= np.cos(lat1)
+    b *= np.cos(lat2)
+    a += b
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_MILES
+    return a
+
+
+def add_zone_fees(fares, lat, lng, band):
+    '''Add to `fares` the fees of the zones each point is in, lat/lng in
+    radians. `band` is scratch space the size of `lat`.
+
+    Zones are a couple of miles across, so a flat (equirectangular)
+    distance is exact enough. Only points in a zone's latitude band are
+    looked at closely.'''
+
+    for zone_lat, zone_lng, cos_lat, radius, fee in ZONE_TABLE:
+        np.subtract(lat, zone_lat, out=band)
+        np.abs(band, out=band)
+        near = np.flatnonzero(band <= radius)
+        dy = lat[near] - zone_lat
+        dx = (lng[near] - zone_lng) * cos_lat
+        fares[near[dx * dx + dy * dy <= radius * radius]] += fee
+
+
+def vehicle_indexes(vehicle_types):
+    '''Row in RATE_TABLE of each vehicle type. An integer array is taken
+    to be rows already (see vehicle_index_column).'''
+
+    if isinstance(vehicle_types, np.ndarray) and vehicle_types.dtype.kind in 'iu':
+        return vehicle_types
+    if isinstance(vehicle_types, str):
+        vehicle_types = [vehicle_types]
+    return np.fromiter((VEHICLE_INDEX.get(kind, UNKNOWN_VEHICLE) for kind in vehicle_types),
+                       dtype=int, count=len(vehicle_types))
+
+
+def vehicle_index_column():
+    '''SQL for the RATE_TABLE row of Reservation.vehicle_type, so the
+    database maps types to rows instead of a Python loop.'''
+    return case(VEHICLE_INDEX, value=Reservation.vehicle_type, else_=UNKNOWN_VEHICLE)
+
+
+# requote()'s columns, as Postgres sends them in a binary COPY: big-endian,
+# each row a field count then every field's length and value
+QUOTE_COLUMNS = (('id', '>i4'), ('vehicle', '>i4'), ('hour', '>i4'),
+                 ('pu_lat', '>f8'), ('pu_lng', '>f8'), ('do_lat', '>f8'), ('do_lng', '>f8'))
+COPY_ROW = np.dtype([('fields', '>i2')]
+                    + [field for name, kind in QUOTE_COLUMNS
+                       for field in ((f'{name}_length', '>i4'), (name, kind))])
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\0'
+# the signature, flags and the header extension's length, then the extension
+COPY_HEADER_SIZE = len(COPY_SIGNATURE) + 8
+# the rows end with a field count of -1
+COPY_TRAILER_SIZE = 2
+
+QUOTE_ROW = np.dtype([(name, '=' + kind[1:]) for name, kind in QUOTE_COLUMNS])
+
+
+def quote(pu_lat, pu_lng, do_lat, do_lng, vehicle_types, pickup_hours):
+    '''(miles, fares) arrays for trips given as arrays (or scalars) of
+    coordinates in degrees, vehicle types (or their RATE_TABLE rows) and
+    pick-up hours (0-23).'''
+
+    pu_lat, pu_lng, do_lat, do_lng = (radians(x) for x in (pu_lat, pu_lng, do_lat, do_lng))
+    hours = np.atleast_1d(np.asarray(pickup_hours)).astype(np.intp)
+    hours %= 24
+    vehicles = vehicle_indexes(vehicle_types).astype(np.intp, copy=False)
+
+    miles = haversine_miles(pu_lat, pu_lng, do_lat, do_lng)
+    miles *= ROAD_FACTOR
+    fares = PER_MILE.take(vehicles)
+    fares *= miles
+    fares += BASE_FARES.take(vehicles)
+    np.maximum(fares, MINIMUM_FARES.take(vehicles), out=fares)
+    fares *= HOURLY_SURCHARGE.take(hours)
+    band = np.empty_like(pu_lat)
+    add_zone_fees(fares, pu_lat, pu_lng, band)
+    add_zone_fees(fares, do_lat, do_lng, band)
+
+    return np.round(miles, 1, out=miles), np.round(fares, 2, out=fares)
+
+
+def quote_trip(pu_lat, pu_lng, do_lat, do_lng, vehicle_type, pickup_time):
+    '''(miles, fare) of one trip, None for both when it cannot be quoted.'''
+
+    miles, fares = quote(pu_lat, pu_lng, do_lat, do_lng, [vehicle_type], pickup_time.hour)
+    if np.isnan(fares[0]):
+        return None, None
+    return float(miles[0]), float(fares[0])
+
+
+def copy_rows(data):
+    '''The rows of a binary COPY of requote()'s query (bytes) as a
+    structured array of COPY_ROW, a view of `data`. Every column is fixed
+    width and never NULL, so every row has the same layout.'''
+
+    if not data.startswith(COPY_SIGNATURE):
+        raise ValueError('not a binary COPY')
+    start = COPY_HEADER_SIZE + int.from_bytes(data[COPY_HEADER_SIZE - 4:COPY_HEADER_SIZE], 'big')
+    count = (len(data) - start - COPY_TRAILER_SIZE) // COPY_ROW.itemsize
+    return np.frombuffer(data, COPY_ROW, count=count, offset=start)
+
+
+def quote_query(start, end):
+    '''requote()'s rows (QUOTE_COLUMNS) of the geocoded trips picking up
+    between `start` and `end`.'''
+
+    pickup = aliased(Address)
+    dropoff = aliased(Address)
+    return (db.session.query(cast(Reservation.id, Integer), cast(vehicle_index_column(), Integer),
+                             cast(extract('hour', Reservation.PU_time), Integer),
+                             pickup.latitude, pickup.longitude, dropoff.latitude, dropoff.longitude)
+            .join(pickup, Reservation.PU_address_id == pickup.id)
+            .join(dropoff, Reservation.DO_address_id == dropoff.id)
+            .filter(Reservation.PU_date >= start, Reservation.PU_date <= end)
+            .filter(pickup.latitude != None, pickup.longitude != None,
+                    dropoff.latitude != None, dropoff.longitude != None))
+
+
+def fetch_rows(start, end):
+    '''quote_query() as a structured array with QUOTE_COLUMNS' fields.'''
+
+    query = quote_query(start, end)
+    if db.engine.dialect.name != 'postgresql':
+        return np.array([tuple(row) for row in query], dtype=QUOTE_ROW)
+
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    cursor = db.session.connection().connection.cursor()
+    sql = cursor.mogrify(str(compiled), compiled.params).decode()
+    buffer = io.BytesIO()
+    cursor.copy_expert(f'COPY ({sql}) TO STDOUT WITH (FORMAT binary)', buffer)
+    return copy_rows(buffer.getvalue())
+
+
+def quote_rows(rows):
+    '''(miles, fares) of the trips in a structured array from fetch_rows().'''
+
+    return quote(rows['pu_lat'], rows['pu_lng'], rows['do_lat'], rows['do_lng'],
+                 rows['vehicle'], rows['hour'])
+
+
+def requote(start, end):
+    '''Quote every reservation picking up between `start` and `end`
+    (inclusive) and store its distance_miles and quoted_fare. Trips whose
+    addresses are not geocoded yet are left alone. Returns how many
+    reservations got a quote.'''
+
+    rows = fetch_rows(start, end)
+    if not len(rows):
+        return 0
+
+    miles, fares = quote_rows(rows)
+    quoted = ~np.isnan(fares)
+    if not quoted.any():
+        return 0
+    ids = rows['id'].tolist()
+
+    table = Reservation.__table__
+    update = (table.update()
+              .where(table.c.id == bindparam('res_id'))
+              .values(distance_miles=bindparam('miles'), quoted_fare=bindparam('fare')))
+    db.session.execute(update, [
+        dict(res_id=res_id, miles=float(m), fare=float(f))
+        for res_id, m, f, ok in zip(ids, miles, fares, quoted) if ok
+    ])
+    db.session.commit()
+
+    return int(quoted.sum())
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        start, end = (date.fromisoformat(arg) for arg in sys.argv[1:3])
+        print(f'{requote(start, end)} reservations quoted')
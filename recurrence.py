@@ -0,0 +1,276 @@
+'''Repeating bookings: commutes, school runs.
+
+A RecurringReservation keeps the trip once plus a rule in a subset of
+iCalendar's RRULE:
+
+    FREQ=DAILY|WEEKLY [;INTERVAL=n] [;BYDAY=MO,TU,...] [;COUNT=n] [;UNTIL=YYYYMMDD]
+
+and a list of skipped days (RecurrenceException). occurrences() turns a
+rule into its dates with a generator, jumping straight to the window asked
+for, so showing the next few trips of a booking that repeats forever costs
+a handful of steps.
+
+Real Reservation rows, the ones the dispatch board, fleet checks, exports
+and drivers work from, are only made for the next RECURRING_HORIZON_DAYS.
+materialize() extends every booking up to the horizon in one executemany;
+a day with no vehicle of the booking's type free is skipped instead, as
+if the customer had skipped it. Run it once a day:
+
+    python recurrence.py'''
+
+import logging
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from heapq import merge
+from itertools import islice
+
+from sqlalchemy.orm import selectinload
+
+from addresses import link_records
+from bulk_import import FIELD_NAMES
+from fleet import reserve
+from models import db, RecurringReservation, RecurrenceException, Reservation
+
+log = logging.getLogger(__name__)
+
+RECURRING_HORIZON_DAYS = int(os.environ.get('RECURRING_HORIZON_DAYS', 14))
+
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+# the form's fields that are kept in RecurringReservation.trip
+TRIP_FIELDS = [name for name in FIELD_NAMES if name not in ('vehicle_type', 'PU_date', 'PU_time')]
+
+Rule = namedtuple('Rule', ('freq', 'interval', 'weekdays', 'count', 'until'))
+
+Occurrence = namedtuple('Occurrence', ('day', 'series'))
+
+
+@lru_cache(maxsize=256)
+def parse_rule(text):
+    '''A Rule from RRULE text. Raises ValueError for anything outside the subset.'''
+
+    parts = {}
+    for part in text.upper().replace('RRULE:', '').split(';'):
+        if not part:
+            continue
+        name, _, value = part.partition('=')
+        parts[name.strip()] = value.strip()
+
+    freq = parts.pop('FREQ', None)
+    if freq not in ('DAILY', 'WEEKLY'):
+        raise ValueError(f'unsupported FREQ: {freq}')
+
+    interval = int(parts.pop('INTERVAL', 1))
+    if interval < 1:
+        raise ValueError('INTERVAL must be at least 1')
+
+    weekdays = ()
+    if 'BYDAY' in parts:
+        try:
+            weekdays = tuple(sorted({WEEKDAYS.index(day.strip()) for day in parts.pop('BYDAY').split(',')}))
+        except ValueError:
+            raise ValueError('BYDAY takes MO, TU, WE, TH, FR, SA, SU') from None
+
+    count = int(parts.pop('COUNT')) if 'COUNT' in parts else None
+    until = datetime.strptime(parts.pop('UNTIL')[:8], '%Y%m%d').date() if 'UNTIL' in parts else None
+
+    if parts:
+        raise ValueError(f'unsupported rule parts: {", ".join(parts)}')
+    return Rule(freq, interval, weekdays, count, until)
+
+
+def describe_rule(text):
+    '''"Every weekday", "Every 2 weeks on Mon, Thu", ...'''
+
+    rule = parse_rule(text)
+    unit = 'day' if rule.freq == 'DAILY' else 'week'
+    every = f'Every {rule.interval} {unit}s' if rule.interval > 1 else f'Every {unit}'
+    if rule.weekdays == (0, 1, 2, 3, 4) and rule.interval == 1:
+        every = 'Every weekday'
+    elif rule.weekdays:
+        every += ' on ' + ', '.join(WEEKDAY_NAMES[day] for day in rule.weekdays)
+    if rule.count:
+        every += f', {rule.count} times'
+    return every
+
+
+def occurrences(rule, starts_on, start=None, end=None, until=None, skip=()):
+    '''Days of `rule` (RRULE text) from `starts_on`, lazily, in order.
+
+    Only days in [start, end] are yielded, none after `until` or the rule's
+    own UNTIL, and none in `skip`. Without an end of any kind the generator
+    never stops; take what you need with islice. Skipped days still count
+    towards COUNT, as with iCalendar's EXDATE.'''
+
+    rule = parse_rule(rule)
+    start = max(start or starts_on, starts_on)
+    last = min(day for day in (end, until, rule.until, date.max) if day is not None)
+
+    if rule.freq == 'DAILY':
+        period = timedelta(days=rule.interval)
+        period_start = starts_on
+        offsets = (0,)
+    else:
+        period = timedelta(weeks=rule.interval)
+        period_start = starts_on - timedelta(days=starts_on.weekday())
+        offsets = rule.weekdays or (starts_on.weekday(),)
+    offsets = [timedelta(days=offset) for offset in offsets]
+
+    if rule.count is None and start > period_start:
+        # skip the periods before the window; COUNT needs them counted
+        period_start += period * ((start - period_start) // period)
+
+    seen = 0
+    while True:
+        for offset in offsets:
+            day = period_start + offset
+            if day < starts_on:
+                continue
+            if day > last:
+                return
+            seen += 1
+            if rule.count is not None and seen > rule.count:
+                return
+            if day >= start and day not in skip:
+                yield day
+        period_start += period
+
+
+def series_days(series, start=None, end=None):
+    '''Days of a RecurringReservation, without its skipped days.'''
+
+    return occurrences(series.rule, series.starts_on, start, end, series.until, series.skipped)
+
+
+def expand(series_list, start, end=None):
+    '''Occurrences of several bookings merged in date order, lazily.'''
+
+    return merge(*((Occurrence(day, series) for day in series_days(series, start, end))
+                   for series in series_list),
+                 key=lambda occurrence: occurrence.day)
+
+
+def next_days(series, count, today=None):
+    return list(islice(series_days(series, today or date.today()), count))
+
+
+#############################################################################
+# Booking, skipping and stopping
+
+def trip_values(series, day):
+    '''Reservation columns of the trip of `series` on `day`.'''
+
+    values = dict(series.trip)
+    values.update(vehicle_type=series.vehicle_type, PU_time=series.PU_time, PU_date=day,
+                  user_id=series.user_id, recurring_id=series.id)
+    return values
+
+
+def start_series(user_id, fields, rule, until=None):
+    '''A new repeating booking from ResForm's fields (a dict), and the
+    Reservation of its first trip, both added to the session for the
+    caller to commit. The first trip is the first day of the rule on or
+    after fields['PU_date']. Returns (series, reservation).'''
+
+    series = RecurringReservation(user_id=user_id, rule=rule, starts_on=fields['PU_date'],
+                                  until=until, vehicle_type=fields['vehicle_type'],
+                                  PU_time=fields['PU_time'],
+                                  trip={name: fields.get(name) for name in TRIP_FIELDS})
+
+    days = occurrences(rule, series.starts_on, until=until)
+    first = next(days, None)
+    if first is None:
+        raise ValueError('the rule has no day on or after the pick-up date')
+    if parse_rule(rule).count is not None:
+        # a COUNT rule ends, keep its last day so materialize() can forget it
+        *_, last = [first, *days]
+        series.until = last
+
+    db.session.add(series)
+    db.session.flush()
+
+    res = Reservation(**trip_values(series, first))
+    series.materialized_through = first
+    db.session.add(res)
+    return series, res
+
+
+def skip_day(series, day):
+    '''Skip one day of a repeating booking, cancelling its trip if it was
+    already made. The caller commits.'''
+
+    if day not in series.skipped:
+        series.exceptions.append(RecurrenceException(day=day))
+    Reservation.query.filter_by(recurring_id=series.id, PU_date=day).delete(synchronize_session=False)
+
+
+def stop_series(series, last_day):
+    '''End a repeating booking after `last_day`, cancelling its later trips.
+    The caller commits.'''
+
+    series.until = min(series.until or last_day, last_day)
+    (Reservation.query
+     .filter(Reservation.recurring_id == series.id, Reservation.PU_date > last_day)
+     .delete(synchronize_session=False))
+
+
+#############################################################################
+# Materializing
+
+def materialize(through=None, series_ids=None):
+    '''Make the Reservation rows of every repeating booking (or of
+    `series_ids`) up to `through`, default today + RECURRING_HORIZON_DAYS,
+    and commit. Each booking continues from its materialized_through, so
+    running it again adds only the new days. Returns how many trips were
+    made.
+
+    Days on which the fleet is full are added to the booking's skipped
+    days and logged.'''
+
+    through = through or date.today() + timedelta(days=RECURRING_HORIZON_DAYS)
+
+    query = (RecurringReservation.query
+             .options(selectinload(RecurringReservation.exceptions))
+             .filter(db.or_(RecurringReservation.materialized_through == None,
+                            RecurringReservation.materialized_through < through))
+             .filter(db.or_(RecurringReservation.until == None,
+                            RecurringReservation.materialized_through == None,
+                            RecurringReservation.until > RecurringReservation.materialized_through)))
+    if series_ids is not None:
+        query = query.filter(RecurringReservation.id.in_(series_ids))
+
+    records = []
+    record_series = []
+    now = datetime.utcnow()
+    for series in query:
+        after = series.materialized_through
+        start = after + timedelta(days=1) if after else None
+        for day in series_days(series, start, through):
+            records.append(dict(trip_values(series, day), created_date=now, updated_at=now))
+            record_series.append(series)
+        series.materialized_through = through
+
+    fit = reserve([(record['vehicle_type'], record['PU_date'], record['PU_time']) for record in records])
+    for record, series, ok in zip(records, record_series, fit):
+        if not ok:
+            log.warning('no %s free at %s on %s, skipping that day of repeating booking %s',
+                        series.vehicle_type, series.PU_time, record['PU_date'], series.id)
+            series.exceptions.append(RecurrenceException(day=record['PU_date']))
+    records = [record for record, ok in zip(records, fit) if ok]
+
+    if records:
+        link_records(db.session.connection(), records)
+        db.session.execute(Reservation.__table__.insert(), records)
+    db.session.commit()
+
+    return len(records)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        print(f'{materialize()} trips made from repeating bookings')
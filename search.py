@@ -0,0 +1,146 @@
+'''Reservation search for dispatchers.
+
+Matches passenger name and phone, pick-up and drop-off address (the
+search-box line, which has the city) and the reservation number.
+
+On Postgres, reservations carry two generated columns kept up to date by
+the database: search_vector (tsvector, GIN index) for word matches and
+search_text (GIN trigram index) for typos and partial words. On SQLite an
+FTS5 table shadows the same columns through triggers and prefix-matches
+each word. Both are created with the reservations table (see the DDL
+events below); existing Postgres databases get them from
+migrations/0004_reservation_search.sql and 0010_drop_address_text.sql.'''
+
+import re
+
+from sqlalchemy import event, text, DDL
+
+from models import db, Reservation
+
+SEARCH_COLUMNS = ('passenger_name', 'passenger_phone', 'PU_address', 'DO_address')
+
+# results are ranked and cut off here, nobody pages past the first few screens
+MAX_RESULTS = 200
+
+# reservations.id is an INTEGER column
+MAX_ID = 2 ** 31 - 1
+
+
+def _concat(columns):
+    return " || ' ' || ".join(f'coalesce("{column}", \'\')' for column in columns)
+
+
+POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f"ALTER TABLE reservations ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('simple', {_concat(SEARCH_COLUMNS)})) STORED",
+    f"ALTER TABLE reservations ADD COLUMN IF NOT EXISTS search_text text "
+    f"GENERATED ALWAYS AS (lower({_concat(SEARCH_COLUMNS)})) STORED",
+    'CREATE INDEX IF NOT EXISTS ix_reservations_search_vector ON reservations USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS ix_reservations_search_trgm ON reservations USING gin (search_text gin_trgm_ops)',
+]
+
+_fts_columns = ', '.join(SEARCH_COLUMNS)
+_new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+_old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS reservations_fts USING fts5("
+    f"{_fts_columns}, content='reservations', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS reservations_fts_insert AFTER INSERT ON reservations BEGIN "
+    f"INSERT INTO reservations_fts(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS reservations_fts_delete AFTER DELETE ON reservations BEGIN "
+    f"INSERT INTO reservations_fts(reservations_fts, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS reservations_fts_update AFTER UPDATE ON reservations BEGIN "
+    f"INSERT INTO reservations_fts(reservations_fts, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO reservations_fts(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(Reservation.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(Reservation.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Reservation.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS reservations_fts').execute_if(dialect='sqlite'))
+
+
+POSTGRES_SEARCH = text('''
+    SELECT id FROM (
+        SELECT id,
+               ts_rank(search_vector, websearch_to_tsquery('simple', :q)) * 2
+               + word_similarity(:lower_q, search_text)
+               + CASE WHEN id = :res_id THEN 10 ELSE 0 END AS rank
+        FROM reservations
+        WHERE search_vector @@ websearch_to_tsquery('simple', :q)
+           OR :lower_q <% search_text
+           OR id = :res_id
+    ) ranked
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit OFFSET :offset
+''')
+
+SQLITE_SEARCH = text('''
+    SELECT id FROM (
+        SELECT rowid AS id, bm25(reservations_fts) AS rank
+        FROM reservations_fts
+        WHERE reservations_fts MATCH :match
+        UNION ALL
+        SELECT id, -1000 AS rank FROM reservations WHERE id = :res_id
+    )
+    GROUP BY id
+    ORDER BY min(rank), id DESC
+    LIMIT :limit OFFSET :offset
+''')
+
+
+def fts5_query(q):
+    '''Turn free text into an FTS5 query: every word must match as a prefix.'''
+
+    words = re.findall(r'\w+', q)
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def search_ids(q, limit, offset=0):
+    '''Ids of the best matching reservations, best first.'''
+
+    q = q.strip()
+    # isdigit() alone also takes '²' and other digits int() refuses
+    res_id = int(q) if q.isascii() and q.isdigit() else None
+    if res_id is not None and res_id > MAX_ID:
+        res_id = None
+    params = dict(limit=limit, offset=offset, res_id=res_id)
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(POSTGRES_SEARCH, dict(params, q=q, lower_q=q.lower()))
+    else:
+        match = fts5_query(q)
+        if not match:
+            return [res_id] if res_id is not None and offset == 0 else []
+        rows = db.session.execute(SQLITE_SEARCH, dict(params, match=match))
+
+    return [row[0] for row in rows]
+
+
+def search_reservations(q, page=1, per_page=25):
+    '''One page of reservations matching `q`, best match first, with their
+    customers loaded. Returns (reservations, has_more).'''
+
+    offset = (page - 1) * per_page
+    if not q or not q.strip() or offset >= MAX_RESULTS:
+        return [], False
+
+    limit = min(per_page + 1, MAX_RESULTS - offset)
+    ids = search_ids(q, limit=limit, offset=offset)
+    has_more = len(ids) > per_page and offset + per_page < MAX_RESULTS
+    ids = ids[:per_page]
+
+    if not ids:
+        return [], False
+
+    found = (Reservation.query
+             .outerjoin(Reservation.user)
+             .options(db.contains_eager(Reservation.user))
+             .filter(Reservation.id.in_(ids))
+             .all())
+    by_id = {res.id: res for res in found}
+    return [by_id[res_id] for res_id in ids if res_id in by_id], has_more
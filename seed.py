@@ -1,6 +1,10 @@
 from models import db
 from app import app
+from migrate import migrate
 
 # Drop (if any) and create all tables.
 db.drop_all()
-db.create_all()
\ No newline at end of file
+db.create_all()
+
+# create_all already built the latest schema, so no migration needs to run.
+migrate(db.engine, mark_only=True)
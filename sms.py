@@ -0,0 +1,57 @@
+'''SMS providers used by the outbox worker.
+
+A provider is any object with a send(to, body) method that raises on
+failure. Pick one with the SMS_PROVIDER env var ("twilio" or "fake").'''
+
+import os
+
+from metrics import timed
+
+try:
+    from secret import account_sid, auth_token, twilio_number
+except:
+    account_sid = os.environ.get("ACCOUNT_SID")
+    auth_token = os.environ.get("AUTH_TOKEN")
+    twilio_number = os.environ.get("TWILIO_NUMBER")
+
+
+class TwilioProvider:
+    '''Send text messages through the Twilio API.'''
+
+    def __init__(self, sid=account_sid, token=auth_token, from_number=twilio_number):
+        # imported here so the web app and tests never load the twilio package
+        from twilio.rest import Client
+
+        self.client = Client(sid, token)
+        self.from_number = from_number
+
+    def send(self, to, body):
+        with timed('twilio', 'send'):
+            return self.client.messages.create(body=body, from_=self.from_number, to=to)
+
+
+class FakeProvider:
+    '''Keeps sent messages in memory instead of sending them, for tests and local runs.
+    Set `fail_with` to an exception to make every send fail.'''
+
+    def __init__(self, fail_with=None):
+        self.sent = []
+        self.fail_with = fail_with
+
+    def send(self, to, body):
+        if self.fail_with is not None:
+            raise self.fail_with
+        self.sent.append((to, body))
+
+
+PROVIDERS = {
+    'twilio': TwilioProvider,
+    'fake': FakeProvider,
+}
+
+
+def get_provider(name=None):
+    '''Build the provider named by `name` or the SMS_PROVIDER env var (default twilio).'''
+
+    name = name or os.environ.get('SMS_PROVIDER', 'twilio')
+    return PROVIDERS[name]()
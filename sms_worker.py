@@ -0,0 +1,132 @@
+'''Background worker that drains the SMS outbox.
+
+Run it as its own process (see the Procfile):
+
+    python sms_worker.py
+
+Messages are claimed in batches: marked sending and committed, so no row
+stays locked while the provider is called. Each message is then sent and
+its result committed on its own, so a worker that dies halfway through a
+batch sends again at most the message it was on. The rest of its claim
+is picked up by any worker once SMS_CLAIM_SECONDS have passed.
+
+A failed send is retried with exponential backoff until SMS_MAX_ATTEMPTS
+is reached, then marked failed. Sends are throttled to SMS_RATE_PER_SECOND
+across the whole worker.'''
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from models import db, SmsOutbox
+from sms import get_provider
+
+BATCH_SIZE = int(os.environ.get('SMS_BATCH_SIZE', 50))
+RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', 1))
+MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', 5))
+RETRY_BASE_SECONDS = int(os.environ.get('SMS_RETRY_BASE_SECONDS', 30))
+POLL_SECONDS = float(os.environ.get('SMS_POLL_SECONDS', 2))
+# longer than a batch takes to send at the rate limit
+CLAIM_SECONDS = int(os.environ.get('SMS_CLAIM_SECONDS', 600))
+
+
+class RateLimiter:
+    '''Token bucket: allows `rate` sends per second with bursts up to `burst`.'''
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def acquire(self):
+        '''Block until a send is allowed.'''
+
+        while True:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            self.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff(attempts, base=RETRY_BASE_SECONDS):
+    '''Delay before the next try after `attempts` failed sends: base, 2*base, 4*base...'''
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def claim(batch_size, claim_seconds=CLAIM_SECONDS):
+    '''Mark a batch of due messages as being sent by this worker and commit,
+    which releases their row locks. Until `claim_seconds` have passed no
+    other worker picks them up.'''
+
+    batch = SmsOutbox.due(batch_size)
+    until = datetime.utcnow() + timedelta(seconds=claim_seconds)
+    for message in batch:
+        message.status = SmsOutbox.SENDING
+        message.next_attempt_at = until
+    db.session.commit()
+    return batch
+
+
+def drain_once(provider, limiter=None, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS,
+               claim_seconds=CLAIM_SECONDS):
+    '''Claim one batch of due messages, then send them, committing the
+    result of each message as soon as it is known.
+    Returns the number of messages picked up.'''
+
+    batch = claim(batch_size, claim_seconds)
+
+    for message in batch:
+        if limiter is not None:
+            limiter.acquire()
+
+        message.attempts += 1
+        try:
+            provider.send(message.to, message.body)
+        except Exception as e:
+            message.last_error = str(e)
+            if message.attempts >= max_attempts:
+                message.status = SmsOutbox.FAILED
+            else:
+                message.status = SmsOutbox.PENDING
+                message.next_attempt_at = datetime.utcnow() + backoff(message.attempts)
+        else:
+            message.status = SmsOutbox.SENT
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+        db.session.commit()
+
+    return len(batch)
+
+
+def run(provider=None):
+    '''Poll the outbox forever.'''
+
+    provider = provider or get_provider()
+    limiter = RateLimiter(RATE_PER_SECOND)
+
+    while True:
+        picked_up = drain_once(provider, limiter)
+
+        # only wait when the outbox is empty, keep going while there is a backlog
+        if picked_up < BATCH_SIZE:
+            time.sleep(POLL_SECONDS)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    if os.environ.get('METRICS_PORT'):
+        # the worker's own /metrics (Twilio timings, its SQL), it is not behind the web app
+        from prometheus_client import start_http_server
+        start_http_server(int(os.environ['METRICS_PORT']))
+
+    with app.app_context():
+        run()
@@ -6,40 +6,41 @@ $('#flashMsg').on('click', '.delete-button', async function (evt) {
 })
 
 
-// check if username already existis in the users database
-$('#username').on('focusout', function () {
-    $.getJSON("/check/" + $("#username").val(), (data) => {
+// check if the username, phone number and email are still free, all in one request
+$('#username, #phone, #email').on('focusout', function () {
+    let params = {};
+    for (let field of ['username', 'phone', 'email']) {
+        let value = $("#" + field).val();
+        if (value) {
+            params[field] = value;
+        }
+    }
 
-        if (data['exists'] === true) {
+    if ($.isEmptyObject(params)) {
+        return;
+    }
+
+    $.getJSON("/availability", params, (data) => {
+        let available = data['available'];
+
+        if (available['username'] === true) {
             $("#checkUser").html("<i style='color:#4bbf73;' class='fa-solid fa-check fa-xl'></i><span class='badge rounded-pill bg-success'>This username is available!</span>");
 
-        } else {
+        } else if (available['username'] === false) {
             $("#checkUser").html("<i style='color:#d9534f;' class='fa-solid fa-triangle-exclamation fa-xl'></i><span class='badge rounded-pill bg-danger'>This username is not available!</span>");
         }
-    })
-});
-
-// check if phone number already existis in the users database
-$('#phone').on('focusout', function () {
-    $.getJSON("/verify/" + $("#phone").val(), (data) => {
 
-        if (data['exists'] === true) {
+        if (available['phone'] === true) {
             $("#phoneCheck").html("<i style='color:#4bbf73;' class='fa-solid fa-check fa-xl'></i>");
 
-        } else {
+        } else if (available['phone'] === false) {
             $("#phoneCheck").html("<i style='color:#d9534f;' class='fa-solid fa-triangle-exclamation fa-xl'></i><span class='badge rounded-pill bg-danger'>This phone number belongs to another user.</span>");
         }
-    })
-});
 
-// check if email already existis in the users database
-$('#email').on('focusout', function () {
-    $.getJSON("/lookup/" + $("#email").val(), (data) => {
-
-        if (data['exists'] === true) {
+        if (available['email'] === true) {
             $("#checkEmail").html("<i style='color:#4bbf73;' class='fa-solid fa-check fa-xl'></i>");
 
-        } else {
+        } else if (available['email'] === false) {
             $("#checkEmail").html("<i style='color:#d9534f;' class='fa-solid fa-triangle-exclamation fa-xl'></i><span class='badge rounded-pill bg-danger'>This E-mail belongs to another user.</span>");
         }
     })
@@ -72,11 +73,14 @@ $('#admin_email').on('focusout', function () {
 });
 
 
-// Mapquest place-search API for address input 
-window.onload = function () {
+// Mapquest place-search API for address input, pick-up and drop-off
+// coordinates of the chosen places, for the fare quote
+let coords = {PU: null, DO: null};
+
+function addressSearch(prefix) {
     let ps = placeSearch({
         key: 'Ytg3hzPVuz5SkYxL04RbcLm2AZQrHGhm',
-        container: document.querySelector('#PU_address'),
+        container: document.querySelector('#' + prefix + '_address'),
         useDeviceLocation: true,
         collection: [
             'poi',
@@ -88,23 +92,61 @@ window.onload = function () {
     });
 
     ps.on('change', (e) => {
-        document.querySelector('#PU_street').value = e.result.name || '';
-        document.querySelector('#PU_city').value = e.result.city || '';
-        document.querySelector('#PU_state').value = e.result.stateCode || '';
-        document.querySelector('#PU_zip').value = e.result.postalCode || '';
-        document.querySelector('#PU_country').value = e.result.countryCode || '';
+        document.querySelector('#' + prefix + '_street').value = e.result.name || '';
+        document.querySelector('#' + prefix + '_city').value = e.result.city || '';
+        document.querySelector('#' + prefix + '_state').value = e.result.stateCode || '';
+        document.querySelector('#' + prefix + '_zip').value = e.result.postalCode || '';
+        document.querySelector('#' + prefix + '_country').value = e.result.countryCode || '';
+        coords[prefix] = e.result.latlng || null;
+        updateQuote();
     });
 
     ps.on('clear', () => {
-        document.querySelector('#PU_street').value = '';
-        document.querySelector('#PU_city').value = '';
-        document.querySelector('#PU_state').value = '';
-        document.querySelector('#PU_zip').value = '';
-        document.querySelector('#PU_country').value = '';
+        document.querySelector('#' + prefix + '_street').value = '';
+        document.querySelector('#' + prefix + '_city').value = '';
+        document.querySelector('#' + prefix + '_state').value = '';
+        document.querySelector('#' + prefix + '_zip').value = '';
+        document.querySelector('#' + prefix + '_country').value = '';
+        coords[prefix] = null;
+        updateQuote();
     });
 
     ps.on('error', (e) => {
         console.log(e);
     })
+}
+
+// show the fare for the chosen places, vehicle and pick-up time
+function updateQuote() {
+    if ($('#fare-quote').length === 0) {
+        return;
+    }
+    if (!coords.PU || !coords.DO) {
+        $('#fare-quote').html('');
+        return;
+    }
+
+    let params = {
+        pu_lat: coords.PU.lat, pu_lng: coords.PU.lng,
+        do_lat: coords.DO.lat, do_lng: coords.DO.lng,
+        vehicle_type: $('#vehicle_type').val(),
+        time: $('#PU_time').val(),
+    };
+
+    $.getJSON('/quote', params, (data) => {
+        if (data['fare'] === null) {
+            $('#fare-quote').html('');
+        } else {
+            $('#fare-quote').html("<span class='badge rounded-pill bg-info'>Estimated fare: $" + data['fare'].toFixed(2) + ' (' + data['miles'] + ' miles)</span>');
+        }
+    })
+}
 
+$('#vehicle_type, #PU_time').on('change', updateQuote);
+
+window.onload = function () {
+    addressSearch('PU');
+    if (document.querySelector('#DO_address')) {
+        addressSearch('DO');
+    }
 };
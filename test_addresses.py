@@ -0,0 +1,147 @@
+'''Testing for the address store'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_addresses.py
+
+import io
+from unittest import TestCase
+from datetime import date, time
+
+from sqlalchemy import select, text
+
+from models import db, Address, Reservation, User
+
+from app import create_app
+from addresses import normalize_address, pickups_in, pickup_counts, backfill, LEGACY_RESERVATIONS
+from bulk_import import import_reservations
+
+app = create_app('testing')
+
+db.create_all()
+
+
+class NormalizeTestCase(TestCase):
+
+    def test_same_address_same_key(self):
+        "Are different spellings of one address given the same key?"
+
+        a = normalize_address("123  market street", "san francisco", "California", "94103-1234", "USA")
+        b = normalize_address("123 Market St.", "San Francisco", "CA", "94103", "")
+
+        self.assertEqual(a, b)
+        self.assertEqual(a.street, "123 Market St")
+        self.assertEqual(a.state, "CA")
+        self.assertEqual(a.zip, "94103")
+        self.assertEqual(a.country, "US")
+
+        self.assertNotEqual(a.key, normalize_address("125 Market St", "San Francisco", "CA", "94103", "US").key)
+
+
+    def test_no_address(self):
+        self.assertIsNone(normalize_address("", None, "CA", "", ""))
+
+
+class AddressStoreTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+    def make_res(self, street, city, **kw):
+        res = Reservation(passenger_name="Test User",
+                          passenger_phone="987-654-3210",
+                          vehicle_type="Sedan (up to 4 passengers)",
+                          PU_date=date(2022, 7, 15),
+                          PU_time=time(9, 0),
+                          PU_address=f"{street}, {city}",
+                          PU_street=street,
+                          PU_city=city,
+                          DO_address="SFO Airport",
+                          DO_street="SFO Airport",
+                          DO_city="San Francisco",
+                          user_id=self.user_id,
+                          **kw)
+        db.session.add(res)
+        return res
+
+
+    def test_reservations_share_addresses(self):
+        "Do repeated trips point at the same address rows?"
+
+        first = self.make_res("123 Market Street", "San Francisco")
+        second = self.make_res("123 market st", "san francisco")
+        db.session.commit()
+
+        self.assertEqual(first.PU_address_id, second.PU_address_id)
+        self.assertEqual(first.DO_address_id, second.DO_address_id)
+        self.assertEqual(Address.query.count(), 2)
+        self.assertEqual(first.pickup.street, "123 Market St")
+
+
+    def test_edit_relinks(self):
+        res = self.make_res("123 Market Street", "San Francisco")
+        db.session.commit()
+        old_id = res.PU_address_id
+
+        res.PU_street = "1 Main St"
+        res.PU_city = "Oakland"
+        db.session.commit()
+
+        self.assertNotEqual(res.PU_address_id, old_id)
+        self.assertEqual(res.pickup.city, "Oakland")
+        self.assertEqual([r.id for r in pickups_in(city="oakland")], [res.id])
+
+
+    def test_backfill(self):
+        "Are reservations made before the address store linked in batches?"
+
+        # the text columns migrations/0010_drop_address_text.sql drops
+        for column in LEGACY_RESERVATIONS.c:
+            if column.name not in Reservation.__table__.c:
+                db.session.execute(text(f'ALTER TABLE reservations ADD COLUMN "{column.name}" VARCHAR'))
+
+        for n in range(7):
+            self.make_res(f"{n % 3} Market St", "Oakland" if n % 2 else "Berkeley")
+        db.session.commit()
+        db.session.execute(LEGACY_RESERVATIONS.update().values(
+            PU_address_id=None, DO_address_id=None,
+            PU_street=select(Address.street).where(Address.id == LEGACY_RESERVATIONS.c.PU_address_id).scalar_subquery(),
+            PU_city=select(Address.city).where(Address.id == LEGACY_RESERVATIONS.c.PU_address_id).scalar_subquery(),
+            DO_street="SFO Airport", DO_city="San Francisco"))
+        db.session.execute(Address.__table__.delete())
+        db.session.commit()
+
+        logged = []
+        self.assertEqual(backfill(batch_size=3, log=logged.append), 7)
+        self.assertEqual(len(logged), 3)
+
+        self.assertEqual(Reservation.query.filter(Reservation.PU_address_id == None).count(), 0)
+        self.assertEqual(dict(pickup_counts()), {"Berkeley": 4, "Oakland": 3})
+
+
+    def test_bulk_import_links_addresses(self):
+        csv_file = io.StringIO(
+            "passenger_name,passenger_phone,vehicle_type,PU_date,PU_time,PU_street,PU_city,PU_zip,DO_street,DO_city\n"
+            "A,1,Sedan (up to 4 passengers),2022-07-15,09:30,1 Main St,Oakland,94607,SFO Airport,San Francisco\n"
+            "B,1,Sedan (up to 4 passengers),2022-07-16,09:30,1 Main Street,Oakland,94607-0001,SFO Airport,San Francisco\n"
+        )
+        result = import_reservations(csv_file, self.user_id)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual(Address.query.count(), 2)
+        self.assertEqual(pickups_in(zip_code="94607").count(), 2)
@@ -0,0 +1,202 @@
+'''Testing for the JSON API'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_api.py
+
+from unittest import TestCase
+from datetime import date, time, timedelta
+
+from models import db, Reservation, User
+
+from app import CURR_ADMIN_KEY, CURR_USER_KEY, create_app
+
+app = create_app('testing')
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        other = User.register(username="otheruser",
+                              password="anypassword",
+                              email="other@testing.org",
+                              first_name="Other",
+                              last_name="User",
+                              phone="123-456-7892")
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.user_id = user.id
+        self.other_id = other.id
+        self.admin_id = admin.id
+
+        tomorrow = date.today() + timedelta(days=1)
+        for n in range(15):
+            db.session.add(Reservation(passenger_name=f"Passenger {n}",
+                                       passenger_phone="987-654-3210",
+                                       vehicle_type="Sedan (up to 4 passengers)",
+                                       PU_date=tomorrow,
+                                       PU_time=time(6 + n % 12, 0),
+                                       PU_address="123 Market St",
+                                       DO_address="SFO Airport",
+                                       user_id=self.user_id))
+        db.session.add(Reservation(passenger_name="Someone Else",
+                                   passenger_phone="987-654-3211",
+                                   vehicle_type="Sedan (up to 4 passengers)",
+                                   PU_date=tomorrow,
+                                   PU_time=time(9, 0),
+                                   PU_address="1 Main St",
+                                   PU_street="1 main street",
+                                   PU_city="Oakland",
+                                   DO_address="SFO Airport",
+                                   user_id=self.other_id))
+        db.session.commit()
+        self.other_res_id = Reservation.query.filter_by(user_id=self.other_id).one().id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+    def login(self, c, key, user_id):
+        with c.session_transaction() as sess:
+            sess[key] = user_id
+
+
+    def test_login_required(self):
+        resp = self.client.get('/api/v1/reservations')
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.json["error"], "Unauthorized")
+
+
+    def test_own_reservations_paged(self):
+        "Does a customer page through only their own trips?"
+
+        with self.client as c:
+            self.login(c, CURR_USER_KEY, self.user_id)
+
+            first = c.get('/api/v1/reservations?per_page=10').json
+            self.assertEqual(len(first["reservations"]), 10)
+            self.assertIsNotNone(first["next"])
+
+            rest = c.get(f'/api/v1/reservations?per_page=10&after={first["next"]}').json
+            self.assertEqual(len(rest["reservations"]), 5)
+            self.assertIsNone(rest["next"])
+
+            names = {r["passenger_name"] for r in first["reservations"] + rest["reservations"]}
+            self.assertNotIn("Someone Else", names)
+            self.assertEqual(len(names), 15)
+
+            resp = c.get(f'/api/v1/reservations/{self.other_res_id}')
+            self.assertEqual(resp.status_code, 401)
+
+
+    def test_sparse_fieldset(self):
+        with self.client as c:
+            self.login(c, CURR_USER_KEY, self.user_id)
+
+            resp = c.get('/api/v1/reservations?fields=PU_date,PU_time')
+            row = resp.json["reservations"][0]
+            self.assertEqual(set(row), {"id", "PU_date", "PU_time"})
+            self.assertEqual(row["PU_time"], "06:00:00")
+
+            resp = c.get('/api/v1/reservations?fields=nope')
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.get(f'/api/v1/users/{self.user_id}?fields=password')
+            self.assertEqual(resp.status_code, 400)
+
+
+    def test_address_fields(self):
+        "Are the address parts read from the address rows, in the same query?"
+
+        with self.client as c:
+            self.login(c, CURR_ADMIN_KEY, self.admin_id)
+
+            resp = c.get(f'/api/v1/reservations/{self.other_res_id}?fields=PU_street,PU_city,DO_city')
+            self.assertEqual(resp.json["reservation"], {"id": self.other_res_id, "PU_street": "1 Main St",
+                                                        "PU_city": "Oakland", "DO_city": None})
+
+
+    def test_not_modified(self):
+        "Is a 304 returned until the reservation changes?"
+
+        with self.client as c:
+            self.login(c, CURR_USER_KEY, self.user_id)
+
+            res_id = c.get('/api/v1/reservations').json["reservations"][0]["id"]
+            url = f'/api/v1/reservations/{res_id}'
+
+            resp = c.get(url)
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+
+            list_etag = c.get('/api/v1/reservations').headers["ETag"]
+            resp = c.get('/api/v1/reservations', headers={"If-None-Match": list_etag})
+            self.assertEqual(resp.status_code, 304)
+
+            res = Reservation.query.get(res_id)
+            res.trip_notes = "Flight UA 123"
+            db.session.commit()
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json["reservation"]["trip_notes"], "Flight UA 123")
+
+            resp = c.get('/api/v1/reservations', headers={"If-None-Match": list_etag})
+            self.assertEqual(resp.status_code, 200)
+
+
+    def test_users(self):
+        with self.client as c:
+            self.login(c, CURR_USER_KEY, self.user_id)
+            self.assertEqual(c.get('/api/v1/users').status_code, 401)
+            self.assertEqual(c.get(f'/api/v1/users/{self.other_id}').status_code, 401)
+
+            user = c.get(f'/api/v1/users/{self.user_id}').json["user"]
+            self.assertEqual(user["username"], "testuser")
+            self.assertNotIn("password", user)
+
+        with self.client as c:
+            self.login(c, CURR_ADMIN_KEY, self.admin_id)
+            users = c.get('/api/v1/users').json["users"]
+            self.assertEqual([u["username"] for u in users], ["testuser", "otheruser", "testadmin"])
+
+            resp = c.get('/api/v1/reservations?per_page=100')
+            self.assertEqual(len(resp.json["reservations"]), 16)
+
+
+    def test_pool(self):
+        with self.client as c:
+            self.login(c, CURR_USER_KEY, self.user_id)
+            self.assertEqual(c.get('/api/v1/pool').status_code, 401)
+
+        with self.client as c:
+            self.login(c, CURR_ADMIN_KEY, self.admin_id)
+            resp = c.get('/api/v1/pool')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("pool", resp.json["pool"])
+            self.assertIn('no-store', resp.headers['Cache-Control'])
@@ -0,0 +1,127 @@
+'''Testing for the async serving path'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_asgi.py
+
+from unittest import TestCase, skipUnless
+from datetime import date, time, timedelta
+
+from models import db, Reservation, User
+
+from app import CURR_ADMIN_KEY, CURR_USER_KEY, create_app
+
+app = create_app('testing')
+
+db.create_all()
+
+try:
+    from starlette.testclient import TestClient
+    from asgi import AsyncApp, async_url
+    async_url(app.config['SQLALCHEMY_DATABASE_URI']).get_dialect().dbapi()
+except ImportError:
+    AsyncApp = None
+
+
+@skipUnless(AsyncApp, 'Starlette, httpx or the async database driver is not installed')
+class AsgiTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.asgi_app = AsyncApp(app)
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.user_id = user.id
+        self.admin_id = admin.id
+
+        tomorrow = date.today() + timedelta(days=1)
+        for n in range(3):
+            db.session.add(Reservation(passenger_name=f"Passenger {n}",
+                                       passenger_phone="987-654-3210",
+                                       vehicle_type="Sedan (up to 4 passengers)",
+                                       PU_date=tomorrow,
+                                       PU_time=time(6 + n, 0),
+                                       PU_address="123 Market St",
+                                       DO_address="SFO Airport",
+                                       user_id=self.user_id))
+        db.session.commit()
+        self.res_id = Reservation.query.order_by(Reservation.id).first().id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def client(self, key=None, user_id=None):
+        client = TestClient(self.asgi_app)
+        if key is not None:
+            cookie = app.session_interface.get_signing_serializer(app).dumps({key: user_id})
+            client.cookies.set(app.config['SESSION_COOKIE_NAME'], cookie)
+        return client
+
+
+    def test_routing(self):
+        "Are only the read-only endpoints served on the event loop?"
+
+        get = lambda path: {'type': 'http', 'method': 'GET', 'path': path}
+        self.assertIsNotNone(self.asgi_app.endpoint(get('/api/v1/reservations')))
+        self.assertIsNotNone(self.asgi_app.endpoint(get(f'/res/view/{self.res_id}')))
+        self.assertIsNone(self.asgi_app.endpoint(get('/res/res_form')))
+        self.assertIsNone(self.asgi_app.endpoint({'type': 'http', 'method': 'POST', 'path': '/availability'}))
+        self.assertIsNone(self.asgi_app.endpoint(get('/no/such/page')))
+
+
+    def test_same_answers_as_flask(self):
+        with self.client(CURR_USER_KEY, self.user_id) as client:
+            resp = client.get('/api/v1/reservations?fields=passenger_name')
+            self.assertEqual(resp.status_code, 200)
+
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+                expected = c.get('/api/v1/reservations?fields=passenger_name')
+            self.assertEqual(resp.json(), expected.json)
+            self.assertEqual(resp.headers['ETag'], expected.headers['ETag'])
+
+            resp = client.get(f'/res/view/{self.res_id}')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Customer: Test User', resp.text)
+
+            resp = client.get(f'/users/{self.user_id}')
+            self.assertIn('Passenger 2', resp.text)
+
+            resp = client.get('/availability?username=testuser&email=new@testing.org')
+            self.assertEqual(resp.json(), {"available": {"username": False, "email": True}})
+
+        with self.client(CURR_ADMIN_KEY, self.admin_id) as client:
+            resp = client.get('/admin/admin_home')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Passenger 0', resp.text)
+
+
+    def test_errors_and_the_rest(self):
+        "Errors come from Flask's handlers, other pages from the Flask app."
+
+        with self.client() as client:
+            self.assertEqual(client.get(f'/res/view/{self.res_id}').status_code, 401)
+            resp = client.get('/api/v1/reservations')
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json()["error"], "Unauthorized")
+
+            self.assertEqual(client.get('/about').status_code, 200)
+
+        with self.client(CURR_USER_KEY, self.user_id) as client:
+            self.assertEqual(client.get('/res/view/999999').status_code, 404)
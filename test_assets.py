@@ -0,0 +1,90 @@
+'''Testing for the fingerprinted static files'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_assets.py
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+import assets
+from app import create_app
+
+app = create_app('testing')
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+
+class AssetsTestCase(TestCase):
+
+    def setUp(self):
+        self.dist = tempfile.mkdtemp()
+        self.saved = assets.DIST_DIR, assets.MANIFEST_PATH
+        assets.DIST_DIR = self.dist
+        assets.MANIFEST_PATH = os.path.join(self.dist, 'manifest.json')
+        assets.load_manifest.cache_clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        assets.DIST_DIR, assets.MANIFEST_PATH = self.saved
+        assets.load_manifest.cache_clear()
+        shutil.rmtree(self.dist)
+
+
+    def test_without_build(self):
+        "Do the templates still work before the assets are built?"
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('style.css'), '/static/style.css')
+            self.assertEqual(str(assets.picture('images/home.jpg', alt='Home', class_='card-img')),
+                             '<img src="/static/images/home.jpg" alt="Home" class="card-img">')
+
+
+    def test_fingerprinted_and_compressed(self):
+        manifest = assets.build(log=lambda message: None)
+
+        hashed = manifest['files']['style.css']
+        self.assertRegex(hashed, r'^style\.[0-9a-f]{12}\.css$')
+        self.assertIn('gzip', manifest['encodings'][hashed])
+
+        resp = self.client.get('/')
+        self.assertIn(f'/static/dist/{hashed}', resp.get_data(as_text=True))
+
+        resp = self.client.get(f'/static/dist/{hashed}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        with open(os.path.join(assets.STATIC_DIR, 'style.css'), 'rb') as f:
+            self.assertEqual(gzip.decompress(resp.data), f.read())
+
+        resp = self.client.get(f'/static/dist/{hashed}', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertTrue(resp.content_type.startswith('text/css'))
+
+        self.assertEqual(self.client.get('/static/dist/manifest.json').status_code, 404)
+
+
+    def test_hash_follows_content(self):
+        self.assertNotEqual(assets.fingerprint('a.css', b'body{}'), assets.fingerprint('a.css', b'body{ }'))
+        self.assertEqual(assets.fingerprint('images/a.jpg', b'x'), assets.fingerprint('images/a.jpg', b'x'))
+
+
+    @skipUnless(PIL, 'Pillow is not installed')
+    def test_resized_images(self):
+        manifest = assets.build(log=lambda message: None)
+
+        image = manifest['images']['images/home.jpg']
+        widths = [width for width, _ in image['sources']['image/webp']]
+        self.assertEqual(widths[-1], image['width'])
+        self.assertEqual(widths, sorted(widths))
+
+        with app.test_request_context():
+            html = str(assets.picture('images/home.jpg', alt='Home'))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn(' 640w', html)
@@ -0,0 +1,169 @@
+'''Testing for the username / email / phone availability API'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_availability.py
+
+from unittest import TestCase
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db, User
+
+from app import create_app, config_class, availability_limiter
+from availability import AvailabilityChecker, BloomFilter, ClientRateLimiter, checker, RATE_BURST
+
+app = create_app('testing')
+
+db.create_all()
+
+
+@contextmanager
+def captured_queries():
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+class AvailabilityTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        User.register("Test-User1",
+                    "test-password",
+                    "testuser1@testing.com",
+                    "Test", "User1",
+                    "555-555-5555")
+        db.session.commit()
+
+        self.reset_checker()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        # nor leave a filter of these users to the next test module
+        self.reset_checker()
+        return res
+
+    def reset_checker(self):
+        # the module level checker outlives the tables dropped in setUp
+        checker.bloom = None
+        checker.taken.entries.clear()
+        availability_limiter.buckets.clear()
+
+
+    def test_check_many_fields(self):
+        "Are several fields checked in one request?"
+
+        resp = self.client.get('/availability?username=Test-User1&email=free@testing.com&phone=555-555-5555')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['available'],
+                         {'username': False, 'email': True, 'phone': False})
+
+
+    def test_old_endpoints(self):
+        self.assertEqual(self.client.get('/check/Test-User1').json, {'exists': False})
+        self.assertEqual(self.client.get('/check/nobody').json, {'exists': True})
+
+
+    def test_new_user_is_taken_right_away(self):
+        "Is a user registered after the filter was built reported as taken?"
+
+        self.assertTrue(checker.check({'username': 'newbie'})['username'])
+
+        User.register("newbie", "test-password", "newbie@testing.com", "New", "Bie", "555-000-0000")
+        db.session.commit()
+
+        self.assertFalse(checker.check({'username': 'newbie'})['username'])
+
+
+    def test_rolled_back_user_is_not_taken(self):
+        "Is a user whose registration rolled back still reported as free?"
+
+        self.assertTrue(checker.check({'username': 'newbie'})['username'])
+
+        User.register("newbie", "test-password", "newbie@testing.com", "New", "Bie", "555-000-0000")
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertTrue(checker.check({'username': 'newbie'})['username'])
+
+
+    def test_free_values_skip_the_database(self):
+        "Does a value the Bloom filter has never seen avoid a query?"
+
+        fresh = AvailabilityChecker()
+        fresh.rebuild()
+
+        with captured_queries() as statements:
+            self.assertEqual(fresh.check({'username': 'nobody-has-this'}), {'username': True})
+
+        self.assertEqual(statements, [])
+
+
+    def test_one_rebuild_at_a_time(self):
+        "While one request rebuilds the filter, do the others go on without it?"
+
+        fresh = AvailabilityChecker(rebuild_seconds=0)
+        fresh.rebuild()
+        old = fresh.bloom
+
+        with fresh.rebuilding:
+            # stale, but another request is rebuilding it: the old filter is used
+            self.assertEqual(fresh.check({'username': 'nobody-has-this'}), {'username': True})
+            self.assertIs(fresh.bloom, old)
+
+            # no filter yet: the database answers
+            fresh.bloom = None
+            self.assertEqual(fresh.check({'username': 'Test-User1', 'email': 'free@testing.com'}),
+                             {'username': False, 'email': True})
+            self.assertIsNone(fresh.bloom)
+
+        fresh.check({'username': 'nobody-has-this'})
+        self.assertIsNotNone(fresh.bloom)
+
+
+    def test_rate_limit(self):
+        "Is a client that checks too often told to slow down?"
+
+        limiter = ClientRateLimiter(rate=1, burst=2, clock=lambda: 0)
+        self.assertTrue(limiter.allow('1.2.3.4'))
+        self.assertTrue(limiter.allow('1.2.3.4'))
+        self.assertFalse(limiter.allow('1.2.3.4'))
+        self.assertTrue(limiter.allow('5.6.7.8'))
+
+
+    def test_rate_limit_behind_proxy(self):
+        "Does each client forwarded by the router get its own bucket?"
+
+        behind_router = type('BehindRouter', (config_class('testing'),), {'PROXY_FIX_X_FOR': 1})
+        client = create_app(behind_router).test_client()
+
+        def check(forwarded_for):
+            return client.get('/availability?username=nobody',
+                              environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                              headers={'X-Forwarded-For': forwarded_for}).status_code
+
+        statuses = [check('1.2.3.4') for _ in range(RATE_BURST + 1)]
+        self.assertEqual(statuses[-1], 429)
+        self.assertEqual(check('5.6.7.8'), 200)
+        self.assertEqual(set(availability_limiter.buckets), {'1.2.3.4', '5.6.7.8'})
+
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(100)
+        for n in range(100):
+            bloom.add(f'user{n}')
+
+        self.assertTrue(all(f'user{n}' in bloom for n in range(100)))
+        false_positives = sum(f'other{n}' in bloom for n in range(1000))
+        self.assertLess(false_positives, 50)
+
@@ -0,0 +1,158 @@
+'''Testing for the bulk reservation import'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_bulk_import.py
+
+import io
+from unittest import TestCase
+from datetime import date, time
+
+from models import db, FleetCapacity, Reservation, User
+
+from app import CURR_ADMIN_KEY, create_app
+from bulk_import import import_reservations, validate_chunk
+
+app = create_app('testing')
+
+db.create_all()
+
+HEADER = "passenger_name,passenger_phone,vehicle_type,PU_date,PU_time,PU_street,PU_city,PU_state,DO_street,DO_city,trip_notes\n"
+GOOD = 'Ride {n},415-555-0100,Sedan (up to 4 passengers),2022-07-15,09:30,{n} Market St,San Francisco,CA,SFO Airport,San Francisco,"Notes, with comma"\n'
+
+
+class BulkImportTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.user_id = user.id
+        self.admin_id = admin.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        app.config['WTF_CSRF_ENABLED'] = True
+        return res
+
+
+    def test_validate_chunk(self):
+        "Are ResForm's rules applied to every row?"
+
+        rows = [
+            dict(passenger_name="A", passenger_phone="1", vehicle_type="Sedan (up to 4 passengers)",
+                 PU_date="2022-07-15", PU_time="09:30", PU_street="1 Main St", PU_city="Oakland",
+                 DO_street="SFO", DO_city="San Francisco"),
+            dict(passenger_name="", passenger_phone="1", vehicle_type="Limo",
+                 PU_date="07/15/2022", PU_time="9:30am", PU_street="1 Main St", PU_city="Oakland",
+                 PU_state="Calif", DO_street="SFO", DO_city="San Francisco"),
+        ]
+
+        records, errors = validate_chunk(rows, first_line=2)
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["PU_date"], date(2022, 7, 15))
+        self.assertEqual(records[0]["PU_time"], time(9, 30))
+        self.assertEqual(records[0]["PU_address"], "1 Main St, Oakland")
+
+        self.assertEqual({error.line for error in errors}, {3})
+        self.assertEqual({error.field for error in errors},
+                         {"passenger_name", "vehicle_type", "PU_date", "PU_time", "PU_state"})
+
+
+    def test_import_in_chunks(self):
+        "Are the valid rows inserted for the user, chunk by chunk, and the bad ones reported?"
+
+        lines = [GOOD.format(n=n) for n in range(25)]
+        lines[7] = "No Phone,,Sedan (up to 4 passengers),2022-07-15,09:30,1 Main St,Oakland,CA,SFO,San Francisco,\n"
+        csv_file = io.StringIO(HEADER + "".join(lines))
+
+        result = import_reservations(csv_file, self.user_id, chunk_size=10)
+
+        self.assertEqual(result.rows, 25)
+        self.assertEqual(result.imported, 24)
+        self.assertEqual([(e.line, e.field) for e in result.errors], [(9, "passenger_phone")])
+
+        self.assertEqual(Reservation.query.filter_by(user_id=self.user_id).count(), 24)
+        res = Reservation.query.filter_by(passenger_name="Ride 3").one()
+        self.assertEqual(res.trip_notes, "Notes, with comma")
+        self.assertEqual(res.PU_address, "3 Market St, San Francisco, CA")
+        self.assertIsNotNone(res.created_date)
+
+
+    def test_full_fleet(self):
+        "Are rows with no vehicle free at their pickup time reported instead of overbooked?"
+
+        db.session.add(FleetCapacity(vehicle_type="Sedan (up to 4 passengers)", vehicles=2))
+        db.session.commit()
+
+        lines = [GOOD.format(n=n) for n in range(4)]
+        lines[1] = "No Phone,,Sedan (up to 4 passengers),2022-07-15,09:30,1 Main St,Oakland,CA,SFO,San Francisco,\n"
+        csv_file = io.StringIO(HEADER + "".join(lines))
+
+        result = import_reservations(csv_file, self.user_id, chunk_size=2)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([(e.line, e.field) for e in result.errors], [(3, "passenger_phone"), (5, "PU_time")])
+        self.assertEqual(Reservation.query.count(), 2)
+
+
+    def test_missing_columns(self):
+        result = import_reservations(io.StringIO("passenger_name\nA\n"), self.user_id)
+        self.assertEqual(result.imported, 0)
+        self.assertIn("PU_date", {error.field for error in result.errors})
+
+
+    def test_import_route(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+
+            resp = c.get(f'/admin/import/{self.user_id}')
+            self.assertEqual(resp.status_code, 200)
+
+            data = {"csv_file": (io.BytesIO((HEADER + GOOD.format(n=1)).encode()), "rides.csv")}
+            resp = c.post(f'/admin/import/{self.user_id}', data=data, content_type="multipart/form-data")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("1 of 1 reservations have been imported", resp.get_data(as_text=True))
+
+        self.assertEqual(Reservation.query.filter_by(user_id=self.user_id).count(), 1)
+
+
+    def test_import_not_utf8(self):
+        "Is a file that is not UTF-8 reported before anything is imported?"
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        lines = [GOOD.format(n=n) for n in range(5)]
+        lines[3] = lines[3].replace("Ride", "Café")
+        data = {"csv_file": (io.BytesIO((HEADER + "".join(lines)).encode('latin-1')), "rides.csv")}
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+
+            resp = c.post(f'/admin/import/{self.user_id}', data=data, content_type="multipart/form-data")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("not UTF-8", resp.get_data(as_text=True))
+            self.assertIn("<td>5</td>", resp.get_data(as_text=True))
+
+        self.assertEqual(Reservation.query.count(), 0)
@@ -0,0 +1,102 @@
+'''Testing for the connection pool settings'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_db_pool.py
+
+import sqlite3
+import threading
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+
+import db_pool
+from config import ProductionConfig
+
+
+def settings(**overrides):
+    config = {name: getattr(ProductionConfig, name) for name in dir(ProductionConfig) if name.isupper()}
+    config.update(SQLALCHEMY_DATABASE_URI='postgresql://app@db.example.com/book_a_ride',
+                  WEB_CONCURRENCY=4, GUNICORN_THREADS=2, DB_MAX_CONNECTIONS=20,
+                  DB_POOL_SIZE=None, DB_MAX_OVERFLOW=None,
+                  DB_STATEMENT_TIMEOUT_MS=30000, DB_PGBOUNCER=False)
+    config.update(overrides)
+    return config
+
+
+class DbPoolTestCase(TestCase):
+
+    def test_sizing(self):
+        "Is the pool sized from the gunicorn workers, request threads and mailer threads?"
+
+        self.assertEqual(db_pool.pool_sizing(settings()), (4, 1))
+        self.assertEqual(db_pool.pool_sizing(settings(WEB_CONCURRENCY=1)), (4, 16))
+        self.assertEqual(db_pool.pool_sizing(settings(WEB_CONCURRENCY=10)), (4, 0))
+        self.assertEqual(db_pool.pool_sizing(settings(SMTP_POOL_SIZE=5)), (7, 0))
+        self.assertEqual(db_pool.pool_sizing(settings(DB_POOL_SIZE='8', DB_MAX_OVERFLOW='0')), (8, 0))
+
+
+    def test_sizing_asgi(self):
+        "Do the sync and async engines of an asgi.py worker share its connections?"
+
+        config = settings(SERVE_ASGI=True, WEB_CONCURRENCY=1, DB_ASYNC_POOL_SIZE=10)
+        sync_size, sync_overflow = db_pool.pool_sizing(config)
+        async_size, async_overflow = db_pool.pool_sizing(config, is_async=True)
+
+        self.assertEqual((sync_size, async_size), (4, 10))
+        self.assertEqual(sync_size + sync_overflow + async_size + async_overflow, 20)
+        self.assertEqual(db_pool.pool_sizing(settings(SERVE_ASGI=True)), (4, 0))
+
+
+    def test_engine_options(self):
+        options = db_pool.engine_options(settings())
+        self.assertIs(options['poolclass'], db_pool.MeteredQueuePool)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_recycle'], ProductionConfig.DB_POOL_RECYCLE)
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=30000'})
+
+        self.assertEqual(db_pool.engine_options(settings(SQLALCHEMY_DATABASE_URI='sqlite://')),
+                         {'pool_pre_ping': True})
+
+
+    def test_pgbouncer(self):
+        "No startup options and no prepared statements behind PgBouncer."
+
+        options = db_pool.engine_options(settings(DB_PGBOUNCER=True))
+        self.assertEqual(options['connect_args'], {})
+
+        options = db_pool.engine_options(settings(
+            DB_PGBOUNCER=True, SQLALCHEMY_DATABASE_URI='postgresql+asyncpg://app@db.example.com/book_a_ride'))
+        self.assertEqual(options['connect_args'], {'statement_cache_size': 0,
+                                                   'prepared_statement_cache_size': 0})
+
+
+    def test_status(self):
+        "Are connections in use and checkout waits counted?"
+
+        engine = create_engine('sqlite://', creator=lambda: sqlite3.connect(':memory:', check_same_thread=False),
+                               poolclass=db_pool.MeteredQueuePool, pool_size=1, max_overflow=0,
+                               pool_timeout=0.2)
+
+        conn = engine.connect()
+        status = db_pool.pool_status(engine)
+        self.assertEqual((status['in_use'], status['checkouts'], status['timeouts']), (1, 1, 0))
+
+        # a second checkout has to wait for the first one, then gives up
+        failed = []
+        def checkout():
+            try:
+                engine.connect().close()
+            except exc.TimeoutError:
+                failed.append(True)
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+        conn.close()
+
+        status = db_pool.pool_status(engine)
+        self.assertEqual(failed, [True])
+        self.assertEqual((status['in_use'], status['idle'], status['timeouts']), (0, 1, 1))
+        self.assertGreaterEqual(status['wait_ms_max'], 200)
+
+        engine.dispose()
+        engine.connect().close()
+        self.assertEqual(db_pool.pool_status(engine)['checkouts'], 2)
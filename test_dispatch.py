@@ -0,0 +1,160 @@
+'''Testing for the driver assignment'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_dispatch.py
+
+from itertools import permutations
+from unittest import TestCase
+from datetime import date, time
+
+import numpy as np
+
+from models import db, Address, Driver, Reservation, User, Vehicle
+
+from app import CURR_ADMIN_KEY, create_app
+from dispatch import assign_drivers, hungarian, plan_day
+from bench_dispatch import random_day
+
+app = create_app('testing')
+
+db.create_all()
+
+SEDAN = "Sedan (up to 4 passengers)"
+SPRINTER = "Sprinter Van (up to 14 passengers)"
+
+UNION_SQUARE = (37.7880, -122.4075)
+SFO = (37.6152, -122.3899)
+
+
+class HungarianTestCase(TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for rows, cols in ((4, 4), (3, 5), (5, 3), (1, 4), (6, 6)):
+            for _ in range(20):
+                cost = rng.integers(0, 50, (rows, cols)).astype(float)
+                r, c = hungarian(cost)
+
+                self.assertEqual(len(r), min(rows, cols))
+                self.assertEqual(len(set(r.tolist())), len(r))
+                self.assertEqual(len(set(c.tolist())), len(c))
+
+                if rows <= cols:
+                    best = min(cost[range(rows), list(p)].sum() for p in permutations(range(cols), rows))
+                else:
+                    best = min(cost[list(p), range(cols)].sum() for p in permutations(range(rows), cols))
+                self.assertEqual(cost[r, c].sum(), best)
+
+
+    def test_day_plan_is_feasible(self):
+        "Does no driver get a ride they cannot reach, or two rides at once?"
+
+        drivers, rides = random_day(300, 60)
+        shift_start = drivers['free_at'].copy()
+        shift_end = drivers['shift_end'].copy()
+        vehicle = drivers['vehicle_class'].copy()
+
+        plan = plan_day(drivers, rides)
+        self.assertGreater(len(plan), 150)
+
+        by_driver = {}
+        for ride, driver in plan.items():
+            self.assertGreaterEqual(vehicle[driver], rides['vehicle_class'][ride])
+            self.assertGreaterEqual(rides['start'][ride], shift_start[driver])
+            self.assertLessEqual(rides['end'][ride], shift_end[driver])
+            by_driver.setdefault(driver, []).append(ride)
+
+        for trips in by_driver.values():
+            trips.sort()
+            for earlier, later in zip(trips, trips[1:]):
+                self.assertLess(rides['end'][earlier], rides['start'][later])
+
+
+class AssignTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7890",
+                                   is_admin=True)
+        db.session.commit()
+        self.admin_id = admin.id
+
+        db.session.add_all([
+            Vehicle(id=1, plate="SEDAN1", vehicle_type=SEDAN),
+            Vehicle(id=2, plate="VAN1", vehicle_type=SPRINTER),
+            # near SFO, but only a sedan
+            Driver(id=1, name="Sam Sedan", vehicle_id=1, base_latitude=SFO[0], base_longitude=SFO[1]),
+            # downtown, with the van
+            Driver(id=2, name="Val Van", vehicle_id=2,
+                   base_latitude=UNION_SQUARE[0], base_longitude=UNION_SQUARE[1]),
+            Driver(id=3, name="Off Duty", vehicle_id=1, active=False,
+                   base_latitude=UNION_SQUARE[0], base_longitude=UNION_SQUARE[1]),
+        ])
+
+        for n, (vehicle_type, pickup) in enumerate([(SEDAN, time(9, 0)), (SPRINTER, time(9, 0)),
+                                                    (SEDAN, time(9, 5)), (SEDAN, time(23, 30))]):
+            db.session.add(Reservation(passenger_name=f"Passenger {n}",
+                                       passenger_phone="987-654-3210",
+                                       vehicle_type=vehicle_type,
+                                       PU_date=date(2022, 7, 15),
+                                       PU_time=pickup,
+                                       PU_address="SFO",
+                                       PU_street="San Francisco International Airport",
+                                       PU_city="San Francisco",
+                                       DO_address="Union Square",
+                                       DO_street="333 Post St",
+                                       DO_city="San Francisco",
+                                       user_id=self.admin_id))
+        db.session.commit()
+
+        for address in Address.query:
+            address.latitude, address.longitude = SFO if "Airport" in address.street else UNION_SQUARE
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        app.config['WTF_CSRF_ENABLED'] = True
+        return res
+
+
+    def test_assign_drivers(self):
+        result = assign_drivers(date(2022, 7, 15))
+
+        rides = Reservation.query.order_by(Reservation.id).all()
+        # the van ride needs the van and the sedan at SFO takes the first
+        # sedan ride; the next sedan ride and the one after every shift are left over
+        self.assertEqual(result.assigned, 2)
+        self.assertEqual(rides[0].driver_id, 1)
+        self.assertEqual(rides[1].driver_id, 2)
+        self.assertEqual(sorted(result.unassigned), sorted(res.id for res in rides if res.driver_id is None))
+        self.assertIsNone(rides[3].driver_id)
+        self.assertNotIn(3, [res.driver_id for res in rides])
+
+
+    def test_assign_route(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        with self.client as c:
+            resp = c.post('/admin/assign', data={'day': '2022-07-15'})
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+
+            resp = c.post('/admin/assign', data={'day': '2022-07-15'}, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('2 of 4 rides have been assigned a driver.', html)
+            self.assertIn('Val Van', html)
@@ -0,0 +1,159 @@
+'''Testing for the confirmation e-mail template'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_email_template.py
+
+import os
+import tempfile
+from unittest import TestCase
+from datetime import date, time
+from types import SimpleNamespace
+
+from models import db, Reservation, User
+
+from app import CURR_ADMIN_KEY, create_app
+from email_template import CompiledTemplate, EmailTemplate, EMAIL_TEMPLATE_PATH, render_confirmation, render_confirmations
+
+app = create_app('testing')
+
+db.create_all()
+
+
+def make_res(**kwargs):
+    user = SimpleNamespace(first_name="Test", last_name="User", phone="123-456-7890")
+    fields = dict(id=10001, user=user, PU_date=date(2022, 7, 15), PU_time=time(9, 30),
+                  passenger_name="Test User", passenger_phone="987-654-3210",
+                  vehicle_type="Sedan (up to 4 passengers)",
+                  PU_address="123 Main Street, San Francisco, CA, 94104",
+                  DO_address="101 California Street, San Francisco, CA 94104",
+                  trip_notes="Meet at door 3")
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+class EmailTemplateTestCase(TestCase):
+
+    def test_same_output_as_str_replace(self):
+        "Does the compiled template render exactly what the old str.replace chain did?"
+
+        res = make_res()
+        user = res.user
+
+        with open(EMAIL_TEMPLATE_PATH) as f:
+            expected = ' '.join(f.readlines())
+        for field, value in [('{first_name}', user.first_name), ('{last_name}', user.last_name),
+                             ('{phone}', user.phone), ('{conf}', str(res.id)),
+                             ('{PU_date}', res.PU_date.strftime('%A, %B %d, %Y')),
+                             ('{PU_time}', res.PU_time.strftime('%I:%M %p')),
+                             ('{passenger_name}', res.passenger_name),
+                             ('{passenger_phone}', res.passenger_phone),
+                             ('{vehicle_type}', res.vehicle_type),
+                             ('{PU_address}', res.PU_address), ('{DO_address}', res.DO_address),
+                             ('{trip_notes}', res.trip_notes)]:
+            expected = expected.replace(field, value)
+
+        self.assertEqual(render_confirmation(user, res), expected)
+
+
+    def test_escapes_values(self):
+        "Are customer-entered values HTML escaped?"
+
+        html = CompiledTemplate('<p>{trip_notes}</p>').render({'trip_notes': '<b>hi</b> & bye'})
+        self.assertEqual(html, '<p>&lt;b&gt;hi&lt;/b&gt; &amp; bye</p>')
+
+
+    def test_missing_notes(self):
+        "Does a reservation without trip notes still render?"
+
+        html = render_confirmation(make_res().user, make_res(trip_notes=None))
+        self.assertNotIn('{trip_notes}', html)
+        self.assertNotIn('None', html)
+
+
+    def test_reloads_on_change(self):
+        "Is the cached template re-read when the file changes?"
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('Hello {first_name}')
+        try:
+            template = EmailTemplate(f.name)
+            first = template.get()
+            self.assertIs(template.get(), first)
+
+            with open(f.name, 'w') as f2:
+                f2.write('Bye {first_name}')
+            os.utime(f.name, ns=(0, template.mtime + 1))
+
+            self.assertEqual(template.get().render({'first_name': 'Test'}), 'Bye Test')
+        finally:
+            os.unlink(f.name)
+
+
+    def test_batch_render(self):
+        "Does the batch API render one confirmation per reservation?"
+
+        reservations = [make_res(id=n) for n in range(10001, 10011)]
+        rendered = render_confirmations(reservations)
+
+        self.assertEqual([res.id for res, _ in rendered], [r.id for r in reservations])
+        self.assertIn('10005', rendered[4][1])
+
+
+
+class FakeMailer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg, reservation_id=None):
+        self.sent.append(msg)
+
+
+class EmailResViewTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.mailer = app.extensions['mailer'] = FakeMailer()
+
+        admin = User.registerAdmin(username="testadmin", password="anypassword", email="admin@testing.org",
+                                   first_name="Dispatch", last_name="Admin", phone="123-456-0000", is_admin=True)
+        customer = User.register(username="customer", password="anypassword", email="customer@testing.org",
+                                 first_name="Carla", last_name="Customer", phone="123-456-0001")
+        db.session.commit()
+        res = Reservation(passenger_name="Carla Customer", passenger_phone="4155550100",
+                          vehicle_type="Sedan (up to 4 passengers)", PU_date=date(2022, 7, 15),
+                          PU_time=time(9, 30), PU_address="Home", DO_address="Airport", user_id=customer.id)
+        db.session.add(res)
+        db.session.commit()
+        self.admin_id = admin.id
+        self.res_id = res.id
+
+    def tearDown(self):
+        app.extensions.pop('mailer', None)
+        app.config['WTF_CSRF_ENABLED'] = True
+        db.session.rollback()
+        db.session.remove()
+
+
+    def test_admin_sends_customers_confirmation(self):
+        "Does a confirmation sent by an admin carry the customer's name, not the admin's?"
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+            resp = client.post(f'/res/email_res_form/{self.res_id}', data=dict(email_res="carla@testing.org"))
+
+        self.assertEqual(resp.status_code, 302)
+        html = self.mailer.sent[0].get_body(('html',)).get_content()
+        self.assertIn('Carla', html)
+        self.assertNotIn('Dispatch', html)
+
+
+    def test_invalid_form_sends_nothing(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+            resp = client.post(f'/res/email_res_form/{self.res_id}', data=dict(email_res=""))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.mailer.sent, [])
@@ -0,0 +1,123 @@
+'''Testing for the reservation export'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_export.py
+
+import csv
+import io
+import json
+from unittest import TestCase
+from datetime import date, time
+
+from models import db, Reservation, User
+
+from app import CURR_ADMIN_KEY, CURR_USER_KEY, create_app
+import export
+
+app = create_app('testing')
+
+db.create_all()
+
+SEDAN = "Sedan (up to 4 passengers)"
+SUV = "SUV (up to 7 passengers)"
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.user_id = user.id
+        self.admin_id = admin.id
+
+        for n in range(25):
+            db.session.add(Reservation(passenger_name=f"Passenger, {n}",
+                                       passenger_phone="987-654-3210",
+                                       vehicle_type=SUV if n % 5 == 0 else SEDAN,
+                                       PU_date=date(2022, 7, 1 + n),
+                                       PU_time=time(9, 0),
+                                       PU_address="123 Market St",
+                                       DO_address="SFO Airport",
+                                       trip_notes="Line one\nline two",
+                                       user_id=self.admin_id if n == 24 else self.user_id))
+        db.session.commit()
+
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+    def export(self, **args):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+            return c.get('/admin/export', query_string=args)
+
+
+    def test_admin_only(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            resp = c.get('/admin/export')
+            self.assertEqual(resp.status_code, 401)
+
+
+    def test_csv(self):
+        "Does the CSV have a header and every reservation, quoted where needed?"
+
+        resp = self.export()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, "text/csv")
+        self.assertIn("attachment", resp.headers["Content-Disposition"])
+
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[0]["passenger_name"], "Passenger, 0")
+        self.assertEqual(rows[0]["trip_notes"], "Line one\nline two")
+        self.assertEqual(rows[0]["customer_username"], "testuser")
+        self.assertEqual(rows[0]["PU_date"], "2022-07-01")
+
+
+    def test_filters(self):
+        resp = self.export(start="2022-07-05", end="2022-07-20", vehicle_type=SUV, format="ndjson")
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+
+        rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([row["PU_date"] for row in rows], ["2022-07-06", "2022-07-11", "2022-07-16"])
+
+        resp = self.export(user_id=self.admin_id, format="ndjson")
+        rows = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(json.loads(rows[0])["customer_username"], "testadmin")
+
+
+    def test_streamed_in_batches(self):
+        "Is the export written a batch at a time rather than all at once?"
+
+        chunks = list(export.iter_csv(export.export_rows(), batch_size=10))
+        # header + first 10 rows, then 10, then 5
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(list(csv.reader(io.StringIO(chunks[2])))), 5)
+
+        chunks = list(export.iter_ndjson(export.export_rows(), batch_size=10))
+        self.assertEqual([chunk.count("\n") for chunk in chunks], [10, 10, 5])
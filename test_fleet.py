@@ -0,0 +1,184 @@
+'''Testing for the fleet capacity check'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_fleet.py
+
+from unittest import TestCase
+from datetime import date, time, timedelta
+
+from models import db, FleetCapacity, Reservation, User
+
+from app import CURR_USER_KEY, create_app
+from fleet import FleetSchedule, fleet_schedule, overlap_windows, reserve
+
+app = create_app('testing')
+
+db.create_all()
+
+SEDAN = 'Sedan (up to 4 passengers)'
+DAY = date(2022, 7, 15)
+
+
+class FleetScheduleTestCase(TestCase):
+
+    def setUp(self):
+        # (vehicle_type, day) -> pickup minutes
+        self.booked = {}
+        self.loads = []
+        self.schedule = FleetSchedule(load_day=self.load_day,
+                                      load_capacity=lambda vehicle_type: (2, 60) if vehicle_type == SEDAN else None)
+
+    def load_day(self, vehicle_type, day):
+        self.loads.append((vehicle_type, day))
+        return sorted(self.booked.get((vehicle_type, day), []))
+
+    def book(self, day, pickup):
+        self.assertTrue(self.schedule.has_capacity(SEDAN, day, pickup))
+        self.schedule.add(SEDAN, day, pickup)
+
+
+    def test_fills_up(self):
+        "Is a third overlapping sedan trip refused when there are two sedans?"
+
+        self.book(DAY, time(9, 0))
+        self.book(DAY, time(9, 30))
+
+        self.assertFalse(self.schedule.has_capacity(SEDAN, DAY, time(9, 45)))
+        self.assertFalse(self.schedule.has_capacity(SEDAN, DAY, time(8, 45)))
+        # the 9:00 trip is back by 10:00
+        self.assertTrue(self.schedule.has_capacity(SEDAN, DAY, time(10, 0)))
+        self.assertTrue(self.schedule.has_capacity(SEDAN, DAY, time(7, 59)))
+
+
+    def test_trips_that_do_not_overlap_each_other(self):
+        "Are two trips that never run at the same time counted as one vehicle?"
+
+        self.book(DAY, time(9, 0))
+        self.book(DAY, time(10, 30))
+
+        # 9:45-10:45 overlaps both, but only one of them at any moment
+        self.assertTrue(self.schedule.has_capacity(SEDAN, DAY, time(9, 45)))
+
+
+    def test_unlimited_types(self):
+        for _ in range(10):
+            self.assertTrue(self.schedule.has_capacity('SUV (up to 7 passengers)', DAY, time(9, 0)))
+
+
+    def test_trips_across_midnight(self):
+        "Does a late trip the day before still hold a vehicle after midnight?"
+
+        self.booked[(SEDAN, DAY)] = [23 * 60 + 30, 23 * 60 + 40]
+
+        self.assertFalse(self.schedule.has_capacity(SEDAN, DAY + timedelta(days=1), time(0, 15)))
+        self.assertTrue(self.schedule.has_capacity(SEDAN, DAY + timedelta(days=1), time(0, 45)))
+
+
+    def test_days_are_loaded_once(self):
+        "Is a day loaded from the database once and then checked in memory?"
+
+        for minute in range(0, 60, 5):
+            self.schedule.has_capacity(SEDAN, DAY, time(12, minute))
+
+        self.assertEqual(self.loads.count((SEDAN, DAY)), 1)
+
+
+
+class ReserveTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        db.session.add(FleetCapacity(vehicle_type=SEDAN, vehicles=1))
+        db.session.commit()
+        self.user_id = user.id
+        fleet_schedule.forget()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        fleet_schedule.forget()
+        app.config['WTF_CSRF_ENABLED'] = True
+        return res
+
+    def add(self, day, pickup):
+        res = Reservation(passenger_name="Rider", passenger_phone="4155550100", vehicle_type=SEDAN,
+                          PU_date=day, PU_time=pickup, PU_address="1 Main St", DO_address="SFO",
+                          user_id=self.user_id)
+        db.session.add(res)
+        db.session.commit()
+        return res
+
+
+    def test_reserve(self):
+        "Are trips checked against the database and against each other?"
+
+        booked = self.add(DAY, time(9, 0))
+
+        self.assertEqual(reserve([(SEDAN, DAY, time(9, 30)),
+                                  (SEDAN, DAY, time(11, 0)),
+                                  (SEDAN, DAY, time(11, 30)),
+                                  ('SUV (up to 7 passengers)', DAY, time(9, 0))]),
+                         [False, True, False, True])
+        # a trip being moved no longer holds its old slot
+        self.assertEqual(reserve([(SEDAN, DAY, time(9, 30))], exclude_ids=[booked.id]), [True])
+
+
+    def test_reserve_across_midnight(self):
+        "Is a late trip the day before read from the database too?"
+
+        self.add(DAY, time(23, 30))
+        self.add(DAY + timedelta(days=1), time(12, 0))
+
+        self.assertEqual(reserve([(SEDAN, DAY + timedelta(days=1), time(0, 15)),
+                                  (SEDAN, DAY + timedelta(days=1), time(0, 45))]),
+                         [False, True])
+
+
+    def test_overlap_windows(self):
+        "Are only the pickups that can overlap the trips read, split at midnight?"
+
+        windows = overlap_windows([(SEDAN, DAY, time(0, 30)),
+                                   (SEDAN, DAY, time(1, 0)),
+                                   (SEDAN, DAY, time(12, 0)),
+                                   ('SUV (up to 7 passengers)', DAY, time(9, 0))],
+                                  {SEDAN: (1, 60)})
+
+        self.assertEqual(windows, {(SEDAN, DAY - timedelta(days=1)): [(23 * 60 + 31, 24 * 60)],
+                                   (SEDAN, DAY): [(0, 120), (11 * 60 + 1, 13 * 60)]})
+
+
+    def test_edit_into_full_slot(self):
+        "Is moving a trip to a time with no vehicle free refused?"
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.add(DAY, time(9, 0))
+        res_id = self.add(DAY, time(12, 0)).id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            data = dict(passenger_name="Rider", passenger_phone="4155550100", vehicle_type=SEDAN,
+                        PU_date=DAY.isoformat(), PU_time="09:30", PU_address="1 Main St", PU_street="1 Main St",
+                        PU_city="Oakland", PU_state="CA", DO_address="SFO", DO_street="SFO", DO_city="San Francisco")
+            resp = c.post(f'/res/edit_res/{res_id}', data=data)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('booked at that time', resp.get_data(as_text=True))
+            self.assertEqual(Reservation.query.get(res_id).PU_time, time(12, 0))
+
+            # other changes to the trip are still saved
+            data.update(PU_time="12:00", passenger_name="Other Rider")
+            resp = c.post(f'/res/edit_res/{res_id}', data=data)
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Reservation.query.get(res_id).passenger_name, "Other Rider")
@@ -0,0 +1,105 @@
+'''Testing for the pooled background mailer'''
+
+#to run these tests us: pip install -r requirements-dev.txt; python -m unittest test_mailer.py
+
+import socket
+from unittest import TestCase
+from email.message import EmailMessage
+
+from aiosmtpd.controller import Controller
+
+from mailer import SMTPPool, Mailer
+
+
+class Inbox:
+    '''aiosmtpd handler that keeps every message it receives.'''
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_msg(n):
+    msg = EmailMessage()
+    msg['Subject'] = f'Booking confirmation {n}'
+    msg['From'] = 'dispatch@bookaride.test'
+    msg['To'] = 'rider@bookaride.test'
+    msg.set_content('This is a plain text email')
+    return msg
+
+
+class MailerTestCase(TestCase):
+
+    def setUp(self):
+        self.inbox = Inbox()
+        port = free_port()
+        self.controller = Controller(self.inbox, hostname='127.0.0.1', port=port)
+        self.controller.start()
+        self.pool = SMTPPool('127.0.0.1', port, use_ssl=False, size=2)
+        self.statuses = []
+        self.mailer = Mailer(self.pool, on_status=lambda *args: self.statuses.append(args))
+
+    def tearDown(self):
+        self.mailer.stop()
+        self.controller.stop()
+
+
+    def test_sends_in_background(self):
+        "Are queued messages delivered and reported back?"
+
+        for n in range(10):
+            self.mailer.send(make_msg(n), reservation_id=n)
+        self.mailer.join()
+
+        self.assertEqual(len(self.inbox.messages), 10)
+        self.assertEqual(sorted(s[0] for s in self.statuses), list(range(10)))
+        self.assertTrue(all(s[1] == Mailer.SENT for s in self.statuses))
+
+
+    def test_reuses_connections(self):
+        "Do many messages share the pool instead of opening a connection each?"
+
+        for n in range(20):
+            self.mailer.send(make_msg(n))
+        self.mailer.join()
+
+        self.assertEqual(len(self.inbox.messages), 20)
+        self.assertLessEqual(self.inbox.connections, self.pool.size)
+
+
+    def test_reconnects_after_drop(self):
+        "Is a connection closed by the server replaced on the next send?"
+
+        self.mailer.deliver(make_msg(1))
+        conn, _ = self.pool.idle.queue[0]
+        conn.close()
+
+        self.mailer.deliver(make_msg(2))
+        self.assertEqual(len(self.inbox.messages), 2)
+
+
+    def test_reports_failure(self):
+        "Is a message the server cannot take reported as failed?"
+
+        pool = SMTPPool('127.0.0.1', free_port(), use_ssl=False, size=1, timeout=1)
+        mailer = Mailer(pool, on_status=lambda *args: self.statuses.append(args))
+        mailer.send(make_msg(1), reservation_id=1)
+        mailer.join()
+        mailer.stop()
+
+        self.assertEqual(self.statuses[0][:2], (1, Mailer.FAILED))
@@ -0,0 +1,122 @@
+'''Testing for the /metrics instrumentation'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_metrics.py
+
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from prometheus_client import REGISTRY
+from sqlalchemy import exc
+
+from models import db, User
+
+import metrics
+from app import CURR_ADMIN_KEY, create_app
+
+app = create_app('testing')
+
+db.create_all()
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.admin_id = admin.id
+
+        self.client = app.test_client()
+
+
+    def test_request_and_queries(self):
+        "Is every request timed with its endpoint and status, and its SQL counted?"
+
+        before = sample('http_request_duration_seconds_count', endpoint='check_user', method='GET', status='200')
+        queries = sample('db_queries_total', endpoint='check_user')
+
+        self.assertEqual(self.client.get('/check/testadmin').status_code, 200)
+        self.assertEqual(sample('http_request_duration_seconds_count',
+                                endpoint='check_user', method='GET', status='200'), before + 1)
+        self.assertGreater(sample('db_queries_total', endpoint='check_user'), queries)
+
+        before = sample('http_request_duration_seconds_count', endpoint='none', method='GET', status='404')
+        self.client.get('/no/such/page')
+        self.assertEqual(sample('http_request_duration_seconds_count',
+                                endpoint='none', method='GET', status='404'), before + 1)
+
+
+    def test_failed_queries(self):
+        "Is a statement that fails still timed and taken off the connection's stack?"
+
+        before = sample('db_queries_total', endpoint='none')
+        with app.app_context():
+            with db.engine.connect() as conn:
+                for _ in range(3):
+                    with self.assertRaises(exc.OperationalError):
+                        conn.exec_driver_sql('SELECT * FROM no_such_table')
+                self.assertEqual(conn.info['query_start'], [])
+        self.assertEqual(sample('db_queries_total', endpoint='none'), before + 3)
+
+
+    def test_external_calls(self):
+        before = sample('external_call_duration_seconds_count', service='smtp', operation='send', outcome='error')
+        with self.assertRaises(OSError):
+            with metrics.timed('smtp', 'send'):
+                raise OSError('connection refused')
+        self.assertEqual(sample('external_call_duration_seconds_count',
+                                service='smtp', operation='send', outcome='error'), before + 1)
+
+
+    def test_publish(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_ADMIN_KEY] = self.admin_id
+            resp = c.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('http_request_duration_seconds_bucket{', resp.get_data(as_text=True))
+        self.assertIn('db_queries_per_request_bucket{', resp.get_data(as_text=True))
+
+        metrics.METRICS_TOKEN, saved = 'secret-token', metrics.METRICS_TOKEN
+        try:
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            resp = self.client.get('/metrics', headers={'Authorization': 'Bearer secret-token'})
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            metrics.METRICS_TOKEN = saved
+
+
+    def test_workers_added_up(self):
+        "With PROMETHEUS_MULTIPROC_DIR, /metrics sums what every process recorded."
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            run = lambda code: subprocess.run([sys.executable, '-c', 'import metrics\n' + code],
+                                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                              stdout=subprocess.PIPE, text=True, check=True).stdout
+
+            for _ in range(2):
+                run("metrics.EXTERNAL_SECONDS.labels('twilio', 'send', 'ok').observe(0.2)")
+            text = run("from prometheus_client import generate_latest\n"
+                       "print(generate_latest(metrics.registry()).decode())")
+
+        self.assertIn('external_call_duration_seconds_count{operation="send",outcome="ok",service="twilio"} 2.0',
+                      text)
@@ -0,0 +1,258 @@
+'''Testing for the query budgets of every route
+
+Seeds customers with upcoming and past trips, drivers and a repeating
+booking, then calls every route. TestingConfig makes the budgets strict,
+so a route running more statements than its @query_budget, or the same
+SELECT in a loop, fails here.'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_query_budget.py
+
+import io
+import logging
+from unittest import TestCase
+from datetime import date, time, timedelta
+
+from flask import request_finished
+
+from models import db, Driver, FleetCapacity, Reservation, User, Vehicle
+
+from app import CURR_ADMIN_KEY, CURR_USER_KEY, create_app
+from availability import checker
+from fleet import fleet_schedule
+from query_budget import QueryBudgetExceeded, query_budget
+from recurrence import start_series, materialize
+
+app = create_app('testing')
+
+db.create_all()
+
+CUSTOMERS = 5
+TRIPS_PER_CUSTOMER = 12
+SEDAN = "Sedan (up to 4 passengers)"
+
+TRIP = dict(passenger_name="Commuter",
+            passenger_phone="4155550100",
+            passenger_email=None,
+            vehicle_type=SEDAN,
+            PU_date=date.today() + timedelta(days=1),
+            PU_time=time(8, 0),
+            PU_address="Home",
+            PU_street="1 Main St",
+            PU_city="San Francisco",
+            PU_state="CA",
+            PU_zip="94105",
+            PU_country="US",
+            DO_address="Work",
+            DO_street="333 Post St",
+            DO_city="San Francisco",
+            DO_state="CA",
+            DO_zip="94108",
+            DO_country="US",
+            trip_notes=None)
+
+FORM = dict(passenger_name="New Passenger", passenger_phone="4155550199",
+            passenger_email="new@testing.org", vehicle_type=SEDAN,
+            PU_date=(date.today() + timedelta(days=3)).isoformat(), PU_time="10:30",
+            PU_address="Office", PU_street="1 Market St", PU_city="San Francisco", PU_state="CA",
+            DO_address="Airport", DO_street="SFO", DO_city="San Francisco", DO_state="CA")
+
+CSV = ("passenger_name,passenger_phone,vehicle_type,PU_date,PU_time,PU_street,PU_city,PU_state,DO_street,DO_city\n"
+       + "".join(f"Ride {n},415-555-0100,{SEDAN},{date.today() + timedelta(days=5)},09:{n:02d},"
+                 f"{n} Market St,San Francisco,CA,SFO Airport,San Francisco\n" for n in range(10)))
+
+
+class FakeMailer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg, reservation_id=None):
+        self.sent.append(reservation_id)
+
+
+class QueryBudgetTestCase(TestCase):
+
+    def test_counts_and_raises(self):
+        with app.app_context():
+            with query_budget(2) as log:
+                User.query.count()
+                User.query.count()
+            self.assertEqual(log.count, 2)
+
+            with self.assertRaises(QueryBudgetExceeded):
+                with query_budget(1):
+                    User.query.count()
+                    User.query.count()
+
+
+    def test_repeated_select(self):
+        "The same SELECT over and over is a lazy load in a loop, even within the budget."
+
+        with app.app_context():
+            with self.assertRaisesRegex(QueryBudgetExceeded, 'the same SELECT 4 times'):
+                with query_budget(10, max_repeats=3):
+                    for user_id in range(4):
+                        db.session.query(User).filter(User.id == user_id).first()
+
+
+    def test_logs_when_not_strict(self):
+        with app.app_context():
+            with self.assertLogs('query_budget', logging.WARNING) as logs:
+                with query_budget(0, strict=False):
+                    User.query.count()
+        self.assertIn('1 queries, the budget is 0', logs.output[0])
+
+
+    def test_every_route_has_a_budget(self):
+        missing = [endpoint for endpoint, view in app.view_functions.items()
+                   if endpoint != 'static' and not hasattr(view, 'query_budget')]
+        self.assertEqual(missing, [])
+
+
+class RouteBudgetTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.extensions['mailer'] = FakeMailer()
+
+        self.client = app.test_client()
+
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-0000",
+                                   is_admin=True)
+        customers = [User.register(username=f"customer{n}",
+                                   password="anypassword",
+                                   email=f"customer{n}@testing.org",
+                                   first_name="Test",
+                                   last_name=f"Customer{n}",
+                                   phone=f"123-456-{n + 1:04d}")
+                     for n in range(CUSTOMERS)]
+        db.session.add_all([Vehicle(id=1, plate="SEDAN1", vehicle_type=SEDAN),
+                            Driver(id=1, name="Sam Sedan", vehicle_id=1),
+                            Driver(id=2, name="Sue Sedan", vehicle_id=1),
+                            FleetCapacity(vehicle_type=SEDAN, vehicles=10, avg_trip_minutes=60)])
+        db.session.commit()
+        self.admin_id = admin.id
+        self.user_id = customers[0].id
+
+        # upcoming and past trips for every customer, some with a driver
+        for user in customers:
+            for k in range(TRIPS_PER_CUSTOMER):
+                db.session.add(Reservation(**dict(TRIP, PU_date=date.today() + timedelta(days=k - 4),
+                                                  PU_time=time(6 + k, 0), user_id=user.id,
+                                                  driver_id=(k % 3) or None)))
+        series, _ = start_series(self.user_id, TRIP, "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR")
+        db.session.commit()
+        materialize(series_ids=[series.id])
+
+        self.series_id = series.id
+        self.res_id = Reservation.query.filter_by(user_id=self.user_id).order_by(Reservation.id).first().id
+
+        self.visited = set()
+        request_finished.connect(self.record, app)
+
+    def tearDown(self):
+        request_finished.disconnect(self.record, app)
+        app.extensions.pop('mailer', None)
+        app.config['WTF_CSRF_ENABLED'] = True
+        db.session.rollback()
+        db.session.remove()
+
+    def record(self, sender, response, **extra):
+        from flask import request
+        self.visited.add(request.endpoint)
+
+    def call(self, key, user_id, requests):
+        '''Run (method, url, data) as the given user. Each view checks its
+        own budget; here only the status is looked at. The in-process
+        caches are emptied before every request, the budgets are for a
+        cold process.'''
+
+        with self.client as c:
+            if key is not None:
+                with c.session_transaction() as sess:
+                    sess[key] = user_id
+            for method, url, data in requests:
+                checker.bloom = None
+                fleet_schedule.forget()
+                resp = c.open(url, method=method, data=data)
+                # streamed responses (the export) run to the end here
+                resp.get_data()
+                self.assertLess(resp.status_code, 400, f'{method} {url}')
+
+
+    def test_every_route(self):
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        edit = dict(FORM, passenger_name="Edited Passenger")
+
+        self.call(None, None, [
+            ('GET', '/', None),
+            ('GET', '/about', None),
+            ('GET', '/availability?username=customer1&email=nobody@testing.org', None),
+            ('GET', '/check/customer1', None),
+            ('GET', '/verify/123-456-0002', None),
+            ('GET', '/lookup/nobody@testing.org', None),
+            ('GET', '/register', None),
+            ('POST', '/register', dict(username="newuser", password="anypassword", email="newuser@testing.org",
+                                       first_name="New", last_name="User", phone="123-456-9999")),
+            ('GET', '/login', None),
+            ('POST', '/login', dict(username="customer1", password="anypassword")),
+            ('GET', '/logout', None),
+            ('GET', '/admin/register_admin', None),
+            ('POST', '/admin/register_admin', dict(username="newadmin", password="anypassword",
+                                                   email="newadmin@testing.org", first_name="New",
+                                                   last_name="Admin", phone="123-456-8888", is_admin="y")),
+        ])
+
+        self.call(CURR_USER_KEY, self.user_id, [
+            ('GET', f'/users/{self.user_id}', None),
+            ('GET', f'/users/edit_profile/{self.user_id}', None),
+            ('POST', f'/users/edit_profile/{self.user_id}', dict(username="customer0", email="customer0@testing.org",
+                                                                first_name="Renamed", last_name="Customer0",
+                                                                phone="123-456-0001", password="anypassword")),
+            ('GET', '/res/res_form', None),
+            ('POST', '/res/res_form', FORM),
+            ('POST', '/res/res_form', dict(FORM, repeat="FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR")),
+            ('GET', f'/res/view/{self.res_id}', None),
+            ('GET', f'/res/edit_res/{self.res_id}', None),
+            ('POST', f'/res/edit_res/{self.res_id}', edit),
+            ('GET', f'/res/email_res_form/{self.res_id}', None),
+            ('POST', f'/res/email_res_form/{self.res_id}', dict(email_res="me@testing.org")),
+            ('POST', f'/res/recurring/{self.series_id}/skip', dict(day=tomorrow)),
+            ('POST', f'/res/recurring/{self.series_id}/stop', dict(day='')),
+            ('GET', '/quote?pu_lat=37.79&pu_lng=-122.40&do_lat=37.62&do_lng=-122.38', None),
+            ('GET', '/api/v1/reservations', None),
+            ('GET', '/api/v1/reservations?scope=past', None),
+            ('GET', f'/api/v1/reservations/{self.res_id}', None),
+            ('GET', f'/api/v1/users/{self.user_id}', None),
+        ])
+
+        self.call(CURR_ADMIN_KEY, self.admin_id, [
+            ('GET', '/admin/admin_home', None),
+            ('GET', '/admin/admin_home?sort=booked&dir=desc', None),
+            ('POST', '/admin/requote', dict(start=date.today().isoformat(), end=tomorrow)),
+            ('POST', '/admin/assign', dict(day=tomorrow)),
+            ('GET', '/admin/search?q=Commuter', None),
+            ('GET', '/admin/export?format=ndjson', None),
+            ('GET', f'/admin/admin_edit_res/{self.res_id}', None),
+            ('POST', f'/admin/admin_edit_res/{self.res_id}', dict(edit, trip_notes="Gate 4")),
+            ('GET', '/admin/select_user', None),
+            ('GET', f'/admin/new_res/{self.user_id}', None),
+            ('POST', f'/admin/new_res/{self.user_id}', FORM),
+            ('GET', f'/admin/import/{self.user_id}', None),
+            ('POST', f'/admin/import/{self.user_id}', dict(csv_file=(io.BytesIO(CSV.encode()), "rides.csv"))),
+            ('GET', '/api/v1/reservations', None),
+            ('GET', '/api/v1/users', None),
+            ('GET', '/api/v1/pool', None),
+            ('GET', '/metrics', None),
+        ])
+
+        # 404 until the assets are built
+        self.assertIn(self.client.get('/static/dist/style.css').status_code, (200, 404))
+
+        self.assertEqual(set(app.view_functions) - self.visited, {'static'})
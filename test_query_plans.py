@@ -0,0 +1,160 @@
+'''Query plan regression tests
+
+Seeds the test database, runs the hot routes and EXPLAINs every SELECT they
+issue. A test fails if a plan reads a table holding more than
+PLAN_MAX_SEQ_SCAN_ROWS rows with a sequential scan.'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_query_plans.py
+#seed size and threshold: PLAN_SEED_USERS, PLAN_SEED_RES_PER_USER, PLAN_MAX_SEQ_SCAN_ROWS
+
+import os
+import json
+from unittest import TestCase, skipUnless
+from datetime import date, time, timedelta, datetime
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db, bcrypt, FleetCapacity, Reservation, User
+
+from app import CURR_USER_KEY, CURR_ADMIN_KEY, create_app
+from availability import checker
+from fleet import reserve
+
+app = create_app('testing')
+
+SEED_USERS = int(os.environ.get('PLAN_SEED_USERS', 200))
+SEED_RES_PER_USER = int(os.environ.get('PLAN_SEED_RES_PER_USER', 100))
+MAX_SEQ_SCAN_ROWS = int(os.environ.get('PLAN_MAX_SEQ_SCAN_ROWS', 1000))
+
+
+@contextmanager
+def captured_selects():
+    '''Collect (statement, parameters) for every SELECT run inside the block.'''
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+
+def seq_scans(plan):
+    '''Yield the table name of every Seq Scan node in a JSON plan.'''
+
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+@skipUnless(app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'), 'EXPLAIN output is Postgres specific')
+class QueryPlanTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        db.drop_all()
+        db.create_all()
+
+        today = date.today()
+        password = bcrypt.generate_password_hash('anypassword').decode('UTF-8')
+
+        users = [dict(username=f'planuser{n}', password=password, email=f'plan{n}@testing.org',
+                      first_name='Plan', last_name='User', phone=f'555-{n:07d}',
+                      is_admin=False, member_since=datetime.utcnow())
+                 for n in range(SEED_USERS)]
+        db.session.execute(User.__table__.insert(), users)
+
+        user_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+        rows = []
+        for n, user_id in enumerate(user_ids):
+            for k in range(SEED_RES_PER_USER):
+                rows.append(dict(
+                    passenger_name='Plan Passenger', passenger_phone='987-654-3210',
+                    vehicle_type='Sedan (up to 4 passengers)',
+                    PU_date=today + timedelta(days=(n + k) % 730 - 365),
+                    PU_time=time((n + k) % 24, k % 60),
+                    PU_address='123 Main Street, San Francisco, CA, 94104',
+                    DO_address='101 California Street, San Francisco, CA 94104',
+                    created_date=datetime.utcnow(), user_id=user_id,
+                ))
+        db.session.execute(Reservation.__table__.insert(), rows)
+        db.session.commit()
+        db.session.execute('ANALYZE')
+
+        cls.user_id = user_ids[len(user_ids) // 2]
+        cls.res_id = db.session.query(Reservation.id).filter_by(user_id=cls.user_id).first()[0]
+        cls.username = f'planuser{len(user_ids) // 2}'
+        db.session.remove()
+
+    def setUp(self):
+        self.client = app.test_client()
+
+        # the availability Bloom filter reads the whole users table by design,
+        # build it up front so only the per-request EXISTS queries are checked
+        checker.rebuild()
+        checker.taken.entries.clear()
+
+    def assertNoLargeSeqScan(self, url, **sess_values):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess.update(sess_values)
+
+            with captured_selects() as statements:
+                resp = c.get(url)
+
+        self.assertLess(resp.status_code, 400)
+        self.assertPlans(url, statements)
+
+    def assertPlans(self, url, statements):
+        self.assertTrue(statements, f'{url} ran no queries')
+
+        for statement, parameters in statements:
+            with db.engine.connect() as conn:
+                plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+
+                for table in seq_scans(plan[0]['Plan']):
+                    rows = conn.exec_driver_sql('SELECT reltuples FROM pg_class WHERE relname = %(table)s',
+                                                {'table': table}).scalar()
+                    self.assertLessEqual(
+                        rows, MAX_SEQ_SCAN_ROWS,
+                        f'{url}: sequential scan of {table} (~{rows:.0f} rows) in\n{statement}')
+
+
+    def test_user_dashboard_plan(self):
+        self.assertNoLargeSeqScan(f'/users/{self.user_id}', **{CURR_USER_KEY: self.user_id})
+
+    def test_admin_home_plan(self):
+        self.assertNoLargeSeqScan('/admin/admin_home', **{CURR_ADMIN_KEY: self.user_id})
+
+    def test_view_res_plan(self):
+        self.assertNoLargeSeqScan(f'/res/view/{self.res_id}', **{CURR_USER_KEY: self.user_id})
+
+    def test_username_check_plan(self):
+        self.assertNoLargeSeqScan(f'/check/{self.username}')
+
+    def test_phone_check_plan(self):
+        self.assertNoLargeSeqScan('/verify/555-0000001')
+
+    def test_email_check_plan(self):
+        self.assertNoLargeSeqScan('/lookup/plan1@testing.org')
+
+    def test_fleet_reserve_plan(self):
+        "Does the capacity check read the trips' pickup windows through an index?"
+
+        db.session.add(FleetCapacity(vehicle_type='Sedan (up to 4 passengers)', vehicles=3))
+        db.session.flush()
+        try:
+            with captured_selects() as statements:
+                reserve([('Sedan (up to 4 passengers)', date.today(), time(hour, 30)) for hour in (0, 9, 17)])
+            self.assertPlans('fleet.reserve()', statements)
+        finally:
+            db.session.rollback()
@@ -0,0 +1,146 @@
+'''Testing for fare quotes'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_quotes.py
+
+from unittest import TestCase
+from datetime import date, time
+
+import numpy as np
+
+from models import db, Address, Reservation, User
+
+from app import CURR_USER_KEY, create_app
+from quotes import copy_rows, quote, quote_trip, requote
+from geocoding import geocode_missing
+from bench_quotes import batch, copy_data, loop, random_trips
+
+app = create_app('testing')
+
+db.create_all()
+
+SEDAN = "Sedan (up to 4 passengers)"
+
+# Union Square to SFO
+UNION_SQUARE = (37.7880, -122.4075)
+SFO = (37.6152, -122.3899)
+
+
+class QuoteTestCase(TestCase):
+
+    def test_batch_matches_loop(self):
+        "Does the array path quote every trip like the one-at-a-time loop?"
+
+        rows = random_trips(500)
+        miles, fares = batch(copy_data(rows))
+
+        for (_, looped), f in zip(loop(rows), fares):
+            self.assertAlmostEqual(f, looped, delta=0.011)
+
+
+    def test_copy_rows(self):
+        "Is a binary COPY from Postgres read into columns as sent?"
+
+        rows = random_trips(3)
+        columns = copy_rows(copy_data(rows))
+
+        self.assertEqual(columns['id'].tolist(), [1, 2, 3])
+        self.assertEqual(columns['hour'].tolist(), [row[2] for row in rows])
+        self.assertEqual(columns['do_lng'].tolist(), [row[6] for row in rows])
+        with self.assertRaises(ValueError):
+            copy_rows(b'1,2,3\n')
+
+
+    def test_airport_trip(self):
+        miles, fare = quote_trip(*UNION_SQUARE, *SFO, SEDAN, time(12, 0))
+
+        # 12 miles as the crow flies
+        self.assertAlmostEqual(miles, 12.0 * 1.3, delta=0.5)
+        # base + per mile + SFO zone fee
+        self.assertAlmostEqual(fare, 15 + 3 * miles + 10, delta=0.5)
+
+        _, night_fare = quote_trip(*UNION_SQUARE, *SFO, SEDAN, time(23, 30))
+        self.assertGreater(night_fare, fare)
+
+
+    def test_minimum_and_unknown(self):
+        miles, fares = quote([37.78, 37.78], [-122.40, -122.40], [37.79, 37.79], [-122.41, -122.41],
+                             [SEDAN, "Helicopter"], [12, 12])
+        self.assertEqual(fares[0], 45.0)
+        self.assertTrue(np.isnan(fares[1]))
+
+
+class RequoteTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        db.session.commit()
+        self.user_id = user.id
+
+        for n in range(5):
+            db.session.add(Reservation(passenger_name="Test User",
+                                       passenger_phone="987-654-3210",
+                                       vehicle_type=SEDAN,
+                                       PU_date=date(2022, 7, 15 + n),
+                                       PU_time=time(9, 0),
+                                       PU_address="Union Square",
+                                       PU_street="333 Post St",
+                                       PU_city="San Francisco",
+                                       DO_address="SFO",
+                                       DO_street="San Francisco International Airport",
+                                       DO_city="San Francisco",
+                                       user_id=self.user_id))
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+    def lookup(self, locations):
+        return [UNION_SQUARE if "Post St" in location else SFO for location in locations]
+
+
+    def test_geocode_then_requote(self):
+        "Are only geocoded trips in the window quoted?"
+
+        self.assertEqual(requote(date(2022, 7, 1), date(2022, 7, 31)), 0)
+
+        self.assertEqual(geocode_missing(lookup=self.lookup), 2)
+        self.assertEqual(Address.query.filter(Address.latitude == None).count(), 0)
+
+        self.assertEqual(requote(date(2022, 7, 16), date(2022, 7, 17)), 2)
+
+        quoted = Reservation.query.filter(Reservation.quoted_fare != None).all()
+        self.assertEqual(sorted(res.PU_date.day for res in quoted), [16, 17])
+        _, fare = quote_trip(*UNION_SQUARE, *SFO, SEDAN, time(9, 0))
+        self.assertAlmostEqual(float(quoted[0].quoted_fare), fare, places=2)
+
+
+    def test_quote_route(self):
+        with self.client as c:
+            resp = c.get('/quote')
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get('/quote', query_string=dict(pu_lat=UNION_SQUARE[0], pu_lng=UNION_SQUARE[1],
+                                                     do_lat=SFO[0], do_lng=SFO[1],
+                                                     vehicle_type=SEDAN, time="12:00"))
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreater(resp.json["fare"], 45)
+
+            resp = c.get('/quote', query_string=dict(pu_lat="x"))
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,211 @@
+'''Testing for repeating reservations'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_recurrence.py
+
+from itertools import islice
+from unittest import TestCase
+from datetime import date, time, timedelta
+
+from models import db, FleetCapacity, RecurringReservation, RecurrenceException, Reservation, SmsOutbox, User
+
+from app import CURR_USER_KEY, create_app
+from recurrence import (occurrences, parse_rule, describe_rule, start_series, skip_day, stop_series,
+                        materialize, expand, RECURRING_HORIZON_DAYS)
+
+app = create_app('testing')
+
+db.create_all()
+
+WEEKDAYS = "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"
+
+TRIP = dict(passenger_name="Commuter",
+            passenger_phone="4155550100",
+            passenger_email=None,
+            vehicle_type="Sedan (up to 4 passengers)",
+            PU_date=date(2022, 7, 15),
+            PU_time=time(8, 0),
+            PU_address="Home",
+            PU_street="1 Main St",
+            PU_city="San Francisco",
+            PU_state="CA",
+            PU_zip="94105",
+            PU_country="US",
+            DO_address="Work",
+            DO_street="333 Post St",
+            DO_city="San Francisco",
+            DO_state="CA",
+            DO_zip="94108",
+            DO_country="US",
+            trip_notes=None)
+
+
+class OccurrencesTestCase(TestCase):
+
+    def test_weekdays(self):
+        # 2022-07-15 is a Friday
+        days = list(occurrences(WEEKDAYS, date(2022, 7, 15), end=date(2022, 7, 22)))
+        self.assertEqual(days, [date(2022, 7, d) for d in (15, 18, 19, 20, 21, 22)])
+
+
+    def test_interval_count_until_and_skip(self):
+        self.assertEqual(list(occurrences("FREQ=DAILY;INTERVAL=3;COUNT=4", date(2022, 7, 1))),
+                         [date(2022, 7, d) for d in (1, 4, 7, 10)])
+        # skipped days still count towards COUNT
+        self.assertEqual(list(occurrences("FREQ=DAILY;COUNT=3", date(2022, 7, 1), skip={date(2022, 7, 2)})),
+                         [date(2022, 7, 1), date(2022, 7, 3)])
+        self.assertEqual(list(occurrences("FREQ=WEEKLY;INTERVAL=2;UNTIL=20220801", date(2022, 7, 4))),
+                         [date(2022, 7, 4), date(2022, 7, 18), date(2022, 8, 1)])
+        self.assertEqual(list(occurrences("FREQ=WEEKLY", date(2022, 7, 4), until=date(2022, 7, 17))),
+                         [date(2022, 7, 4), date(2022, 7, 11)])
+
+
+    def test_window_matches_full_expansion(self):
+        "Does jumping to a window give the same days as walking up to it?"
+
+        start, end = date(2031, 3, 3), date(2031, 4, 20)
+        for rule in (WEEKDAYS, "FREQ=WEEKLY;INTERVAL=3;BYDAY=TU,SA", "FREQ=DAILY;INTERVAL=5"):
+            walked = [day for day in islice(occurrences(rule, date(2022, 7, 15)), 5000) if start <= day <= end]
+            self.assertEqual(list(occurrences(rule, date(2022, 7, 15), start, end)), walked)
+
+
+    def test_lazy_forever(self):
+        days = occurrences(WEEKDAYS, date(2022, 7, 15), start=date(9000, 1, 1))
+        self.assertEqual(len(list(islice(days, 3))), 3)
+
+
+    def test_rules(self):
+        self.assertEqual(parse_rule(WEEKDAYS).weekdays, (0, 1, 2, 3, 4))
+        self.assertEqual(describe_rule(WEEKDAYS), "Every weekday")
+        self.assertEqual(describe_rule("FREQ=WEEKLY;INTERVAL=2;BYDAY=TH,MO"), "Every 2 weeks on Mon, Thu")
+        for bad in ("FREQ=YEARLY", "FREQ=WEEKLY;BYDAY=XX", "FREQ=DAILY;BYHOUR=8", "FREQ=DAILY;INTERVAL=0"):
+            with self.assertRaises(ValueError):
+                parse_rule(bad)
+
+
+class RecurringReservationTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        app.config['WTF_CSRF_ENABLED'] = True
+        return res
+
+    def book(self, rule=WEEKDAYS, **changes):
+        series, first = start_series(self.user_id, dict(TRIP, **changes), rule)
+        db.session.commit()
+        return series, first
+
+
+    def test_materialize_horizon(self):
+        "Are rows made up to the horizon only, and only once?"
+
+        series, first = self.book()
+        self.assertEqual(first.PU_date, date(2022, 7, 15))
+        self.assertEqual(first.recurring_id, series.id)
+
+        self.assertEqual(materialize(through=date(2022, 7, 22)), 5)
+        self.assertEqual(materialize(through=date(2022, 7, 22)), 0)
+        self.assertEqual(materialize(through=date(2022, 7, 26)), 2)
+
+        trips = Reservation.query.order_by(Reservation.PU_date).all()
+        self.assertEqual([res.PU_date.day for res in trips], [15, 18, 19, 20, 21, 22, 25, 26])
+        self.assertTrue(all(res.PU_address_id is not None for res in trips))
+        self.assertEqual(trips[-1].passenger_name, "Commuter")
+        self.assertEqual(trips[-1].PU_time, time(8, 0))
+
+
+    def test_skip_and_stop(self):
+        series, _ = self.book()
+        materialize(through=date(2022, 7, 22))
+
+        skip_day(series, date(2022, 7, 19))
+        # not made yet: only the exception is kept
+        skip_day(series, date(2022, 7, 27))
+        db.session.commit()
+
+        self.assertIsNone(Reservation.query.filter_by(PU_date=date(2022, 7, 19)).first())
+        self.assertEqual(RecurrenceException.query.count(), 2)
+
+        materialize(through=date(2022, 7, 29))
+        days = {res.PU_date.day for res in Reservation.query}
+        self.assertNotIn(27, days)
+        self.assertIn(28, days)
+
+        stop_series(series, date(2022, 7, 20))
+        db.session.commit()
+        self.assertEqual(max(res.PU_date for res in Reservation.query), date(2022, 7, 20))
+        self.assertEqual(materialize(through=date(2022, 8, 31)), 0)
+
+        merged = [occurrence.day for occurrence in expand([series], date(2022, 7, 1))]
+        self.assertEqual(merged, [date(2022, 7, d) for d in (15, 18, 20)])
+
+
+    def test_count_rule_ends(self):
+        series, _ = self.book("FREQ=DAILY;COUNT=3")
+        self.assertEqual(series.until, date(2022, 7, 17))
+        self.assertEqual(materialize(through=date(2022, 8, 31)), 2)
+
+
+    def test_materialize_skips_full_days(self):
+        "Is a day with every vehicle of the type booked skipped instead of overbooked?"
+
+        series, _ = self.book()
+        db.session.add(FleetCapacity(vehicle_type=TRIP['vehicle_type'], vehicles=1))
+        db.session.add(Reservation(**dict(TRIP, PU_date=date(2022, 7, 19), PU_time=time(8, 30),
+                                          user_id=self.user_id)))
+        db.session.commit()
+
+        self.assertEqual(materialize(through=date(2022, 7, 22)), 4)
+
+        series = RecurringReservation.query.get(series.id)
+        self.assertEqual(series.skipped, {date(2022, 7, 19)})
+        self.assertEqual(Reservation.query.filter_by(PU_date=date(2022, 7, 19)).count(), 1)
+
+
+    def test_res_form_repeat(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        start = date.today() + timedelta(days=1)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            data = {name: value for name, value in TRIP.items() if value is not None}
+            data.update(PU_date=start.isoformat(), PU_time="08:00", repeat="FREQ=DAILY")
+            resp = c.post('/res/res_form', data=data, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Repeating Trips', html)
+            self.assertIn('Every day', html)
+
+            series = RecurringReservation.query.one()
+            self.assertEqual(series.trip["DO_street"], "333 Post St")
+            # the first trip plus the rest of the horizon, nothing further out
+            self.assertEqual(Reservation.query.count(), RECURRING_HORIZON_DAYS)
+            self.assertEqual(SmsOutbox.query.count(), 1)
+
+            resp = c.post(f'/res/recurring/{series.id}/skip', data={'day': start.isoformat()})
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Reservation.query.count(), RECURRING_HORIZON_DAYS - 1)
+
+            data.update(repeat_until=(start - timedelta(days=1)).isoformat())
+            resp = c.post('/res/res_form', data=data)
+            self.assertIn('Must be on or after the pick-up date.', resp.get_data(as_text=True))
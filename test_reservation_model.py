@@ -2,16 +2,15 @@
 
 #to run these tests us: FLASK_ENV=production python -m unittest test_reservation_model.py
 
-import os 
 from unittest import TestCase
 from werkzeug.exceptions import Unauthorized
+from datetime import date, time, timedelta
 
 from models import db, Reservation, User
 
-#Before importing the app.py, create an evironmental var to use a different database for tests
-os.environ['DATABASE_URL'] = "postgresql:///book_a_ride_test"
+from app import CURR_USER_KEY, create_app
 
-from app import CURR_USER_KEY, app
+app = create_app('testing')
 
 db.create_all()
 
@@ -95,9 +94,90 @@ class ReservationModelTestCase(TestCase):
             self.assertEqual(resp.status_code, 404) #Unauthorized
 
 
+    def make_res(self, user_id, PU_date, PU_time=time(10, 0)):
+        res = Reservation(
+                passenger_name="Test User",
+                passenger_phone="987-654-3210",
+                vehicle_type="Sedan",
+                PU_time=PU_time,
+                PU_date=PU_date,
+                PU_address="123 Main Street, San Francisco, CA, 94104",
+                DO_address="101 California Street, San Francisco, CA 94104",
+                user_id=user_id,
+        )
+        db.session.add(res)
+        return res
+
+
+    def test_dashboard_only_own_reservations(self):
+        "Does the dashboard only list the logged in user's trips, split into upcoming and past?"
+
+        other = User.register(username="otheruser",
+                            password="anypassword",
+                            email="other@testing.org",
+                            first_name="Other",
+                            last_name="User",
+                            phone="111-456-7890")
+        db.session.commit()
+
+        mine_next = self.make_res(self.testuser_id, date.today() + timedelta(days=2))
+        mine_past = self.make_res(self.testuser_id, date.today() - timedelta(days=2))
+        theirs = self.make_res(other.id, date.today() + timedelta(days=2))
+        db.session.commit()
+
+        mine_next_id = mine_next.id
+        theirs_id = theirs.id
 
+        upcoming, next_cursor = Reservation.user_trips(self.testuser_id, upcoming=True)
+        past, _ = Reservation.user_trips(self.testuser_id, upcoming=False)
 
-  
-                
+        self.assertEqual([r.id for r in upcoming], [mine_next_id])
+        self.assertEqual([r.id for r in past], [mine_past.id])
+        self.assertIsNone(next_cursor)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f'/users/{self.testuser_id}')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'/res/view/{mine_next_id}"', html)
+            self.assertNotIn(f'/res/view/{theirs_id}"', html)
+
+
+    def test_dashboard_keyset_pages(self):
+        "Do the keyset pages cover every trip exactly once, in pickup order?"
+
+        for day in range(25):
+            self.make_res(self.testuser_id, date.today() + timedelta(days=day))
+        db.session.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = Reservation.user_trips(self.testuser_id, cursor=cursor, per_page=10)
+            seen.extend(page)
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(r.id for r in seen)), 25)
+        self.assertEqual([r.PU_date for r in seen], sorted(r.PU_date for r in seen))
+
+
+    def test_dispatch_board_window(self):
+        "Does the dispatch board only load pick-ups inside the date window, with the customer attached?"
+
+        inside = self.make_res(self.testuser_id, date.today() + timedelta(days=3))
+        self.make_res(self.testuser_id, date.today() + timedelta(days=30))
+        self.make_res(self.testuser_id, date.today() - timedelta(days=1))
+        db.session.commit()
 
+        board, next_cursor = Reservation.dispatch_board()
 
+        self.assertEqual([r.id for r in board], [inside.id])
+        self.assertIsNone(next_cursor)
+        self.assertIn('user', board[0].__dict__) # loaded with the reservation, not lazily
+        self.assertEqual(board[0].user.first_name, "Test")
@@ -0,0 +1,128 @@
+'''Testing for reservation search'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_search.py
+
+from unittest import TestCase
+from datetime import date, time
+
+from models import db, Reservation, User
+
+from app import CURR_ADMIN_KEY, CURR_USER_KEY, create_app
+from search import search_reservations, fts5_query
+
+app = create_app('testing')
+
+db.create_all()
+
+PASSENGERS = ["John Smith", "Jane Doe", "Johnny Cash", "Mary Poppins"]
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.register(username="testuser",
+                             password="anypassword",
+                             email="test@testing.org",
+                             first_name="Test",
+                             last_name="User",
+                             phone="123-456-7890")
+        admin = User.registerAdmin(username="testadmin",
+                                   password="anypassword",
+                                   email="admin@testing.org",
+                                   first_name="Test",
+                                   last_name="Admin",
+                                   phone="123-456-7891",
+                                   is_admin=True)
+        db.session.commit()
+        self.user_id = user.id
+        self.admin_id = admin.id
+
+        for n in range(20):
+            db.session.add(Reservation(passenger_name=PASSENGERS[n % 4],
+                                       passenger_phone=f"555-000-{n:04d}",
+                                       vehicle_type="Sedan (up to 4 passengers)",
+                                       PU_date=date(2022, 7, 15),
+                                       PU_time=time(9, 0),
+                                       PU_address=f"{n} Market St, {'San Francisco' if n % 2 else 'Oakland'}",
+                                       DO_address="SFO Airport",
+                                       user_id=self.user_id))
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+
+    def test_fts5_query(self):
+        self.assertEqual(fts5_query('john  "smith'), '"john"* "smith"*')
+        self.assertEqual(fts5_query('!!'), '')
+
+
+    def test_search_by_name(self):
+        "Does a partial first name find every matching passenger?"
+
+        found, has_more = search_reservations("john")
+        self.assertFalse(has_more)
+        self.assertEqual({res.passenger_name for res in found}, {"John Smith", "Johnny Cash"})
+        self.assertEqual(len(found), 10)
+
+
+    def test_search_pages(self):
+        "Are results paged and the customer loaded with them?"
+
+        first, has_more = search_reservations("oakland", page=1, per_page=4)
+        self.assertTrue(has_more)
+        self.assertEqual(len(first), 4)
+        self.assertEqual(first[0].user.username, "testuser")
+
+        rest, has_more = search_reservations("oakland", page=3, per_page=4)
+        self.assertFalse(has_more)
+        self.assertEqual(len(rest), 2)
+        self.assertFalse({res.id for res in first} & {res.id for res in rest})
+
+
+    def test_search_sees_edits(self):
+        "Is an edited reservation found under its new passenger name?"
+
+        res = Reservation.query.filter_by(passenger_name="Mary Poppins").first()
+        res.passenger_name = "Zed Zebra"
+        db.session.commit()
+
+        found, _ = search_reservations("zebra")
+        self.assertEqual([r.id for r in found], [res.id])
+
+
+    def test_search_by_res_number(self):
+        res = Reservation.query.first()
+        found, _ = search_reservations(str(res.id))
+        self.assertEqual(found[0].id, res.id)
+
+
+    def test_search_odd_numbers(self):
+        "Are digits int() refuses and numbers too big for an id searched as text?"
+
+        self.assertEqual(search_reservations("²"), ([], False))
+        self.assertEqual(search_reservations("9" * 30), ([], False))
+
+
+    def test_search_route(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            resp = c.get('/admin/search?q=mary')
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                del sess[CURR_USER_KEY]
+                sess[CURR_ADMIN_KEY] = self.admin_id
+            resp = c.get('/admin/search?q=mary')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_data(as_text=True).count('/res/view/'), 5)
@@ -0,0 +1,137 @@
+'''Testing for the SMS outbox and worker'''
+
+#to run these tests us: FLASK_ENV=production python -m unittest test_sms_outbox.py
+
+from unittest import TestCase
+from datetime import datetime, timedelta
+
+from models import db, SmsOutbox
+
+from app import create_app
+from sms import FakeProvider
+from sms_worker import drain_once, backoff, RateLimiter
+
+
+class Crash(BaseException):
+    '''The worker process dying, not a failed send.'''
+
+
+class CrashingProvider(FakeProvider):
+    '''Sends `count` messages, then the worker dies.'''
+
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def send(self, to, body):
+        if len(self.sent) == self.count:
+            raise Crash()
+        super().send(to, body)
+
+app = create_app('testing')
+
+db.create_all()
+
+class SmsOutboxTestCase(TestCase):
+
+    def setUp(self):
+
+        db.drop_all()
+        db.create_all()
+
+        self.message = SmsOutbox.queue(to="+15555555555", body="Thank you!")
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+
+    def test_drain_sends_pending(self):
+        "Does the worker send pending messages and mark them sent?"
+
+        provider = FakeProvider()
+
+        self.assertEqual(drain_once(provider), 1)
+        self.assertEqual(provider.sent, [("+15555555555", "Thank you!")])
+
+        msg = SmsOutbox.query.get(self.message.id)
+        self.assertEqual(msg.status, SmsOutbox.SENT)
+        self.assertIsNotNone(msg.sent_at)
+
+        # nothing left to send
+        self.assertEqual(drain_once(provider), 0)
+
+
+    def test_failed_send_backs_off(self):
+        "Is a failed send retried later instead of right away?"
+
+        provider = FakeProvider(fail_with=RuntimeError("provider down"))
+        drain_once(provider)
+
+        msg = SmsOutbox.query.get(self.message.id)
+        self.assertEqual(msg.status, SmsOutbox.PENDING)
+        self.assertEqual(msg.attempts, 1)
+        self.assertEqual(msg.last_error, "provider down")
+        self.assertGreater(msg.next_attempt_at, datetime.utcnow())
+
+        # not due yet, so the next drain skips it
+        self.assertEqual(drain_once(provider), 0)
+
+
+    def test_gives_up_after_max_attempts(self):
+        "Is a message marked failed after too many attempts?"
+
+        provider = FakeProvider(fail_with=RuntimeError("provider down"))
+        drain_once(provider, max_attempts=1)
+
+        msg = SmsOutbox.query.get(self.message.id)
+        self.assertEqual(msg.status, SmsOutbox.FAILED)
+
+
+    def test_crash_keeps_sent_messages(self):
+        "Does a worker dying halfway through a batch keep what it already sent?"
+
+        second = SmsOutbox.queue(to="+15555555556", body="Thank you too!")
+        db.session.commit()
+
+        with self.assertRaises(Crash):
+            drain_once(CrashingProvider(1))
+        db.session.rollback()
+
+        self.assertEqual(SmsOutbox.query.get(self.message.id).status, SmsOutbox.SENT)
+        self.assertEqual(SmsOutbox.query.get(second.id).status, SmsOutbox.SENDING)
+
+        # still claimed by the dead worker
+        provider = FakeProvider()
+        self.assertEqual(drain_once(provider), 0)
+
+        # once the claim runs out it is sent, and only it
+        SmsOutbox.query.get(second.id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(drain_once(provider), 1)
+        self.assertEqual(provider.sent, [("+15555555556", "Thank you too!")])
+
+
+    def test_backoff_doubles(self):
+        self.assertEqual(backoff(1, base=30), timedelta(seconds=30))
+        self.assertEqual(backoff(3, base=30), timedelta(seconds=120))
+
+
+    def test_rate_limiter(self):
+        "Does the rate limiter wait between sends?"
+
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.acquire()
+
+        self.assertEqual(waits, [0.5, 0.5])
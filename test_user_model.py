@@ -2,16 +2,16 @@
 
 #to run these tests us: FLASK_ENV=production python -m unittest test_user_model.py
 
-import os 
 from unittest import TestCase
 from sqlalchemy import exc
 
 from models import db, User
+from identity import load_profile, forget_profile, profile_cache
+from passwords import bcrypt, password_service, hash_rounds, PasswordService, PasswordServiceBusy
 
-#Before importing the app.py, create an evironmental var to use a different database for tests
-os.environ['DATABASE_URL'] = "postgresql:///book_a_ride_test"
+from app import create_app
 
-from app import app
+app = create_app('testing')
 
 db.create_all()
 
@@ -143,4 +143,45 @@ class UserModelTestCase(TestCase):
         self.assertFalse(User.authenticate('badusername', 'password'))
 
     def test_wrong_password(self):
-        self.assertFalse(User.authenticate(self.user1.username, 'wrongpassword'))
\ No newline at end of file
+        self.assertFalse(User.authenticate(self.user1.username, 'wrongpassword'))
+
+    def test_rehash_on_login(self):
+        "Is a hash made with an old work factor upgraded when the user logs in?"
+
+        self.user1.password = bcrypt.generate_password_hash('old-cost-password', 4).decode('UTF-8')
+        db.session.commit()
+
+        u = User.authenticate(self.user1.username, 'old-cost-password')
+        self.assertTrue(u)
+        self.assertEqual(hash_rounds(u.password), password_service.rounds)
+        self.assertTrue(bcrypt.check_password_hash(u.password, 'old-cost-password'))
+
+    def test_unknown_user_runs_dummy_check(self):
+        self.assertFalse(User.authenticate('nobody', 'anypassword'))
+        self.assertIsNotNone(password_service._dummy)
+
+    def test_password_pool_full(self):
+        "Are hashes refused instead of queued when the pool is full?"
+
+        service = PasswordService(rounds=4, workers=1, max_pending=1)
+        service.slots.acquire()
+
+        with self.assertRaises(PasswordServiceBusy):
+            service.hash('anypassword')
+
+    def test_profile_cache(self):
+        "Is the current user's profile cached, without the password, until it changes?"
+
+        profile_cache.entries.clear()
+
+        profile = load_profile(self.user1id)
+        self.assertEqual(profile.first_name, 'Test')
+        self.assertFalse(hasattr(profile, 'password'))
+
+        self.user1.first_name = 'Changed'
+        db.session.commit()
+        self.assertEqual(load_profile(self.user1id).first_name, 'Test')
+
+        forget_profile(self.user1id)
+        self.assertEqual(load_profile(self.user1id).first_name, 'Changed')
+        self.assertIsNone(load_profile(12345))